@@ -0,0 +1,6 @@
+"""Офлайн бенчмарки API и фоновых обработчиков.
+
+Внешние клиенты (GigaChat, Elasticsearch, сервис эмбеддингов) заменяются
+детерминированными заглушками с настраиваемой задержкой, Redis и SQLite
+используются настоящие. Запуск: ``python -m benchmarks --help``.
+"""
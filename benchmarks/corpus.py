@@ -0,0 +1,109 @@
+"""Синтетические PDF и DOCX документы для бенчмарков индексации"""
+
+import random
+import zipfile
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import pymupdf
+
+from .fakes import VOCABULARY
+
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""  # noqa: E501
+
+DOCX_RELATIONSHIPS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""  # noqa: E501
+
+DOCX_DOCUMENT_RELATIONSHIPS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"/>"""
+
+DOCX_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def generate_sections(
+        rng: random.Random, sections: int, paragraphs: int, words: int
+) -> list[tuple[str, list[str]]]:
+    """Генерирует разделы документа: заголовок и абзацы из случайных слов словаря"""
+    return [
+        (
+            f"Раздел {i + 1}: {' '.join(rng.choices(VOCABULARY, k=3))}",
+            [" ".join(rng.choices(VOCABULARY, k=words)) + "." for _ in range(paragraphs)],
+        )
+        for i in range(sections)
+    ]
+
+
+def write_pdf(path: Path, sections: list[tuple[str, list[str]]]) -> None:
+    document = pymupdf.open()
+    for title, paragraphs in sections:
+        page = document.new_page()
+        rect = pymupdf.Rect(50, 50, page.rect.width - 50, page.rect.height - 50)
+        page.insert_htmlbox(
+            rect, f"<h1>{escape(title)}</h1>" + "".join(f"<p>{escape(p)}</p>" for p in paragraphs)
+        )
+    document.save(path)
+    document.close()
+
+
+def build_docx_paragraph(text: str, style: str | None = None) -> str:
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f'<w:p>{properties}<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def write_docx(path: Path, sections: list[tuple[str, list[str]]]) -> None:
+    body = "".join(
+        build_docx_paragraph(title, style="Heading1")
+        + "".join(build_docx_paragraph(paragraph) for paragraph in paragraphs)
+        for title, paragraphs in sections
+    )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:document xmlns:w="{DOCX_NAMESPACE}"><w:body>{body}</w:body></w:document>'
+    )
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        docx.writestr("_rels/.rels", DOCX_RELATIONSHIPS)
+        docx.writestr("word/_rels/document.xml.rels", DOCX_DOCUMENT_RELATIONSHIPS)
+        docx.writestr("word/document.xml", document)
+
+
+def generate_corpus(
+        directory: Path,
+        count: int,
+        extensions: tuple[str, ...] = ("pdf", "docx"),
+        sections: int = 8,
+        paragraphs: int = 6,
+        words: int = 60,
+        seed: int = 42,
+) -> list[Path]:
+    """Создаёт детерминированный корпус документов, чередуя форматы.
+
+    :param directory: Директория для файлов.
+    :param count: Количество документов.
+    :param extensions: Форматы документов.
+    :param sections: Количество разделов (h1 заголовков) в документе.
+    :param paragraphs: Количество абзацев в разделе.
+    :param words: Количество слов в абзаце.
+    :param seed: Зерно генератора, одинаковое зерно даёт одинаковый корпус.
+    :return Пути до созданных файлов.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)  # noqa: S311
+    paths: list[Path] = []
+    for i in range(count):
+        extension = extensions[i % len(extensions)]
+        path = directory / f"document-{i:04d}.{extension}"
+        content = generate_sections(rng, sections, paragraphs, words)
+        if extension == "pdf":
+            write_pdf(path, content)
+        else:
+            write_docx(path, content)
+        paths.append(path)
+    return paths
@@ -0,0 +1,415 @@
+"""Детерминированные заглушки внешних клиентов с настраиваемой задержкой"""
+
+from typing import Any, ClassVar
+
+import asyncio
+import hashlib
+import json
+import math
+import operator
+import re
+import time
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+from urllib.parse import parse_qs, urlsplit
+
+from elastic_transport import ApiResponseMeta, BaseAsyncNode, HttpHeaders
+from elastic_transport._node import NodeApiResponse  # noqa: PLC2701
+from elasticsearch import AsyncElasticsearch
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import (
+    agenerate_from_stream,
+    generate_from_stream,
+)
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+FAKE_ELASTICSEARCH_URL = "http://fake-elasticsearch:9200"
+
+WORD_PATTERN = re.compile(r"\w+")
+
+VOCABULARY: tuple[str, ...] = (
+    "документ", "запрос", "ответ", "контекст", "модель", "индекс", "поиск", "данные",
+    "система", "пользователь", "результат", "значение", "параметр", "процесс", "сервис",
+    "база", "знаний", "вектор", "текст", "агент",
+)
+
+
+@dataclass(frozen=True)
+class FakeLatency:
+    """Задержки заглушек в секундах.
+
+    :param embeddings: Задержка одного запроса эмбеддингов.
+    :param embeddings_per_text: Дополнительная задержка на каждый текст в запросе.
+    :param llm_first_token: Задержка до первого токена ответа LLM.
+    :param llm_token: Задержка между токенами ответа LLM.
+    :param search: Задержка поискового запроса к Elasticsearch.
+    :param bulk: Задержка bulk запроса к Elasticsearch.
+    """
+
+    embeddings: float = 0.01
+    embeddings_per_text: float = 0.001
+    llm_first_token: float = 0.3
+    llm_token: float = 0.01
+    search: float = 0.02
+    bulk: float = 0.05
+
+
+def hash_to_int(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+class FakeEmbeddings(Embeddings):
+    """Эмбеддинги на основе хэширования слов (feature hashing).
+
+    Одинаковые тексты всегда получают одинаковые векторы, а тексты с общими
+    словами - близкие, поэтому семантический кэш и поиск ведут себя правдоподобно.
+    """
+
+    def __init__(self, dims: int = 384, latency: FakeLatency | None = None) -> None:
+        self.dims = dims
+        self.latency = latency or FakeLatency()
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dims
+        for word in WORD_PATTERN.findall(text.lower()):
+            value = hash_to_int(word)
+            vector[value % self.dims] += 1.0 if value & 1 << 32 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def _delay(self, count: int) -> float:
+        return self.latency.embeddings + self.latency.embeddings_per_text * count
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self._delay(len(texts)))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self._delay(len(texts)))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Чат модель, потоково отдающая детерминированный ответ по хэшу промпта"""
+
+    response_tokens: int = 64
+    latency: FakeLatency = FakeLatency()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _build_tokens(self, messages: list[BaseMessage]) -> list[str]:
+        seed = hash_to_int("".join(str(message.content) for message in messages))
+        return [
+            f"{VOCABULARY[(seed >> i % 48) % len(VOCABULARY)]} "
+            for i in range(self.response_tokens)
+        ]
+
+    def _stream(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,  # noqa: ARG002
+            run_manager: CallbackManagerForLLMRun | None = None,
+            **kwargs: Any,  # noqa: ARG002
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency.llm_first_token)
+        for i, token in enumerate(self._build_tokens(messages)):
+            if i:
+                time.sleep(self.latency.llm_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,  # noqa: ARG002
+            run_manager: AsyncCallbackManagerForLLMRun | None = None,
+            **kwargs: Any,  # noqa: ARG002
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency.llm_first_token)
+        for i, token in enumerate(self._build_tokens(messages)):
+            if i:
+                await asyncio.sleep(self.latency.llm_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _generate(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: CallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+
+    async def _agenerate(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: AsyncCallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        return await agenerate_from_stream(
+            self._astream(messages, stop, run_manager, **kwargs)
+        )
+
+
+def get_field(source: dict[str, Any], path: str) -> Any:
+    """Значение поля документа по пути через точку (metadata.document_id)"""
+    value: Any = source
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def cosine(left: list[float], right: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(left, right, strict=False))
+    norm = math.sqrt(sum(x * x for x in left)) * math.sqrt(sum(y * y for y in right))
+    return dot / norm if norm else 0.0
+
+
+class FakeElasticsearchStore:
+    """In-memory реализация используемого приложением подмножества Elasticsearch API:
+    индексы и маппинги, bulk, гибридный поиск (kNN + match, _msearch), scroll и delete_by_query.
+    """
+
+    def __init__(self, latency: FakeLatency | None = None) -> None:
+        self.latency = latency or FakeLatency()
+        self.indices: dict[str, dict[str, dict[str, Any]]] = {}
+        self.mappings: dict[str, dict[str, Any]] = {}
+        self._scrolls: dict[str, list[dict[str, Any]]] = {}
+
+    def handle(  # noqa: C901, PLR0911
+            self, method: str, target: str, body: bytes | None
+    ) -> tuple[int, Any, float]:
+        """Обрабатывает HTTP запрос клиента.
+
+        :return HTTP статус, тело ответа и задержка ответа в секундах.
+        """
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        match method, parts:
+            case "POST" | "PUT", ["_bulk"] | [_, "_bulk"]:
+                return 200, self._bulk(body or b""), self.latency.bulk
+            case "POST" | "GET", ["_search", "scroll"]:
+                return 200, self._scroll(self._load(body)), self.latency.search
+            case "DELETE", ["_search", "scroll"]:
+                self._scrolls.pop(self._load(body).get("scroll_id"), None)
+                return 200, {"succeeded": True, "num_freed": 1}, 0.0
+            case "POST" | "GET", [index, "_search"]:
+                return 200, self._search(index, self._load(body), params), self.latency.search
+            case "POST" | "GET", [index, "_msearch"]:
+                return 200, self._msearch(index, body or b""), self.latency.search
+            case "POST", [index, "_delete_by_query"]:
+                return 200, self._delete_by_query(index, self._load(body)), self.latency.bulk
+            case "POST" | "GET", [index, "_refresh"]:
+                return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}, 0.0
+            case "GET", [index, "_mapping"]:
+                return 200, {index: {"mappings": self.mappings.get(index, {})}}, 0.0
+            case "HEAD", []:
+                return 200, None, 0.0
+            case "HEAD", [index]:
+                return (200 if index in self.indices else 404), None, 0.0
+            case "PUT", [index]:
+                self.indices.setdefault(index, {})
+                self.mappings[index] = self._load(body).get("mappings", {})
+                return 200, {"acknowledged": True, "index": index}, 0.0
+            case "GET", []:
+                return 200, {"version": {"number": "8.19.0"}, "tagline": "fake"}, 0.0
+            case _:
+                return 400, {"error": f"Unsupported request {method} {target}"}, 0.0
+
+    @staticmethod
+    def _load(body: bytes | None) -> dict[str, Any]:
+        return json.loads(body) if body else {}
+
+    def _bulk(self, body: bytes) -> dict[str, Any]:
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        items: list[dict[str, Any]] = []
+        i = 0
+        while i < len(lines):
+            (operation, action), = lines[i].items()
+            documents = self.indices.setdefault(action["_index"], {})
+            if operation == "delete":
+                found = documents.pop(action["_id"], None) is not None
+                status = 200 if found else 404
+                i += 1
+            else:
+                documents[action["_id"]] = lines[i + 1]
+                status = 201
+                i += 2
+            items.append({operation: {"_id": action["_id"], "status": status}})
+        return {"took": 1, "errors": False, "items": items}
+
+    def _matches(self, source: dict[str, Any], query: dict[str, Any]) -> bool:
+        if not query or "match_all" in query:
+            return True
+        if "term" in query:
+            (field, value), = query["term"].items()
+            value = value["value"] if isinstance(value, dict) else value
+            return get_field(source, field) == value
+        if "match" in query:
+            return self._match_score(source, query) > 0
+        return True
+
+    @staticmethod
+    def _match_score(source: dict[str, Any], query: dict[str, Any]) -> float:
+        (field, value), = query["match"].items()
+        text = value["query"] if isinstance(value, dict) else value
+        words = set(WORD_PATTERN.findall(text.lower()))
+        document_words = WORD_PATTERN.findall(str(get_field(source, field) or "").lower())
+        return sum(word in words for word in document_words) / (len(document_words) or 1)
+
+    def _score(self, source: dict[str, Any], body: dict[str, Any]) -> float:
+        knn = body.get("knn")
+        query = body.get("query", {})
+        if "retriever" in body:
+            knn, standard = body["retriever"]["rrf"]["retrievers"]
+            knn, query = knn["knn"], standard["standard"]["query"]
+        score = 0.0
+        if knn:
+            vector = source.get(knn["field"]) or []
+            score += knn.get("boost", 1.0) * cosine(knn["query_vector"], vector)
+        if "match" in query:
+            (_, value), = query["match"].items()
+            boost = value.get("boost", 1.0) if isinstance(value, dict) else 1.0
+            score += boost * self._match_score(source, query)
+        return score
+
+    @staticmethod
+    def _project(source: dict[str, Any], includes: Any) -> dict[str, Any] | None:
+        if includes is False or includes == "false":
+            return None
+        if not includes:
+            return source
+        fields = includes.split(",") if isinstance(includes, str) else includes
+        return {field: source[field] for field in fields if field in source}
+
+    def _search(
+            self, index: str, body: dict[str, Any], params: dict[str, str]
+    ) -> dict[str, Any]:
+        documents = self.indices.get(index, {})
+        size = int(body.get("size", params.get("size", 10)))
+        includes = body.get("_source", params.get("_source"))
+        if "scroll" in params:
+            hits = [
+                {"_index": index, "_id": id_, "_score": 1.0,
+                 "_source": self._project(source, includes)}
+                for id_, source in documents.items()
+                if self._matches(source, body.get("query", {}))
+            ]
+            scroll_id = hashlib.sha256(json.dumps(body).encode("utf-8")).hexdigest()
+            self._scrolls[scroll_id] = hits[size:]
+            return self._build_hits(hits[:size], scroll_id)
+        scored = sorted(
+            ((self._score(source, body), id_, source) for id_, source in documents.items()),
+            key=operator.itemgetter(0),
+            reverse=True,
+        )
+        hits = [
+            {"_index": index, "_id": id_, "_score": score,
+             "_source": self._project(source, includes)}
+            for score, id_, source in scored[:size]
+        ]
+        return self._build_hits(hits)
+
+    def _msearch(self, index: str, body: bytes) -> dict[str, Any]:
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        return {"responses": [
+            {**self._search(header.get("index", index), search, {}), "status": 200}
+            for header, search in zip(lines[::2], lines[1::2], strict=True)
+        ]}
+
+    def _scroll(self, body: dict[str, Any]) -> dict[str, Any]:
+        scroll_id = body["scroll_id"]
+        hits = self._scrolls.get(scroll_id, [])
+        size = 1000
+        self._scrolls[scroll_id] = hits[size:]
+        return self._build_hits(hits[:size], scroll_id)
+
+    @staticmethod
+    def _build_hits(
+            hits: list[dict[str, Any]], scroll_id: str | None = None
+    ) -> dict[str, Any]:
+        response: dict[str, Any] = {
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits},
+        }
+        if scroll_id is not None:
+            response["_scroll_id"] = scroll_id
+        return response
+
+    def _delete_by_query(self, index: str, body: dict[str, Any]) -> dict[str, Any]:
+        documents = self.indices.get(index, {})
+        ids = [id_ for id_, source in documents.items() if self._matches(source, body["query"])]
+        for id_ in ids:
+            del documents[id_]
+        return {"took": 1, "deleted": len(ids), "failures": []}
+
+
+def build_response(
+        node: BaseAsyncNode, status: int, data: Any, started_at: float
+) -> NodeApiResponse:
+    meta = ApiResponseMeta(
+        status=status,
+        http_version="1.1",
+        headers=HttpHeaders({
+            "content-type": "application/json",
+            "x-elastic-product": "Elasticsearch",
+        }),
+        duration=time.perf_counter() - started_at,
+        node=node.config,
+    )
+    body = b"" if data is None else json.dumps(data).encode("utf-8")
+    return NodeApiResponse(meta, body)
+
+
+class FakeAsyncNode(BaseAsyncNode):
+    """Узел транспорта AsyncElasticsearch, обращающийся к хранилищу вместо сети"""
+
+    _CLIENT_META_HTTP_CLIENT = ("fake", "1.0")
+    store: ClassVar[FakeElasticsearchStore]
+
+    async def perform_request(  # type: ignore[override]
+            self,
+            method: str,
+            target: str,
+            body: bytes | None = None,
+            headers: HttpHeaders | None = None,  # noqa: ARG002
+            request_timeout: Any = None,  # noqa: ARG002
+    ) -> NodeApiResponse:
+        started_at = time.perf_counter()
+        status, data, delay = self.store.handle(method, target, body)
+        await asyncio.sleep(delay)
+        return build_response(self, status, data, started_at)
+
+    async def close(self) -> None:  # type: ignore[override]  # noqa: PLR6301
+        return None
+
+
+def create_elasticsearch_client(store: FakeElasticsearchStore) -> AsyncElasticsearch:
+    """Создаёт асинхронный клиент поверх in-memory хранилища"""
+    node_class = type("BenchmarkAsyncNode", (FakeAsyncNode,), {"store": store})
+    return AsyncElasticsearch(FAKE_ELASTICSEARCH_URL, node_class=node_class)
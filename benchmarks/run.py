@@ -0,0 +1,418 @@
+"""Нагрузочные сценарии и запуск бенчмарков.
+
+Внешние клиенты в ``fastapi_rag.depends`` подменяются заглушками до первого
+обращения к ним, после чего приложение запускается в том же процессе на
+uvicorn с локальным портом, а обработчики брокера работают как при обычном
+запуске API (нужен Redis из настроек).
+"""
+
+from typing import Any
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import socket
+import subprocess  # noqa: S404
+import time
+import uuid
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from itertools import count
+from pathlib import Path
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from langchain_core.documents import Document
+
+from fastapi_rag.notifications import MAX_WAIT_TIMEOUT
+
+from .corpus import generate_corpus
+from .fakes import (
+    VOCABULARY,
+    FakeChatModel,
+    FakeElasticsearchStore,
+    FakeEmbeddings,
+    FakeLatency,
+    create_elasticsearch_client,
+)
+from .stats import LatencyRecorder, RecordingHistogram
+
+logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+API_PREFIX = "/api/v1"
+INDEX_NAME = "rag-index"
+SCENARIOS: tuple[str, ...] = ("completions", "completions_stream", "async_tasks", "upload")
+TERMINAL_STATUSES: tuple[str, ...] = ("done", "error")
+POLL_INTERVAL = 0.05
+
+Request = Callable[[httpx.AsyncClient, int, LatencyRecorder], Awaitable[None]]
+
+
+@dataclass
+class BenchmarkConfig:
+    """Параметры запуска бенчмарков"""
+
+    scenarios: tuple[str, ...] = SCENARIOS
+    concurrency: tuple[int, ...] = (1, 8, 32)
+    requests: int = 100
+    distinct_queries: int = 0
+    knowledge_base_size: int = 500
+    corpus_size: int = 10
+    corpus_dir: Path = Path("benchmarks/.corpus")
+    task_timeout: float = 60.0
+    embeddings_dims: int = 384
+    response_tokens: int = 64
+    latency: FakeLatency = field(default_factory=FakeLatency)
+
+
+def install_fakes(config: BenchmarkConfig, recorder: LatencyRecorder) -> FakeElasticsearchStore:
+    """Подменяет внешние клиенты в depends заглушками.
+
+    Должна вызываться до первого обращения к клиентам: производные клиенты
+    (ретривер, запись в индекс, семантический кэш) создаются поверх заглушек.
+
+    :return In-memory хранилище фейкового Elasticsearch.
+    """
+    from fastapi_rag import depends, metrics  # noqa: PLC0415
+    from fastapi_rag.instrumentation import LLMMetricsHandler  # noqa: PLC0415
+
+    store = FakeElasticsearchStore(config.latency)
+    depends.get_elasticsearch.override(create_elasticsearch_client(store))
+    depends.get_embeddings.override(FakeEmbeddings(config.embeddings_dims, config.latency))
+    depends.get_llm.override(FakeChatModel(
+        response_tokens=config.response_tokens,
+        latency=config.latency,
+        callbacks=[LLMMetricsHandler()],
+    ))
+    metrics.node_duration = RecordingHistogram(metrics.node_duration, recorder, label="node")
+    return store
+
+
+def build_query(i: int, distinct_queries: int) -> str:
+    """Детерминированный запрос пользователя, повторяющийся каждые distinct_queries раз"""
+    n = i % distinct_queries if distinct_queries else i
+    words = " ".join(VOCABULARY[(n * 7 + j * 3) % len(VOCABULARY)] for j in range(6))
+    return f"Что известно про {words}? #{n}"
+
+
+async def seed_knowledge_base(size: int) -> None:
+    """Наполняет фейковый индекс чанками через IngestionWriter приложения"""
+    from fastapi_rag.depends import create_index, get_ingestion_writer  # noqa: PLC0415
+
+    await create_index(INDEX_NAME)
+    documents = [
+        Document(
+            id=f"seed:{i}",
+            page_content=" ".join(VOCABULARY[(i + j) % len(VOCABULARY)] for j in range(80)),
+            metadata={"document_id": "seed"},
+        )
+        for i in range(size)
+    ]
+    if documents:
+        await get_ingestion_writer().write(documents)
+
+
+def message_payload(i: int, config: BenchmarkConfig) -> dict[str, Any]:
+    return {
+        "chat_id": str(uuid.uuid4()),
+        "role": "user",
+        "text": build_query(i, config.distinct_queries),
+    }
+
+
+def completions_request(config: BenchmarkConfig) -> Request:
+    async def request(client: httpx.AsyncClient, i: int, recorder: LatencyRecorder) -> None:
+        start = time.perf_counter()
+        response = await client.post(
+            f"{API_PREFIX}/chat/completions", json=message_payload(i, config)
+        )
+        response.raise_for_status()
+        recorder.record("POST /chat/completions", time.perf_counter() - start)
+
+    return request
+
+
+def completions_stream_request(config: BenchmarkConfig) -> Request:
+    async def request(client: httpx.AsyncClient, i: int, recorder: LatencyRecorder) -> None:
+        start = time.perf_counter()
+        first_chunk_at = None
+        async with client.stream(
+            "POST", f"{API_PREFIX}/chat/completions/stream", json=message_payload(i, config)
+        ) as response:
+            response.raise_for_status()
+            async for _ in response.aiter_bytes():
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+        end = time.perf_counter()
+        recorder.record("POST /chat/completions/stream (first chunk)", first_chunk_at - start)
+        recorder.record("POST /chat/completions/stream", end - start)
+
+    return request
+
+
+def async_task_request(config: BenchmarkConfig) -> Request:
+    async def request(client: httpx.AsyncClient, i: int, recorder: LatencyRecorder) -> None:
+        start = time.perf_counter()
+        response = await client.post(
+            f"{API_PREFIX}/chat/completions/async", json=message_payload(i, config)
+        )
+        response.raise_for_status()
+        recorder.record("POST /chat/completions/async", time.perf_counter() - start)
+        task_id = response.json()["id"]
+        deadline = start + config.task_timeout
+        while True:
+            timeout = min(max(deadline - time.perf_counter(), 0.1), MAX_WAIT_TIMEOUT)
+            response = await client.get(
+                f"{API_PREFIX}/chat/tasks/{task_id}/wait", params={"timeout": timeout}
+            )
+            response.raise_for_status()
+            task = response.json()
+            if task["status"] in TERMINAL_STATUSES or time.perf_counter() >= deadline:
+                break
+        if task["status"] != "done":
+            raise RuntimeError(f"Task {task_id} finished with status {task['status']}")
+        recorder.record("async task (end to end)", time.perf_counter() - start)
+
+    return request
+
+
+def upload_request(config: BenchmarkConfig, corpus: list[Path]) -> Request:
+    async def request(client: httpx.AsyncClient, i: int, recorder: LatencyRecorder) -> None:
+        path = corpus[i % len(corpus)]
+        # Уникальное имя файла, иначе загрузки обновляют один и тот же документ
+        filename = f"{path.stem}-{i}{path.suffix}"
+        start = time.perf_counter()
+        response = await client.post(
+            f"{API_PREFIX}/documents/upload", files={"file": (filename, path.read_bytes())}
+        )
+        response.raise_for_status()
+        recorder.record("POST /documents/upload", time.perf_counter() - start)
+        job_id = response.json()["id"]
+        deadline = start + config.task_timeout
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            response = await client.get(f"{API_PREFIX}/documents/jobs/{job_id}")
+            response.raise_for_status()
+            job = response.json()
+            if job["status"] in TERMINAL_STATUSES or time.perf_counter() >= deadline:
+                break
+        if job["status"] != "done":
+            raise RuntimeError(f"Ingestion job {job_id} failed: {job['error']}")
+        recorder.record("ingestion (end to end)", time.perf_counter() - start)
+
+    return request
+
+
+async def run_load(
+        client: httpx.AsyncClient,
+        request: Request,
+        concurrency: int,
+        requests: int,
+        recorder: LatencyRecorder,
+) -> tuple[float, int]:
+    """Выполняет requests запросов, удерживая concurrency запросов в полёте.
+
+    :return Длительность прогона в секундах и количество ошибок.
+    """
+    counter = count()
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        while (i := next(counter)) < requests:
+            try:
+                await request(client, i, recorder)
+            except Exception:
+                errors += 1
+                logger.exception("Benchmark request %s failed", i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, errors
+
+
+def get_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL  # noqa: S607
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(config: BenchmarkConfig) -> dict[str, Any]:
+    """Запускает выбранные сценарии на каждом уровне конкурентности"""
+    node_recorder = LatencyRecorder()
+    install_fakes(config, node_recorder)
+    from fastapi_rag.app import app  # noqa: PLC0415
+
+    corpus = (
+        generate_corpus(config.corpus_dir, config.corpus_size)
+        if "upload" in config.scenarios else []
+    )
+    factories: dict[str, Callable[[], Request]] = {
+        "completions": lambda: completions_request(config),
+        "completions_stream": lambda: completions_stream_request(config),
+        "async_tasks": lambda: async_task_request(config),
+        "upload": lambda: upload_request(config, corpus),
+    }
+    results: list[dict[str, Any]] = []
+    async with serve(app) as base_url:
+        await seed_knowledge_base(config.knowledge_base_size)
+        limits = httpx.Limits(max_connections=max(config.concurrency))
+        timeout = httpx.Timeout(config.task_timeout + MAX_WAIT_TIMEOUT)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+            for scenario in config.scenarios:
+                for concurrency in config.concurrency:
+                    recorder = LatencyRecorder()
+                    node_recorder.reset()
+                    logger.warning("Running %s with concurrency %s", scenario, concurrency)
+                    duration, errors = await run_load(
+                        client, factories[scenario](), concurrency, config.requests, recorder
+                    )
+                    results.append({
+                        "scenario": scenario,
+                        "concurrency": concurrency,
+                        "requests": config.requests,
+                        "errors": errors,
+                        "duration_s": round(duration, 3),
+                        "throughput_rps": round((config.requests - errors) / duration, 3),
+                        "latency": recorder.summary(),
+                        "nodes": node_recorder.summary(),
+                    })
+    return {
+        "meta": {
+            "created_at": datetime.now(UTC).isoformat(),
+            "revision": get_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                **asdict(config),
+                "corpus_dir": str(config.corpus_dir),
+            },
+        },
+        "results": results,
+    }
+
+
+@asynccontextmanager
+async def serve(app: FastAPI) -> AsyncGenerator[str]:
+    """Запускает приложение на uvicorn со свободным локальным портом.
+
+    :return Базовый URL запущенного приложения.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((HOST, 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    serving = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        if serving.done():
+            await serving
+            raise RuntimeError("Application failed to start")
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://{HOST}:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def format_table(report: dict[str, Any]) -> str:
+    lines = [(
+        f"{'scenario':<20}{'conc':>6}{'rps':>10}{'err':>6}  "
+        f"{'operation':<46}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )]
+    for result in report["results"]:
+        rows = [*result["latency"].items(), *(
+            (f"node {name}", summary) for name, summary in result["nodes"].items()
+        )] or [("-", {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0})]
+        for name, summary in rows:
+            lines.append(
+                f"{result['scenario']:<20}{result['concurrency']:>6}"
+                f"{result['throughput_rps']:>10.2f}{result['errors']:>6}  {name:<46}"
+                f"{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}"
+            )
+    return "\n".join(lines)
+
+
+def parse_args(argv: list[str] | None = None) -> tuple[BenchmarkConfig, Path]:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Офлайн бенчмарки fastapi-rag"
+    )
+
+    def csv(value: str) -> tuple[str, ...]:
+        return tuple(item.strip() for item in value.split(",") if item.strip())
+
+    def scenarios(value: str) -> tuple[str, ...]:
+        names = csv(value)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise argparse.ArgumentTypeError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        return names
+
+    defaults = BenchmarkConfig()
+    latency = defaults.latency
+    parser.add_argument("--scenarios", type=scenarios, default=defaults.scenarios)
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: tuple(int(item) for item in csv(value)),
+        default=defaults.concurrency,
+    )
+    parser.add_argument("--requests", type=int, default=defaults.requests)
+    parser.add_argument(
+        "--distinct-queries", type=int, default=defaults.distinct_queries,
+        help="Количество различных запросов (0 - все запросы уникальны)",
+    )
+    parser.add_argument("--knowledge-base-size", type=int, default=defaults.knowledge_base_size)
+    parser.add_argument("--corpus-size", type=int, default=defaults.corpus_size)
+    parser.add_argument("--corpus-dir", type=Path, default=defaults.corpus_dir)
+    parser.add_argument("--task-timeout", type=float, default=defaults.task_timeout)
+    parser.add_argument("--embeddings-dims", type=int, default=defaults.embeddings_dims)
+    parser.add_argument("--response-tokens", type=int, default=defaults.response_tokens)
+    parser.add_argument("--embeddings-latency", type=float, default=latency.embeddings)
+    parser.add_argument(
+        "--embeddings-per-text-latency", type=float, default=latency.embeddings_per_text
+    )
+    parser.add_argument("--llm-first-token-latency", type=float, default=latency.llm_first_token)
+    parser.add_argument("--llm-token-latency", type=float, default=latency.llm_token)
+    parser.add_argument("--search-latency", type=float, default=latency.search)
+    parser.add_argument("--bulk-latency", type=float, default=latency.bulk)
+    parser.add_argument("--output", type=Path, default=Path("benchmark-results.json"))
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    config = BenchmarkConfig(
+        scenarios=args.scenarios,
+        concurrency=args.concurrency,
+        requests=args.requests,
+        distinct_queries=args.distinct_queries,
+        knowledge_base_size=args.knowledge_base_size,
+        corpus_size=args.corpus_size,
+        corpus_dir=args.corpus_dir,
+        task_timeout=args.task_timeout,
+        embeddings_dims=args.embeddings_dims,
+        response_tokens=args.response_tokens,
+        latency=FakeLatency(
+            embeddings=args.embeddings_latency,
+            embeddings_per_text=args.embeddings_per_text_latency,
+            llm_first_token=args.llm_first_token_latency,
+            llm_token=args.llm_token_latency,
+            search=args.search_latency,
+            bulk=args.bulk_latency,
+        ),
+    )
+    return config, args.output
+
+
+def main(argv: list[str] | None = None) -> None:
+    config, output = parse_args(argv)
+    report = asyncio.run(run_benchmarks(config))
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(format_table(report))  # noqa: T201
+    print(f"Results written to {output}")  # noqa: T201
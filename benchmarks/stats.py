@@ -0,0 +1,75 @@
+"""Сбор задержек и расчёт перцентилей"""
+
+from typing import Any
+
+import math
+from collections import defaultdict
+
+from prometheus_client import Histogram
+
+PERCENTILES: tuple[int, ...] = (50, 95, 99)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль отсортированной выборки с линейной интерполяцией"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Сводка по выборке задержек в миллисекундах"""
+    values = sorted(values)
+    summary = {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "max_ms": values[-1] * 1000 if values else 0.0,
+    }
+    summary.update({f"p{q}_ms": percentile(values, q) * 1000 for q in PERCENTILES})
+    return {key: round(value, 3) for key, value in summary.items()}
+
+
+class LatencyRecorder:
+    """Накопитель задержек по именованным операциям (эндпоинтам, вершинам графа)"""
+
+    def __init__(self) -> None:
+        self.samples: defaultdict[str, list[float]] = defaultdict(list)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.samples[name].append(seconds)
+
+    def reset(self) -> None:
+        self.samples.clear()
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {name: summarize(values) for name, values in sorted(self.samples.items())}
+
+
+class RecordingHistogram:
+    """Обёртка над prometheus гистограммой с метками, дополнительно сохраняющая
+    каждое наблюдение в LatencyRecorder для точных перцентилей.
+
+    :param histogram: Исходная гистограмма.
+    :param recorder: Накопитель задержек.
+    :param label: Метка, значение которой используется как имя операции.
+    """
+
+    def __init__(self, histogram: Histogram, recorder: LatencyRecorder, label: str) -> None:
+        self.histogram = histogram
+        self.recorder = recorder
+        self.label = label
+
+    def labels(self, **labels: Any) -> "RecordingChild":
+        return RecordingChild(self, labels)
+
+
+class RecordingChild:
+    def __init__(self, parent: RecordingHistogram, labels: dict[str, Any]) -> None:
+        self.parent = parent
+        self.labels = labels
+
+    def observe(self, amount: float) -> None:
+        self.parent.histogram.labels(**self.labels).observe(amount)
+        self.parent.recorder.record(str(self.labels[self.parent.label]), amount)
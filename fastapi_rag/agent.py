@@ -1,30 +1,69 @@
 from typing import Final, TypedDict
 
+import asyncio
+import hashlib
+import json
 import logging
-from collections.abc import Sequence
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
 from uuid import UUID
 
 from langchain_core.documents import Document
+from langchain_core.messages import SystemMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import Runnable, RunnableConfig
 from langgraph.graph import END, START, StateGraph
 from langgraph.graph.state import CompiledStateGraph
 
-from .depends import llm, redis, retriever
+from .background import run_in_background
+from .cache import build_query_key
+from .coalescing import SingleFlight
+from .context import (
+    deduplicate_documents,
+    estimate_tokens,
+    order_by_score,
+    pack_documents,
+    pack_history,
+)
+from .depends import (
+    get_conversation_summarizer,
+    get_generation_flight,
+    get_history_store,
+    get_llm,
+    get_reranker,
+    get_retrieval_flight,
+    get_retriever,
+    get_semantic_cache,
+    get_summary_store,
+)
+from .history import format_entries, make_turn
+from .lifecycle import Lazy
+from .metrics import agent_duration, track_node
+from .schemas import HistoryEntry
 from .settings import settings
 
 logger = logging.getLogger(__name__)
 
 SYSTEM_PROMPT = settings.rag.system_prompt
-USER_PROMPT = """История диалога:
+USER_PROMPT = """Контекст:
+{context}
+
+История диалога:
 {conversation_history}
 
 Запрос пользователя:
 {query}
 """
-TTL = settings.redis.ttl
-MAX_CONVERSATION_HISTORY_LENGTH = settings.rag.max_conversation_history_length
+
+# Промпт собирается один раз при импорте модуля, цепочка генерации - при первом
+# вызове LLM, системный промпт передаётся как есть, без шаблонизации
+prompt: Final[ChatPromptTemplate] = ChatPromptTemplate.from_messages([
+    SystemMessage(content=SYSTEM_PROMPT), ("human", USER_PROMPT)
+])
+get_generation_chain: Final[Lazy[Runnable[dict[str, str], str]]] = Lazy(
+    lambda: prompt | get_llm() | StrOutputParser(), name="generation_chain"
+)
 
 
 class State(TypedDict):
@@ -33,13 +72,21 @@ class State(TypedDict):
     Attributes:
         query: Запрос пользователя.
         conversation_history: История сообщений пользователя в рамках диалога.
+        conversation_summary: Сводка сообщений диалога, не вошедших в историю.
         documents: Найденные документы по запросу пользователя.
+        context: Упакованный в бюджет токенов контекст для генерации.
         response: Финальный ответ агента.
+        query_embedding: Эмбеддинг запроса, если ответ можно сохранить в семантический кэш.
+        cache_hit: Был ли ответ найден в семантическом кэше.
     """
     query: str
-    conversation_history: list[str]
+    conversation_history: list[HistoryEntry]
+    conversation_summary: str
     documents: list[Document]
+    context: str
     response: str
+    query_embedding: list[float]
+    cache_hit: bool
 
 
 def format_documents(documents: Sequence[Document]) -> str:
@@ -47,18 +94,69 @@ def format_documents(documents: Sequence[Document]) -> str:
     return "\n\n".join([document.page_content for document in documents])
 
 
-def build_conversation_history_key(chat_id: UUID) -> str:
-    return f"conversation_history:{chat_id}"
+def format_conversation_history(entries: Sequence[HistoryEntry], summary: str = "") -> str:
+    """Форматирует историю диалога и её сводку для промпта"""
+    history = format_entries(entries)
+    if not summary:
+        return history
+    return f"Summary: {summary}\n{history}" if history else f"Summary: {summary}"
+
+
+def build_generation_key(query: str, conversation_history: str, context: str) -> str:
+    """Ключ генерации: нормализованный запрос, отпечаток истории диалога и контекста"""
+    payload = json.dumps(
+        [build_query_key(query), conversation_history, context], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def coalesce[T](
+        flight: SingleFlight[T] | None, key: str, func: Callable[[], Awaitable[T]]
+) -> T:
+    """Объединяет идентичные конкурентные вызовы, если объединение включено"""
+    if flight is None:
+        return await func()
+    return await flight.do(key, func)
+
+
+async def lookup_semantic_cache(
+        state: State, config: RunnableConfig | None = None
+) -> dict[str, str | bool | list[float]]:
+    """Поиск готового ответа на семантически близкий запрос"""
+    logger.info("---LOOKUP SEMANTIC CACHE---")
+    # Кэш общий для всех чатов, а ответ в продолжении диалога зависит от его истории,
+    # поэтому такие запросы не читают кэш и не пишут в него
+    if await get_history_store().exists(config["configurable"]["chat_id"]):
+        return {"cache_hit": False}
+    response, embedding = await get_semantic_cache().lookup(state["query"])
+    if response is None:
+        return {"cache_hit": False, "query_embedding": embedding}
+    return {"cache_hit": True, "query_embedding": embedding, "response": response}
+
+
+def route_semantic_cache(state: State) -> str | list[str]:
+    """Пропускает извлечение и генерацию при попадании в кэш"""
+    return END if state["cache_hit"] else ["get_conversation_history", "retrieve"]
 
 
 async def get_conversation_history(
         state: State, config: RunnableConfig | None = None  # noqa: ARG001
-) -> dict[str, list[str]]:
-    """Получение истории диалога пользователя"""
+) -> dict[str, list[HistoryEntry] | str]:
+    """Получение истории диалога пользователя и её сводки"""
     logger.info("---GET CONVERSATION HISTORY---")
-    key = build_conversation_history_key(config["configurable"]["chat_id"])
-    messages = await redis.lrange(key, 0, -1)
-    return {"conversation_history": [message.decode("utf-8") for message in reversed(messages)]}
+    chat_id = config["configurable"]["chat_id"]
+    if not settings.summarization.enabled:
+        return {"conversation_history": await get_history_store().get(chat_id)}
+    entries, summary = await asyncio.gather(
+        get_history_store().get(chat_id), get_summary_store().get(chat_id)
+    )
+    if summary is None:
+        return {"conversation_history": entries, "conversation_summary": ""}
+    # Сообщения, уже вошедшие в сводку, в промпт не попадают
+    return {
+        "conversation_history": [entry for entry in entries if entry.timestamp > summary.until],
+        "conversation_summary": summary.text,
+    }
 
 
 async def retrieve(
@@ -66,51 +164,140 @@ async def retrieve(
 ) -> dict[str, list[Document]]:
     """Извлечение документов из базы знаний"""
     logger.info("---RETRIEVE ---")
-    documents = await retriever.ainvoke(state["query"])
+    query = state["query"]
+    documents = await coalesce(
+        get_retrieval_flight(), build_query_key(query), lambda: get_retriever().ainvoke(query)
+    )
+    return {"documents": documents}
+
+
+async def rerank(
+        state: State, config: RunnableConfig | None = None  # noqa: ARG001
+) -> dict[str, list[Document]]:
+    """Переранжирует найденные документы cross-encoder моделью"""
+    logger.info("---RERANK---")
+    documents = await get_reranker().arerank(state["query"], state["documents"])
     return {"documents": documents}
 
 
+def pack_context(
+        state: State, config: RunnableConfig | None = None  # noqa: ARG001
+) -> dict[str, str | list[Document] | list[HistoryEntry]]:
+    """Упаковывает документы и историю диалога в бюджет токенов промпта"""
+    logger.info("---PACK CONTEXT---")
+    chars_per_token = settings.rag.chars_per_token
+    budget = settings.rag.max_prompt_tokens - estimate_tokens(
+        SYSTEM_PROMPT + USER_PROMPT + state["query"], chars_per_token
+    )
+    history_budget = min(settings.rag.max_history_tokens, budget)
+    history, history_tokens = pack_history(
+        state["conversation_history"], history_budget, chars_per_token
+    )
+    # Последние сообщения важнее сводки, она занимает оставшийся бюджет истории
+    summary = state.get("conversation_summary", "")
+    summary_budget = max(history_budget - history_tokens, 0)
+    if estimate_tokens(summary, chars_per_token) > summary_budget:
+        summary = summary[:int(summary_budget * chars_per_token)]
+    history_tokens += estimate_tokens(summary, chars_per_token)
+    documents = deduplicate_documents(
+        order_by_score(state["documents"]), settings.rag.dedup_threshold
+    )
+    documents = pack_documents(documents, budget - history_tokens, chars_per_token)
+    logger.info(
+        "Packed %s of %s documents and %s of %s history messages",
+        len(documents), len(state["documents"]),
+        len(history), len(state["conversation_history"]),
+    )
+    return {
+        "documents": documents,
+        "conversation_history": history,
+        "conversation_summary": summary,
+        "context": format_documents(documents),
+    }
+
+
 async def generate(
         state: State, config: RunnableConfig | None = None  # noqa: ARG001
 ) -> dict[str, str]:
     """Генерирует ответ на запрос пользователя"""
     logger.info("---GENERATE ---")
-    user_prompt = USER_PROMPT.format(
-        conversation_history="\n".join(state["conversation_history"]), query=state["query"]
+    inputs = {
+        "context": state["context"],
+        "conversation_history": format_conversation_history(
+            state["conversation_history"], state.get("conversation_summary", "")
+        ),
+        "query": state["query"],
+    }
+    # Одинаковые запросы с той же историей и контекстом ждут одну генерацию,
+    # токены при этом стримятся только запросу-лидеру
+    response = await coalesce(
+        get_generation_flight(),
+        build_generation_key(**inputs),
+        lambda: get_generation_chain().ainvoke(inputs),
     )
-    chain = ChatPromptTemplate.from_template() | llm | StrOutputParser()
-    response = await chain.ainvoke({
-        "user_prompt": user_prompt, "context": format_documents(state["documents"]),
-    })
     return {"response": response}
 
 
-async def cache_conversation_history(
-        state: State, config: RunnableConfig | None = None
-) -> State:
+async def update_semantic_cache(query: str, response: str, query_embedding: list[float]) -> None:
+    """Сохраняет сгенерированный ответ в семантический кэш"""
+    logger.info("---UPDATE SEMANTIC CACHE---")
+    await get_semantic_cache().store(query, response, query_embedding)
+
+
+async def cache_conversation_history(chat_id: UUID, query: str, response: str) -> None:
     """Сохраняет истории диалога"""
     logger.info("---CACHE CONVERSATION HISTORY---")
-    key = build_conversation_history_key(config["configurable"]["chat_id"])
-    messages = [f"User: {state["query"]}", f"AI: {state["response"]}"]
-    await redis.lpush(key, *messages)
-    await redis.expire(key, TTL)
-    await redis.ltrim(key, 0, MAX_CONVERSATION_HISTORY_LENGTH)
-    return state
+    await get_history_store().add(chat_id, make_turn(query, response))
+    if settings.summarization.enabled:
+        await summarize_conversation(chat_id)
+
+
+async def summarize_conversation(chat_id: UUID) -> None:
+    """Сжимает старые сообщения диалога в сводку"""
+    logger.info("---SUMMARIZE CONVERSATION---")
+    await get_conversation_summarizer().summarize(chat_id)
+
+
+def schedule_post_processing(chat_id: UUID, state: State) -> None:
+    """Выносит запись истории диалога и семантического кэша с критического пути запроса"""
+    if not state.get("response"):
+        return
+    run_in_background(cache_conversation_history(chat_id, state["query"], state["response"]))
+    # Эмбеддинга запроса нет, если ответ зависит от истории диалога
+    cacheable = not state.get("cache_hit") and "query_embedding" in state
+    if settings.semantic_cache.enabled and cacheable:
+        run_in_background(
+            update_semantic_cache(state["query"], state["response"], state["query_embedding"])
+        )
 
 
 # Инициализация графа
 workflow = StateGraph(State)
 # Добавление вершин графа
-workflow.add_node("get_conversation_history", get_conversation_history)
-workflow.add_node("retrieve", retrieve)
-workflow.add_node("generate", generate)
-workflow.add_node("cache_conversation_history", cache_conversation_history)
-# Добавление ребёр графа
-workflow.add_edge(START, "get_conversation_history")
-workflow.add_edge("get_conversation_history", "retrieve")
-workflow.add_edge("retrieve", "generate")
-workflow.add_edge("generate", "cache_conversation_history")
-workflow.add_edge("cache_conversation_history", END)
+workflow.add_node("get_conversation_history", track_node(get_conversation_history))
+workflow.add_node("retrieve", track_node(retrieve))
+workflow.add_node("pack_context", track_node(pack_context))
+workflow.add_node("generate", track_node(generate))
+# Добавление ребёр графа, история диалога и документы извлекаются параллельно
+if settings.semantic_cache.enabled:
+    workflow.add_node("lookup_semantic_cache", track_node(lookup_semantic_cache))
+    workflow.add_edge(START, "lookup_semantic_cache")
+    workflow.add_conditional_edges(
+        "lookup_semantic_cache",
+        route_semantic_cache,
+        ["get_conversation_history", "retrieve", END],
+    )
+else:
+    workflow.add_edge(START, "get_conversation_history")
+    workflow.add_edge(START, "retrieve")
+if settings.reranker.enabled:
+    workflow.add_node("rerank", track_node(rerank))
+    workflow.add_edge("retrieve", "rerank")
+    workflow.add_edge(["get_conversation_history", "rerank"], "pack_context")
+else:
+    workflow.add_edge(["get_conversation_history", "retrieve"], "pack_context")
+workflow.add_edge("pack_context", "generate")
+workflow.add_edge("generate", END)
 # Компиляция графа
 agent: Final[CompiledStateGraph[State]] = workflow.compile()
 
@@ -118,5 +305,45 @@ agent: Final[CompiledStateGraph[State]] = workflow.compile()
 async def execute_agent(chat_id: UUID, query: str) -> str:
     """Функция для вызова RAG агента"""
     config = RunnableConfig(configurable={"chat_id": chat_id})
-    accumulated_state = await agent.ainvoke({"query": query}, config=config)
+    with agent_duration.time():
+        accumulated_state = await agent.ainvoke({"query": query}, config=config)
+    schedule_post_processing(chat_id, accumulated_state)
     return accumulated_state.get("response", "")
+
+
+async def stream_agent(chat_id: UUID, query: str) -> AsyncIterator[str]:
+    """Потоковый вызов RAG агента, отдаёт токены ответа по мере их генерации.
+
+    :param chat_id: Идентификатор чата.
+    :param query: Запрос пользователя.
+    :return Асинхронный итератор токенов вершины generate.
+    """
+    config = RunnableConfig(configurable={"chat_id": chat_id})
+    streamed = False
+    accumulated_state: State = {"query": query}
+    # Время, пока клиент читает токены, не входит в длительность выполнения графа
+    elapsed = 0.0
+    resumed_at: float | None = time.perf_counter()
+    try:
+        async for mode, chunk in agent.astream(
+            {"query": query}, config=config, stream_mode=["messages", "values"]
+        ):
+            if mode == "values":
+                accumulated_state = chunk
+                continue
+            message, metadata = chunk
+            if metadata.get("langgraph_node") != "generate" or not message.content:
+                continue
+            streamed = True
+            elapsed += time.perf_counter() - resumed_at
+            resumed_at = None
+            yield message.content
+            resumed_at = time.perf_counter()
+    finally:
+        if resumed_at is not None:
+            elapsed += time.perf_counter() - resumed_at
+        agent_duration.observe(elapsed)
+    schedule_post_processing(chat_id, accumulated_state)
+    # Ответ мог быть получен без генерации, например из семантического кэша
+    if not streamed and accumulated_state.get("response"):
+        yield accumulated_state["response"]
@@ -5,26 +5,47 @@ from collections.abc import AsyncGenerator
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from prometheus_client import make_asgi_app
 
+from .background import wait_background_tasks
 from .broker import app as faststream_app
-from .database.base import create_db, create_tables
-from .depends import create_index
-from .exceptions import AppError
+from .broker import get_queue_depth_monitor, message_writer, prepare
+from .depends import close_clients
+from .exceptions import AppError, OverloadedError
+from .indexing import shutdown_parsing_executor
+from .lifecycle import StartupReport
 from .routers import router
+from .settings import settings
+from .tracing import TraceIdMiddleware
+from .websockets import get_connection_manager
 
 
 async def lifespan(_: FastAPI) -> AsyncGenerator[None]:
-    create_index("rag-index")
-    create_db()
-    await create_tables()
-    await faststream_app.broker.start()
+    report = StartupReport("API")
+    await prepare(report)
+    # Без потребителей API только публикует задачи, обработкой занимаются воркеры
+    with report.stage("broker"):
+        if settings.broker.consumers_enabled:
+            await faststream_app.broker.start()
+        else:
+            await faststream_app.broker.connect()
+    get_queue_depth_monitor().start()
+    report.log()
     yield
+    await get_queue_depth_monitor().close()
+    await wait_background_tasks()
+    shutdown_parsing_executor()
     await faststream_app.broker.stop()
+    await message_writer.close()
+    if get_connection_manager.initialized:
+        await get_connection_manager().close()
+    await close_clients()
 
 
 app: Final[FastAPI] = FastAPI(lifespan=lifespan)
 
 app.include_router(router)
+app.mount("/metrics", make_asgi_app())
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,8 +53,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[settings.observability.trace_header],
 )
 
+if settings.observability.trace_propagation:
+    app.add_middleware(TraceIdMiddleware, header=settings.observability.trace_header)
+
 
 @app.exception_handler(AppError)
 def handle_app_error(request: Request, exc: AppError) -> JSONResponse:  # noqa: ARG001
@@ -43,6 +68,14 @@ def handle_app_error(request: Request, exc: AppError) -> JSONResponse:  # noqa:
     )
 
 
+@app.exception_handler(OverloadedError)
+def handle_overload(request: Request, exc: OverloadedError) -> JSONResponse:  # noqa: ARG001
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"message": str(exc), "code": exc.code},
+    )
+
+
 @app.exception_handler(ValueError)
 def handle_value_error(request: Request, exc: ValueError) -> JSONResponse:  # noqa: ARG001
     return JSONResponse(
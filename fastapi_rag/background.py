@@ -0,0 +1,30 @@
+import asyncio
+import logging
+from collections.abc import Coroutine
+
+logger = logging.getLogger(__name__)
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _on_task_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed", exc_info=task.exception())
+
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    """Запускает корутину в фоне, не блокируя текущий запрос.
+
+    Ссылка на задачу сохраняется до её завершения, чтобы её не собрал сборщик мусора.
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_task_done)
+    return task
+
+
+async def wait_background_tasks() -> None:
+    """Дожидается завершения фоновых задач (при остановке приложения)"""
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
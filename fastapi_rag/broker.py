@@ -1,35 +1,238 @@
 from typing import Final
 
-from faststream import FastStream, Logger
-from faststream.redis import RedisBroker
+import asyncio
+import os
+from collections.abc import Awaitable, Callable
+from functools import partial
+from pathlib import Path
+from uuid import uuid4
 
-from .agent import execute_agent
-from .database.queries import persist_messages, update_task
-from .exceptions import AppError
-from .schemas import Message, Role, TaskProcess, TaskStatus
+from faststream import AckPolicy, FastStream, Logger
+from faststream.redis import RedisBroker, StreamSub
+from prometheus_client import start_http_server
+
+from .background import wait_background_tasks
+from .database.base import create_db, create_tables
+from .database.queries import read_ingestion_job, update_ingestion_job, update_task
+from .database.writer import MessageWriter
+from .delivery import DeliveryMiddleware, DeliveryOptions
+from .depends import (
+    INDEX_NAME,
+    close_clients,
+    create_index,
+    get_redis,
+    get_task_notifier,
+    warmup_embeddings,
+    warmup_reranker,
+)
+from .indexing import indexing_file, shutdown_parsing_executor
+from .instrumentation import BrokerMetricsMiddleware, QueueDepthMonitor
+from .lifecycle import Lazy, StartupReport
+from .schemas import (
+    IngestionStage,
+    IngestionTask,
+    Message,
+    Role,
+    Task,
+    TaskProcess,
+    TaskStatus,
+)
 from .settings import settings
+from .tracing import TraceMiddleware
+
+STREAMS: Final[tuple[str, ...]] = ("pending_tasks", "messages_persisting", "pending_ingestions")
+TERMINAL_STATUSES: Final[frozenset[TaskStatus]] = frozenset({TaskStatus.DONE, TaskStatus.ERROR})
+
+
+async def fail_task(body: bytes) -> None:
+    """Переводит задачу, перенесённую в dead-letter stream, в статус ошибки"""
+    task = TaskProcess.model_validate_json(body)
+    await update_task(task.id, status=TaskStatus.ERROR)
+    await get_task_notifier().publish(Task(id=task.id, status=TaskStatus.ERROR))
 
-broker = RedisBroker(url=settings.redis.url)
+
+async def fail_ingestion(body: bytes) -> None:
+    """Переводит индексацию, перенесённую в dead-letter stream, в статус ошибки"""
+    task = IngestionTask.model_validate_json(body)
+    await update_ingestion_job(
+        task.job_id, status=TaskStatus.ERROR, error="Delivery attempts exhausted"
+    )
+    await asyncio.to_thread(Path(task.path).unlink, missing_ok=True)
+
+
+broker = RedisBroker(
+    url=settings.redis.url,
+    graceful_timeout=settings.broker.graceful_timeout,
+    middlewares=[
+        *([TraceMiddleware] if settings.observability.trace_propagation else []),
+        BrokerMetricsMiddleware,
+        partial(DeliveryMiddleware, options=DeliveryOptions(
+            redis=get_redis,
+            group=settings.broker.group,
+            consumer=settings.broker.consumer,
+            max_deliveries=settings.broker.max_deliveries,
+            # Владение продлевается заметно чаще, чем его может забрать другой потребитель
+            claim_refresh_interval=settings.broker.min_idle_time / 1000 / 3,
+            on_dead_letter={"pending_tasks": fail_task, "pending_ingestions": fail_ingestion},
+        )),
+    ],
+)
 
 app: Final[FastStream] = FastStream(broker)
 
+message_writer: Final[MessageWriter] = MessageWriter(
+    max_batch_size=settings.persistence.batch_size,
+    max_wait_ms=settings.persistence.flush_interval_ms,
+    max_retries=settings.persistence.max_retries,
+    retry_backoff=settings.persistence.retry_backoff,
+)
+
+get_queue_depth_monitor: Final[Lazy[QueueDepthMonitor]] = Lazy(
+    lambda: QueueDepthMonitor(
+        redis=get_redis(),
+        streams=STREAMS,
+        group=settings.broker.group,
+        interval=settings.observability.queue_depth_interval,
+    ),
+    name="queue_depth_monitor",
+)
+
+
+def consume(
+        stream: str, max_workers: int = settings.broker.max_workers
+) -> Callable[[Callable[..., object]], Callable[..., object]]:
+    """Подписывает обработчик на Redis Stream в группе потребителей.
+
+    Первый подписчик читает новые сообщения, второй забирает сообщения, которые
+    не были подтверждены дольше min_idle_time (упавший или зависший воркер).
+    Сообщение подтверждается только после успешной обработки, ограничение
+    повторных доставок и продление владения - в DeliveryMiddleware.
+
+    :param stream: Название Redis Stream.
+    :param max_workers: Количество одновременно обрабатываемых сообщений.
+    """
+    def decorator(func: Callable[..., object]) -> Callable[..., object]:
+        for min_idle_time in (None, settings.broker.min_idle_time):
+            func = broker.subscriber(
+                stream=StreamSub(
+                    stream,
+                    group=settings.broker.group,
+                    consumer=settings.broker.consumer,
+                    min_idle_time=min_idle_time,
+                    polling_interval=settings.broker.polling_interval,
+                ),
+                ack_policy=AckPolicy.NACK_ON_ERROR,
+                max_workers=max_workers,
+            )(func)
+        return func
+
+    return decorator
+
+
+async def prepare_database() -> None:
+    await create_db()
+    await create_tables()
+
 
-@broker.subscriber("pending_tasks")
-@broker.publisher("messages_persisting")
+async def prepare(report: StartupReport) -> None:
+    """Подготовка хранилищ и моделей при запуске процесса API или воркера.
+
+    Независимые этапы выполняются конкурентно, длительность каждого попадает в отчёт.
+    """
+    async def run(stage: str, coro: Awaitable[None]) -> None:
+        with report.stage(stage):
+            await coro
+
+    await asyncio.gather(
+        run("create_index", create_index(INDEX_NAME)),
+        run("database", prepare_database()),
+    )
+    await asyncio.gather(
+        run("warmup_embeddings", warmup_embeddings(INDEX_NAME)),
+        run("warmup_reranker", warmup_reranker()),
+    )
+
+
+@app.on_startup
+async def startup() -> None:
+    """Подготовка отдельного процесса воркера (python worker.py)"""
+    report = StartupReport("Worker")
+    await prepare(report)
+    if settings.observability.worker_metrics_port:
+        start_http_server(settings.observability.worker_metrics_port)
+    get_queue_depth_monitor().start()
+    report.log()
+
+
+@app.after_shutdown
+async def shutdown() -> None:
+    await get_queue_depth_monitor().close()
+    await wait_background_tasks()
+    await message_writer.close()
+    shutdown_parsing_executor()
+    await close_clients()
+
+
+@consume("pending_tasks")
+@broker.publisher(stream="messages_persisting")
 async def handle_task(task: TaskProcess, logger: Logger) -> list[Message]:
+    # Агент (langgraph) импортируется при первой задаче, импорт брокера остаётся лёгким
+    from .agent import execute_agent  # noqa: PLC0415
+
     try:
         user_message = task.user_message
         response = await execute_agent(user_message.chat_id, user_message.text)
         ai_message = Message(chat_id=user_message.chat_id, role=Role.AI, text=response)
         await update_task(task.id, status=TaskStatus.DONE, message_id=ai_message.id)
-    except AppError:
-        logger.exception("{e}")
+    except Exception:
+        logger.exception("Task %s failed", task.id)
         await update_task(task.id, status=TaskStatus.ERROR)
+        await get_task_notifier().publish(Task(id=task.id, status=TaskStatus.ERROR))
     else:
+        # Уведомление содержит ответ, он доступен клиенту до записи сообщений в базу
+        await get_task_notifier().publish(
+            Task(id=task.id, status=TaskStatus.DONE, message=ai_message)
+        )
         return [user_message, ai_message]
 
 
-@broker.subscriber("messages_persisting")
+# Конкурентность подписчика ограничивает размер пакета отложенной записи
+@consume("messages_persisting", max_workers=settings.persistence.batch_size)
 async def handle_messages(messages: list[Message], logger: Logger) -> None:
-    await persist_messages(messages)
+    await message_writer.write(messages)
     logger.info("Messages persisting successfully")
+
+
+@consume("pending_ingestions")
+async def handle_ingestion(task: IngestionTask, logger: Logger) -> None:
+    async def on_progress(stage: IngestionStage, chunks_count: int) -> None:
+        await update_ingestion_job(task.job_id, stage=stage, chunks_count=chunks_count)
+
+    upload_path = Path(task.path)
+    # Каждая доставка работает со своей жёсткой ссылкой на загруженный файл: повторно
+    # доставленное сообщение не теряет файл, удалённый завершившимся обработчиком
+    path = upload_path.with_name(f"{upload_path.stem}-{uuid4().hex}{upload_path.suffix}")
+    try:
+        await asyncio.to_thread(os.link, upload_path, path)
+    except FileNotFoundError:
+        job = await read_ingestion_job(task.job_id)
+        if job is not None and job.status in TERMINAL_STATUSES:
+            logger.info("Ingestion job %s is already finished", task.job_id)
+            return
+        await update_ingestion_job(
+            task.job_id, status=TaskStatus.ERROR, error="Uploaded file is missing"
+        )
+        return
+    try:
+        await update_ingestion_job(task.job_id, status=TaskStatus.RUNNING)
+        await indexing_file(path, task.document_id, on_progress)
+    except Exception as e:
+        logger.exception("Ingestion of %s failed", task.filename)
+        await update_ingestion_job(task.job_id, status=TaskStatus.ERROR, error=str(e))
+    else:
+        await update_ingestion_job(task.job_id, status=TaskStatus.DONE)
+        logger.info("File %s indexed successfully", task.filename)
+    finally:
+        await asyncio.to_thread(path.unlink, missing_ok=True)
+        # Исходный файл удаляется только после финального статуса задания
+        await asyncio.to_thread(upload_path.unlink, missing_ok=True)
@@ -0,0 +1,243 @@
+from typing import Any
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from redis.asyncio import Redis
+
+from .metrics import cache_requests, semantic_cache_hits, semantic_cache_misses
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def build_query_key(query: str) -> str:
+    """Ключ кэша по нормализованному запросу (регистр и пробелы не учитываются)"""
+    normalized = WHITESPACE_PATTERN.sub(" ", query).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """Семантический кэш ответов агента.
+
+    Записи хранятся в Redis Stream, ограниченном по длине (вытесняются самые старые),
+    каждый процесс держит локальную копию векторов и за один round trip
+    дочитывает только новые записи. Инвалидация выполняется увеличением поколения кэша.
+
+    :param redis: Асинхронный клиент Redis.
+    :param embeddings: Модель эмбеддингов для векторизации запросов.
+    :param similarity_threshold: Минимальное косинусное сходство для попадания в кэш.
+    :param ttl: Время жизни записи в секундах.
+    :param max_size: Максимальное количество записей в кэше.
+    :param namespace: Префикс ключей Redis.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            embeddings: Embeddings,
+            similarity_threshold: float,
+            ttl: int,
+            max_size: int,
+            namespace: str = "semantic_cache",
+    ) -> None:
+        self.redis = redis
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._log_key = f"{namespace}:log"
+        self._generation_key = f"{namespace}:generation"
+        self._lock = asyncio.Lock()
+        self._generation: bytes | None = None
+        self._last_id = "0-0"
+        self._created_at: list[float] = []
+        self._responses: list[str] = []
+        self._vectors: np.ndarray | None = None
+
+    def _reset(self, generation: bytes | None) -> None:
+        self._generation = generation
+        self._last_id = "0-0"
+        self._created_at, self._responses, self._vectors = [], [], None
+
+    def _append(self, entries: list[tuple[bytes, dict[bytes, bytes]]]) -> None:
+        if not entries:
+            return
+        vectors = [np.frombuffer(fields[b"vector"], dtype=np.float32) for _, fields in entries]
+        self._created_at.extend(float(fields[b"created_at"]) for _, fields in entries)
+        self._responses.extend(fields[b"response"].decode("utf-8") for _, fields in entries)
+        stacked = np.vstack(vectors)
+        self._vectors = stacked if self._vectors is None else np.vstack([self._vectors, stacked])
+        self._last_id = entries[-1][0].decode("utf-8")
+        # Локальная копия ограничена тем же размером, что и поток в Redis
+        overflow = len(self._responses) - self.max_size
+        if overflow > 0:
+            del self._created_at[:overflow], self._responses[:overflow]
+            self._vectors = self._vectors[overflow:]
+
+    async def _sync(self) -> None:
+        """Дочитывает новые записи кэша из Redis в локальную копию"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self._generation_key)
+            pipe.xrange(self._log_key, min=f"({self._last_id}")
+            generation, entries = await pipe.execute()
+        if generation != self._generation:
+            self._reset(generation)
+            entries = await self.redis.xrange(self._log_key)
+        self._append(entries)
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    async def lookup(self, query: str) -> tuple[str | None, list[float]]:
+        """Ищет сохранённый ответ на семантически близкий запрос.
+
+        :param query: Запрос пользователя.
+        :return Найденный ответ (или None) и эмбеддинг запроса.
+        """
+        embedding = await self.embeddings.aembed_query(query)
+        async with self._lock:
+            await self._sync()
+            if self._vectors is None:
+                semantic_cache_misses.inc()
+                return None, embedding
+            similarities = self._vectors @ self._normalize(embedding)
+            expired = np.asarray(self._created_at) < time.time() - self.ttl
+            similarities[expired] = -1.0
+            index = int(np.argmax(similarities))
+            if similarities[index] < self.similarity_threshold:
+                semantic_cache_misses.inc()
+                return None, embedding
+            semantic_cache_hits.inc()
+            logger.info("Semantic cache hit with similarity %.3f", similarities[index])
+            return self._responses[index], embedding
+
+    async def store(self, query: str, response: str, embedding: list[float]) -> None:
+        """Сохраняет ответ агента в кэш.
+
+        :param query: Запрос пользователя.
+        :param response: Ответ агента.
+        :param embedding: Эмбеддинг запроса.
+        """
+        fields = {
+            "query": query,
+            "response": response,
+            "vector": self._normalize(embedding).tobytes(),
+            "created_at": time.time(),
+        }
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(self._log_key, fields, maxlen=self.max_size, approximate=False)
+            pipe.expire(self._log_key, self.ttl)
+            await pipe.execute()
+
+    async def clear(self) -> None:
+        """Инвалидирует кэш, например после изменения базы знаний"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._log_key)
+            pipe.incr(self._generation_key)
+            await pipe.execute()
+        logger.info("Semantic cache invalidated")
+
+
+class IndexGeneration:
+    """Счётчик поколений базы знаний, увеличивается при каждом её изменении.
+
+    Включается в ключи кэшей, зависящих от содержимого индекса, что позволяет
+    инвалидировать их без сканирования ключей. Значение кэшируется в процессе
+    на refresh_interval секунд.
+
+    :param redis: Асинхронный клиент Redis.
+    :param refresh_interval: Интервал обновления локального значения в секундах.
+    :param key: Ключ счётчика в Redis.
+    """
+
+    def __init__(
+            self, redis: Redis, refresh_interval: float = 1.0, key: str = "index_generation"
+    ) -> None:
+        self.redis = redis
+        self.refresh_interval = refresh_interval
+        self.key = key
+        self._value = 0
+        self._refreshed_at = float("-inf")
+
+    async def get(self) -> int:
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self._value = int(await self.redis.get(self.key) or 0)
+            self._refreshed_at = time.monotonic()
+        return self._value
+
+    async def bump(self) -> int:
+        self._value = await self.redis.incr(self.key)
+        self._refreshed_at = time.monotonic()
+        logger.info("Index generation bumped to %s", self._value)
+        return self._value
+
+
+class TwoLevelCache:
+    """Двухуровневый кэш: LRU в памяти процесса (L1) и Redis (L2).
+
+    Значения должны сериализоваться в JSON. При попадании в L2 значение
+    переносится в L1.
+
+    :param redis: Асинхронный клиент Redis.
+    :param name: Название кэша, используется как префикс ключей и метка метрик.
+    :param ttl: Время жизни записи в Redis в секундах.
+    :param local_max_items: Максимальное количество записей в памяти процесса.
+    :param local_ttl: Время жизни записи в памяти процесса в секундах.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            name: str,
+            ttl: int,
+            local_max_items: int = 1024,
+            local_ttl: float = 60.0,
+    ) -> None:
+        self.redis = redis
+        self.name = name
+        self.ttl = ttl
+        self.local_max_items = local_max_items
+        self.local_ttl = local_ttl
+        self._local: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def _set_local(self, key: str, value: Any) -> None:
+        self._local[key] = (time.monotonic() + self.local_ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_max_items:
+            self._local.popitem(last=False)
+
+    async def get(self, key: str) -> Any | None:
+        item = self._local.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._local.move_to_end(key)
+                cache_requests.labels(cache=self.name, result="l1_hit").inc()
+                return value
+            del self._local[key]
+        data = await self.redis.get(f"{self.name}:{key}")
+        if data is None:
+            cache_requests.labels(cache=self.name, result="miss").inc()
+            return None
+        value = json.loads(data)
+        self._set_local(key, value)
+        cache_requests.labels(cache=self.name, result="l2_hit").inc()
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        self._set_local(key, value)
+        await self.redis.set(
+            f"{self.name}:{key}", json.dumps(value, ensure_ascii=False), ex=self.ttl
+        )
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import Counter
+from collections.abc import Awaitable, Callable
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockError
+
+from .metrics import coalesced_requests
+
+logger = logging.getLogger(__name__)
+
+RESULT_READY = "ready"
+RESULT_FAILED = "failed"
+
+
+class SingleFlight[T]:
+    """Объединение одинаковых конкурентных вызовов внутри процесса (single-flight).
+
+    Первый вызов по ключу запускает функцию в отдельной задаче, остальные ожидают
+    её результат. Отмена одного из ожидающих не отменяет общий вызов, он отменяется
+    только когда не осталось ни одного ожидающего (например, все клиенты отключились).
+
+    :param name: Название операции, используется в метриках.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: dict[str, asyncio.Task[T]] = {}
+        self._waiters: Counter[str] = Counter()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._execute(key, func))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            coalesced_requests.labels(operation=self.name, scope="local").inc()
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                # Новый вызов с тем же ключом не должен присоединиться к отменяемой задаче
+                self._forget(key, task)
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] <= 0:
+                del self._waiters[key]
+
+    def _forget(self, key: str, task: asyncio.Task[T]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def _execute(  # noqa: PLR6301
+            self, key: str, func: Callable[[], Awaitable[T]]  # noqa: ARG002
+    ) -> T:
+        return await func()
+
+
+class DistributedSingleFlight[T](SingleFlight[T]):
+    """Объединение одинаковых вызовов между процессами (воркерами uvicorn и брокера).
+
+    Внутри процесса вызовы объединяются как в SingleFlight. Между процессами
+    лидер захватывает Redis блокировку, а после выполнения сохраняет результат
+    на короткое время и оповещает остальных через pub/sub. Если лидер не успел
+    за wait_timeout или завершился с ошибкой, процесс выполняет функцию сам.
+
+    :param redis: Асинхронный клиент Redis.
+    :param name: Название операции, используется в ключах и метриках.
+    :param encode: Сериализация результата в строку.
+    :param decode: Десериализация результата.
+    :param lock_ttl: Время жизни блокировки лидера в секундах.
+    :param wait_timeout: Максимальное время ожидания результата лидера в секундах.
+    :param result_ttl: Время хранения результата в Redis в секундах.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            name: str,
+            encode: Callable[[T], str],
+            decode: Callable[[bytes], T],
+            lock_ttl: float = 60.0,
+            wait_timeout: float = 60.0,
+            result_ttl: int = 10,
+    ) -> None:
+        super().__init__(name)
+        self.redis = redis
+        self.encode = encode
+        self.decode = decode
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+
+    async def _execute(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        channel = f"singleflight:{self.name}:{key}"
+        result_key = f"{channel}:result"
+        lock = self.redis.lock(f"{channel}:lock", timeout=self.lock_ttl)
+        if await lock.acquire(blocking=False):
+            return await self._lead(channel, result_key, lock, func)
+        async with self.redis.pubsub() as pubsub:
+            await pubsub.subscribe(channel)
+            # Результат мог быть опубликован до подписки
+            data = await self.redis.get(result_key)
+            if data is None:
+                status = await self._wait_for_leader(pubsub)
+                data = await self.redis.get(result_key) if status == RESULT_READY else None
+        if data is None:
+            logger.warning(
+                "No result from %s leader for key %s, executing locally", self.name, key
+            )
+            return await func()
+        coalesced_requests.labels(operation=self.name, scope="distributed").inc()
+        return self.decode(data)
+
+    async def _lead(
+            self, channel: str, result_key: str, lock: Lock, func: Callable[[], Awaitable[T]]
+    ) -> T:
+        try:
+            result = await func()
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.set(result_key, self.encode(result), ex=self.result_ttl)
+                pipe.publish(channel, RESULT_READY)
+                await pipe.execute()
+        except BaseException:
+            await self.redis.publish(channel, RESULT_FAILED)
+            raise
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                logger.warning("Lock %s expired before %s leader finished", lock.name, self.name)
+        return result
+
+    async def _wait_for_leader(self, pubsub: PubSub) -> str | None:
+        try:
+            async with asyncio.timeout(self.wait_timeout):
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        return message["data"].decode("utf-8")
+        except TimeoutError:
+            return None
+        return None
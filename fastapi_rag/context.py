@@ -0,0 +1,86 @@
+import math
+import re
+from collections.abc import Sequence
+
+from langchain_core.documents import Document
+
+from .schemas import HistoryEntry
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+SHINGLE_SIZE = 3
+
+
+def estimate_tokens(text: str, chars_per_token: float) -> int:
+    """Приблизительная оценка количества токенов без обращения к токенизатору LLM"""
+    return math.ceil(len(text) / chars_per_token)
+
+
+def build_shingles(text: str) -> set[tuple[str, ...]]:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def get_score(document: Document) -> float:
+    return document.metadata.get("score", 0.0)
+
+
+def order_by_score(documents: Sequence[Document]) -> list[Document]:
+    """Сортирует документы по убыванию итогового (fused) скора"""
+    return sorted(documents, key=get_score, reverse=True)
+
+
+def deduplicate_documents(documents: Sequence[Document], threshold: float) -> list[Document]:
+    """Удаляет почти дублирующиеся и перекрывающиеся чанки.
+
+    Чанк считается дубликатом, если доля его шинглов, содержащихся в уже выбранном
+    чанке, не меньше порога (перекрытие соседних чанков тоже даёт высокую долю).
+    Документы должны быть отсортированы по убыванию скора, остаётся лучший из дубликатов.
+
+    :param documents: Документы, отсортированные по убыванию скора.
+    :param threshold: Порог доли общих шинглов от 0 до 1.
+    """
+    selected: list[tuple[Document, set[tuple[str, ...]]]] = []
+    for document in documents:
+        shingles = build_shingles(document.page_content)
+        is_duplicate = any(
+            len(shingles & other) / max(min(len(shingles), len(other)), 1) >= threshold
+            for _, other in selected
+        ) if shingles else True
+        if not is_duplicate:
+            selected.append((document, shingles))
+    return [document for document, _ in selected]
+
+
+def pack_history(
+        entries: Sequence[HistoryEntry], budget: int, chars_per_token: float
+) -> tuple[list[HistoryEntry], int]:
+    """Оставляет последние сообщения истории, умещающиеся в бюджет токенов.
+
+    :return Сообщения в хронологическом порядке и количество занятых ими токенов.
+    """
+    packed: list[HistoryEntry] = []
+    used = 0
+    for entry in reversed(entries):
+        tokens = estimate_tokens(entry.text, chars_per_token)
+        if used + tokens > budget:
+            break
+        packed.append(entry)
+        used += tokens
+    return list(reversed(packed)), used
+
+
+def pack_documents(
+        documents: Sequence[Document], budget: int, chars_per_token: float
+) -> list[Document]:
+    """Жадно набирает документы в порядке убывания скора, пока они умещаются в бюджет"""
+    packed: list[Document] = []
+    used = 0
+    for document in documents:
+        tokens = estimate_tokens(document.page_content, chars_per_token)
+        if used + tokens > budget:
+            continue
+        packed.append(document)
+        used += tokens
+    return packed
@@ -1,10 +1,12 @@
 from typing import Final
 
+import asyncio
 import sqlite3
+from contextlib import closing
 from datetime import datetime
 from uuid import UUID, uuid4
 
-from sqlalchemy import DateTime, func
+from sqlalchemy import Connection, DateTime, func, text
 from sqlalchemy.ext.asyncio import (
     AsyncAttrs,
     AsyncEngine,
@@ -14,17 +16,29 @@ from sqlalchemy.ext.asyncio import (
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
-from ..settings import DB_PATH, SQLALCHEMY_URL
+from ..settings import DB_PATH, SQLALCHEMY_URL, settings
 
-engine: Final[AsyncEngine] = create_async_engine(url=SQLALCHEMY_URL, echo=True)
+engine: Final[AsyncEngine] = create_async_engine(url=SQLALCHEMY_URL, echo=settings.database.echo)
 
 sessionmaker: Final[async_sessionmaker[AsyncSession]] = async_sessionmaker(
         engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
 )
 
 
-def create_db() -> None:
-    sqlite3.connect(DB_PATH)
+def _create_db_file() -> None:
+    with closing(sqlite3.connect(DB_PATH)):
+        pass
+
+
+async def create_db() -> None:
+    await asyncio.to_thread(_create_db_file)
+
+
+async def ping_db() -> bool:
+    """Проверяет доступность базы данных"""
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    return True
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -38,6 +52,14 @@ class Base(AsyncAttrs, DeclarativeBase):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
 
+def create_indexes(connection: Connection) -> None:
+    """Создаёт индексы, добавленные в модели после создания их таблиц"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def create_tables() -> None:
     async with engine.begin() as connection:
         await connection.run_sync(Base.metadata.create_all)
+        await connection.run_sync(create_indexes)
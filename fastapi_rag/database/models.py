@@ -1,6 +1,6 @@
 from uuid import UUID
 
-from sqlalchemy import CheckConstraint, Text
+from sqlalchemy import CheckConstraint, Index, Text
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -16,6 +16,8 @@ class MessageModel(Base):
 
     __table_args__ = (
         CheckConstraint("role IN ('user', 'ai')", name="check_role_values"),
+        # Чтение истории чата и keyset пагинация по (created_at, id)
+        Index("ix_messages_chat_id_created_at_id", "chat_id", "created_at", "id"),
     )
 
 
@@ -26,3 +28,14 @@ class TaskModel(Base):
     message_id: Mapped[UUID | None] = mapped_column(
         PG_UUID(as_uuid=True), unique=True, nullable=True
     )
+
+
+class IngestionJobModel(Base):
+    __tablename__ = "ingestion_jobs"
+
+    document_id: Mapped[UUID] = mapped_column(PG_UUID(as_uuid=True))
+    filename: Mapped[str]
+    status: Mapped[str]
+    stage: Mapped[str]
+    chunks_count: Mapped[int] = mapped_column(default=0)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -1,19 +1,28 @@
+import base64
+import json
+from datetime import datetime
 from uuid import UUID
 
-from sqlalchemy import func, insert, select, update
+from sqlalchemy import func, insert, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..exceptions import PersistingError, ReadingError, UpdateError
-from ..schemas import ChatHistory, Message, Task
+from ..metrics import track_query
+from ..schemas import ChatHistory, ChatHistoryPage, IngestionJob, Message, Task
 from .base import sessionmaker
-from .models import MessageModel, TaskModel
+from .models import IngestionJobModel, MessageModel, TaskModel
 
 
+@track_query
 async def persist_messages(messages: list[Message]) -> None:
-    """Сохраняет сообщения в базу данных"""
+    """Сохраняет сообщения в базу данных одной транзакцией.
+    Уже сохранённые сообщения (с тем же идентификатором) пропускаются.
+    """
     try:
         async with sessionmaker() as session:
-            stmt = insert(MessageModel)
+            stmt = sqlite_insert(MessageModel).on_conflict_do_nothing(index_elements=["id"])
             values = [message.model_dump() for message in messages]
             await session.execute(stmt, values)
             await session.commit()
@@ -22,6 +31,7 @@ async def persist_messages(messages: list[Message]) -> None:
         raise PersistingError(f"Error while persisting messages, error: {e}") from e
 
 
+@track_query
 async def read_message(id: UUID) -> Message | None:  # noqa: A002
     """Получает сообщение по его уникальному идентификатору"""
     try:
@@ -34,41 +44,104 @@ async def read_message(id: UUID) -> Message | None:  # noqa: A002
         raise ReadingError(f"Error while reading message, error: {e}") from e
 
 
+def encode_cursor(created_at: datetime, id: UUID) -> str:  # noqa: A002
+    """Кодирует позицию последнего сообщения страницы в непрозрачный курсор"""
+    payload = json.dumps([created_at.isoformat(), str(id)])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor))  # noqa: A001
+        return datetime.fromisoformat(created_at), UUID(id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+async def count_chat_messages(session: AsyncSession, chat_id: UUID) -> int:
+    stmt = select(func.count()).select_from(MessageModel).where(MessageModel.chat_id == chat_id)
+    return await session.scalar(stmt)
+
+
+@track_query
 async def read_chat_history(chat_id: UUID, page: int, limit: int) -> ChatHistory:
     try:
         async with sessionmaker() as session:
             stmt = (
-                select(MessageModel, func.count(MessageModel.id).over().label("total_count"))
+                select(MessageModel)
                 .where(MessageModel.chat_id == chat_id)
-                .order_by(MessageModel.created_at.asc())
+                .order_by(MessageModel.created_at.asc(), MessageModel.id.asc())
                 .offset((page - 1) * limit)
                 .limit(limit)
             )
             results = await session.execute(stmt)
-            rows = results.all()
-            if not rows:
-                return ChatHistory(
-                    total_count=0, page=page, limit=limit, chat_id=chat_id, messages=[]
-                )
-            total_count = rows[0].total_count
-            messages = [Message.model_validate(row[0]) for row in rows]
-            return ChatHistory(
-                total_count=total_count, page=page, limit=limit, chat_id=chat_id, messages=messages
-            )
+            messages = [Message.model_validate(model) for model in results.scalars()]
+            total_count = await count_chat_messages(session, chat_id)
+        return ChatHistory(
+            total_count=total_count, page=page, limit=limit, chat_id=chat_id, messages=messages
+        )
     except SQLAlchemyError as e:
         raise ReadingError(f"Error while reading chat history, error: {e}") from e
 
 
+@track_query
+async def read_chat_history_page(
+        chat_id: UUID, limit: int, cursor: str | None = None, with_total: bool = False
+) -> ChatHistoryPage:
+    """Получает страницу истории чата по курсору (keyset пагинация по (created_at, id)).
+
+    :param chat_id: Идентификатор чата.
+    :param limit: Количество сообщений на странице.
+    :param cursor: Курсор, полученный с предыдущей страницы.
+    :param with_total: Нужно ли посчитать общее количество сообщений в чате.
+    :return Страница истории и курсор следующей страницы.
+    """
+    stmt = (
+        select(MessageModel)
+        .where(MessageModel.chat_id == chat_id)
+        .order_by(MessageModel.created_at.asc(), MessageModel.id.asc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        stmt = stmt.where(
+            tuple_(MessageModel.created_at, MessageModel.id) > tuple_(*decode_cursor(cursor))
+        )
+    try:
+        async with sessionmaker() as session:
+            results = await session.execute(stmt)
+            models = list(results.scalars())
+            total_count = await count_chat_messages(session, chat_id) if with_total else None
+    except SQLAlchemyError as e:
+        raise ReadingError(f"Error while reading chat history, error: {e}") from e
+    next_cursor = None
+    if len(models) > limit:
+        models = models[:limit]
+        next_cursor = encode_cursor(models[-1].created_at, models[-1].id)
+    return ChatHistoryPage(
+        chat_id=chat_id,
+        limit=limit,
+        messages=[Message.model_validate(model) for model in models],
+        next_cursor=next_cursor,
+        total_count=total_count,
+    )
+
+
+@track_query
 async def persist_task(task: Task) -> None:
     try:
         async with sessionmaker() as session:
-            stmt = insert(TaskModel).values(**task.model_dump())
+            stmt = insert(TaskModel).values(
+                id=task.id,
+                status=task.status,
+                message_id=task.message.id if task.message is not None else None,
+            )
             await session.execute(stmt)
             await session.commit()
     except SQLAlchemyError as e:
         raise PersistingError(f"Error while persisting task, error: {e}") from e
 
 
+@track_query
 async def read_task(task_id: UUID) -> Task | None:
     try:
         async with sessionmaker() as session:
@@ -92,6 +165,7 @@ async def read_task(task_id: UUID) -> Task | None:
         raise ReadingError(f"Error while reading task, error: {e}") from e
 
 
+@track_query
 async def update_task(task_id: UUID, **kwargs) -> None:
     try:
         async with sessionmaker() as session:
@@ -106,3 +180,42 @@ async def update_task(task_id: UUID, **kwargs) -> None:
     except SQLAlchemyError as e:
         await session.rollback()
         raise UpdateError(f"Error while update task, error: {e}") from e
+
+
+@track_query
+async def persist_ingestion_job(job: IngestionJob) -> None:
+    try:
+        async with sessionmaker() as session:
+            stmt = insert(IngestionJobModel).values(**job.model_dump())
+            await session.execute(stmt)
+            await session.commit()
+    except SQLAlchemyError as e:
+        raise PersistingError(f"Error while persisting ingestion job, error: {e}") from e
+
+
+@track_query
+async def read_ingestion_job(job_id: UUID) -> IngestionJob | None:
+    try:
+        async with sessionmaker() as session:
+            stmt = select(IngestionJobModel).where(IngestionJobModel.id == job_id)
+            result = await session.execute(stmt)
+            model = result.scalar_one_or_none()
+        return IngestionJob.model_validate(model) if model else None
+    except SQLAlchemyError as e:
+        raise ReadingError(f"Error while reading ingestion job, error: {e}") from e
+
+
+@track_query
+async def update_ingestion_job(job_id: UUID, **kwargs) -> None:
+    try:
+        async with sessionmaker() as session:
+            stmt = (
+                update(IngestionJobModel)
+                .where(IngestionJobModel.id == job_id)
+                .values(**kwargs)
+            )
+            await session.execute(stmt)
+            await session.commit()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise UpdateError(f"Error while update ingestion job, error: {e}") from e
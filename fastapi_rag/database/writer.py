@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from collections.abc import Sequence
+
+from ..background import run_in_background
+from ..metrics import messages_flush_size
+from ..schemas import Message
+from .queries import persist_messages
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """Отложенная (write-behind) пакетная запись сообщений в базу данных.
+
+    Сообщения копятся до max_batch_size штук или max_wait_ms миллисекунд и
+    сохраняются одной транзакцией. Вставка идемпотентна по идентификатору
+    сообщения, поэтому повторная доставка и повтор записи не создают дубликатов.
+    Вызывающий дожидается фиксации своего пакета, брокер подтверждает сообщение
+    только после записи.
+
+    :param max_batch_size: Максимальное количество сообщений в пакете.
+    :param max_wait_ms: Максимальное время ожидания наполнения пакета в миллисекундах.
+    :param max_retries: Количество повторов записи пакета при ошибке.
+    :param retry_backoff: Базовая задержка между повторами в секундах.
+    """
+
+    def __init__(
+            self,
+            max_batch_size: int = 100,
+            max_wait_ms: float = 50.0,
+            max_retries: int = 3,
+            retry_backoff: float = 0.5,
+    ) -> None:
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._pending: list[tuple[list[Message], asyncio.Future[None]]] = []
+        self._pending_count = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task[None]] = set()
+
+    async def write(self, messages: Sequence[Message]) -> None:
+        """Добавляет сообщения в буфер и ожидает их сохранения"""
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[None] = loop.create_future()
+        self._pending.append((list(messages), future))
+        self._pending_count += len(messages)
+        if self._pending_count >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+        await future
+
+    async def close(self) -> None:
+        """Сохраняет накопленные сообщения и дожидается завершения всех записей"""
+        self._dispatch()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_count = self._pending, [], 0
+        if batch:
+            task = run_in_background(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: list[tuple[list[Message], asyncio.Future[None]]]) -> None:
+        messages = [message for messages, _ in batch for message in messages]
+        messages_flush_size.observe(len(messages))
+        attempt = 0
+        while True:
+            try:
+                await persist_messages(messages)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.exception("Failed to persist %s messages", len(messages))
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    return
+                delay = self.retry_backoff * 2 ** attempt
+                attempt += 1
+                logger.warning("Messages persisting failed (%s), retrying in %.1f s", e, delay)
+                await asyncio.sleep(delay)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
@@ -0,0 +1,117 @@
+from typing import Any
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Mapping
+from contextlib import suppress
+from dataclasses import dataclass, field
+
+from faststream import BaseMiddleware
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from .metrics import broker_dead_letters
+
+logger = logging.getLogger(__name__)
+
+DeadLetterHandler = Callable[[bytes], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class DeliveryOptions:
+    """Параметры доставки сообщений Redis Streams группе потребителей.
+
+    :param redis: Функция получения асинхронного клиента Redis.
+    :param group: Группа потребителей.
+    :param consumer: Имя потребителя текущего процесса.
+    :param max_deliveries: Количество попыток доставки, после которого сообщение
+    переносится в dead-letter stream.
+    :param claim_refresh_interval: Период продления владения обрабатываемым сообщением в секундах.
+    :param on_dead_letter: Обработчики тел сообщений, перенесённых в dead-letter stream,
+    по названиям Redis Streams (например, для перевода задачи в статус ошибки).
+    """
+    redis: Callable[[], Redis]
+    group: str
+    consumer: str
+    max_deliveries: int = 5
+    claim_refresh_interval: float = 60.0
+    on_dead_letter: Mapping[str, DeadLetterHandler] = field(default_factory=dict)
+
+
+def dead_letter_stream(stream: str) -> str:
+    return f"{stream}:dead"
+
+
+class DeliveryMiddleware(BaseMiddleware):
+    """Ограничение повторных доставок и продление владения сообщениями Redis Streams.
+
+    Неподтверждённое сообщение забирается другим потребителем через XAUTOCLAIM
+    после min_idle_time. Пока сообщение обрабатывается, владение им периодически
+    продлевается (XCLAIM JUSTID не увеличивает счётчик доставок), поэтому долгие
+    задачи не обрабатываются повторно. Сообщение, доставленное больше max_deliveries
+    раз (например, роняющее воркер), переносится в dead-letter stream и подтверждается.
+    """
+
+    def __init__(self, msg: Any, /, *, context: Any, options: DeliveryOptions) -> None:
+        super().__init__(msg, context=context)
+        self.options = options
+
+    async def _read_pending(self, stream: str, message_id: bytes) -> dict[str, Any] | None:
+        entries = await self.options.redis().xpending_range(
+            stream, self.options.group, min=message_id, max=message_id, count=1
+        )
+        return entries[0] if entries else None
+
+    async def _refresh_claim(self, stream: str, message_id: bytes) -> None:
+        consumer = self.options.consumer.encode("utf-8")
+        while True:
+            await asyncio.sleep(self.options.claim_refresh_interval)
+            try:
+                entry = await self._read_pending(stream, message_id)
+                if entry is None or entry["consumer"] != consumer:
+                    logger.warning(
+                        "Message %s of %s was claimed by another consumer", message_id, stream
+                    )
+                    return
+                await self.options.redis().xclaim(
+                    stream, self.options.group, self.options.consumer,
+                    min_idle_time=0, message_ids=[message_id], justid=True,
+                )
+            except RedisError:
+                logger.warning("Failed to refresh claim of %s", message_id, exc_info=True)
+
+    async def _dead_letter(
+            self, msg: Any, stream: str, message_id: bytes, deliveries: int
+    ) -> None:
+        await self.options.redis().xadd(
+            dead_letter_stream(stream),
+            {**msg.raw_message["data"], "message_id": message_id, "deliveries": deliveries},
+        )
+        broker_dead_letters.labels(stream=stream).inc()
+        logger.error(
+            "Message %s of %s moved to %s after %s deliveries",
+            message_id, stream, dead_letter_stream(stream), deliveries,
+        )
+        handler = self.options.on_dead_letter.get(stream)
+        if handler is not None:
+            await handler(msg.body)
+
+    async def consume_scope(
+            self, call_next: Callable[[Any], Awaitable[Any]], msg: Any
+    ) -> Any:
+        if msg.raw_message.get("type") != "stream":
+            return await call_next(msg)
+        stream, message_id = msg.raw_message["channel"], msg.raw_message["message_ids"][0]
+        entry = await self._read_pending(stream, message_id)
+        deliveries = entry["times_delivered"] if entry is not None else 1
+        if deliveries > self.options.max_deliveries:
+            # Возврат без исключения подтверждает сообщение
+            await self._dead_letter(msg, stream, message_id, deliveries)
+            return None
+        refresh = asyncio.create_task(self._refresh_claim(stream, message_id))
+        try:
+            return await call_next(msg)
+        finally:
+            refresh.cancel()
+            with suppress(asyncio.CancelledError):
+                await refresh
@@ -1,72 +1,391 @@
-from typing import Final
+from typing import TYPE_CHECKING, Final
 
-from elasticsearch import Elasticsearch
-from embeddings_service.langchain import RemoteHTTPEmbeddings
-from langchain.retrievers import EnsembleRetriever
-from langchain_community.retrievers import ElasticSearchBM25Retriever
+import asyncio
+import json
+from collections.abc import Callable
+
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseChatModel
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.vectorstores import VectorStore
-from langchain_elasticsearch import ElasticsearchStore
-from langchain_gigachat import GigaChat
-from langchain_text_splitters import (
-    MarkdownHeaderTextSplitter,
-    RecursiveCharacterTextSplitter,
-    TextSplitter,
-)
 from redis.asyncio import Redis
 
+from .cache import IndexGeneration, SemanticCache, TwoLevelCache
+from .coalescing import DistributedSingleFlight, SingleFlight
+from .embeddings import (
+    CachedEmbeddings,
+    InstrumentedEmbeddings,
+    LocalEmbeddings,
+    MicroBatchingEmbeddings,
+)
+from .history import ConversationHistoryStore, ConversationSummaryStore
+from .instrumentation import LLMMetricsHandler
+from .lifecycle import Lazy
+from .notifications import TaskNotifier
+from .rerankers import CrossEncoderReranker
 from .settings import settings
+from .summarization import ConversationSummarizer
+
+if TYPE_CHECKING:
+    from elasticsearch import AsyncElasticsearch, Elasticsearch
+    from langchain_text_splitters import MarkdownHeaderTextSplitter, TextSplitter
+
+    from .ingestion import IngestionWriter
+
+# Клиенты Elasticsearch, GigaChat, сервиса эмбеддингов и сплиттеры импортируются
+# и создаются при первом обращении, импорт модуля не требует тяжёлых зависимостей
 
 TIMEOUT = 120
+INDEX_NAME = "rag-index"
+
+get_redis: Final[Lazy[Redis]] = Lazy(lambda: Redis.from_url(settings.redis.url), name="redis")
 
-redis: Final[Redis] = Redis.from_url(settings.redis.url)
+get_history_store: Final[Lazy[ConversationHistoryStore]] = Lazy(
+    lambda: ConversationHistoryStore(
+        redis=get_redis(),
+        ttl=settings.redis.ttl,
+        max_length=settings.rag.max_conversation_history_length,
+    ),
+    name="history_store",
+)
 
-md_splitter: Final[MarkdownHeaderTextSplitter] = MarkdownHeaderTextSplitter(
-    headers_to_split_on=[("#", "h1")]
+get_summary_store: Final[Lazy[ConversationSummaryStore]] = Lazy(
+    lambda: ConversationSummaryStore(redis=get_redis(), ttl=settings.redis.ttl),
+    name="summary_store",
 )
 
-text_splitter: Final[TextSplitter] = RecursiveCharacterTextSplitter(
-    chunk_size=settings.rag.chunk_size,
-    chunk_overlap=settings.rag.chunk_overlap,
-    length_function=len,
-    separators=["\n#"],
+get_task_notifier: Final[Lazy[TaskNotifier]] = Lazy(
+    lambda: TaskNotifier(redis=get_redis(), ttl=settings.redis.ttl), name="task_notifier"
 )
 
-embeddings: Final[Embeddings] = RemoteHTTPEmbeddings(
-    base_url=settings.embeddings.base_url, normalize_embeddings=False, timeout=TIMEOUT
+
+def create_md_splitter() -> "MarkdownHeaderTextSplitter":
+    from langchain_text_splitters import MarkdownHeaderTextSplitter  # noqa: PLC0415
+
+    return MarkdownHeaderTextSplitter(headers_to_split_on=[("#", "h1")])
+
+
+def create_text_splitter() -> "TextSplitter":
+    from langchain_text_splitters import RecursiveCharacterTextSplitter  # noqa: PLC0415
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=settings.rag.chunk_size,
+        chunk_overlap=settings.rag.chunk_overlap,
+        length_function=len,
+        separators=["\n#"],
+    )
+
+
+get_md_splitter: Final[Lazy["MarkdownHeaderTextSplitter"]] = Lazy(
+    create_md_splitter, name="md_splitter"
+)
+
+get_text_splitter: Final[Lazy["TextSplitter"]] = Lazy(create_text_splitter, name="text_splitter")
+
+
+def create_embeddings() -> Embeddings:
+    """Создаёт эмбеддинги выбранного в настройках бэкенда"""
+    match settings.embeddings.backend:
+        case "local":
+            return LocalEmbeddings(
+                model_name=settings.embeddings.model_name,
+                normalize=settings.embeddings.normalize,
+                batch_size=settings.embeddings.batch_size,
+                max_workers=settings.embeddings.max_workers,
+                max_queue_size=settings.embeddings.max_queue_size,
+                queue_timeout=settings.embeddings.queue_timeout,
+                device=settings.embeddings.device,
+            )
+        case _:
+            from embeddings_service.langchain import RemoteHTTPEmbeddings  # noqa: PLC0415
+
+            return RemoteHTTPEmbeddings(
+                base_url=settings.embeddings.base_url,
+                normalize_embeddings=settings.embeddings.normalize,
+                timeout=TIMEOUT,
+            )
+
+
+get_embeddings: Final[Lazy[Embeddings]] = Lazy(create_embeddings, name="embeddings")
+
+get_index_generation: Final[Lazy[IndexGeneration]] = Lazy(
+    lambda: IndexGeneration(
+        redis=get_redis(),
+        refresh_interval=settings.retrieval_cache.generation_refresh_interval,
+    ),
+    name="index_generation",
+)
+
+
+def create_query_embeddings() -> Embeddings:
+    """Создаёт эмбеддинги запросов пользователей: конкурентные запросы объединяются
+    в батчи, векторы повторяющихся запросов кэшируются.
+    """
+    query_embeddings = InstrumentedEmbeddings(get_embeddings(), operation="query")
+    if settings.embeddings.micro_batching:
+        query_embeddings = MicroBatchingEmbeddings(
+            query_embeddings,
+            max_batch_size=settings.embeddings.micro_batch_size,
+            max_wait_ms=settings.embeddings.micro_batch_wait_ms,
+        )
+    if settings.retrieval_cache.enabled:
+        query_embeddings = CachedEmbeddings(query_embeddings, TwoLevelCache(
+            redis=get_redis(),
+            name="query_embeddings",
+            ttl=settings.retrieval_cache.embeddings_ttl,
+            local_max_items=settings.retrieval_cache.local_max_items,
+            local_ttl=settings.retrieval_cache.local_ttl,
+        ))
+    return query_embeddings
+
+
+get_query_embeddings: Final[Lazy[Embeddings]] = Lazy(
+    create_query_embeddings, name="query_embeddings"
+)
+
+
+def create_elasticsearch() -> "AsyncElasticsearch":
+    from elasticsearch import AsyncElasticsearch  # noqa: PLC0415
+
+    return AsyncElasticsearch(settings.elasticsearch.url)
+
+
+get_elasticsearch: Final[Lazy["AsyncElasticsearch"]] = Lazy(
+    create_elasticsearch, name="elasticsearch"
+)
+
+
+def create_sync_elasticsearch() -> "Elasticsearch":
+    from elasticsearch import Elasticsearch  # noqa: PLC0415
+
+    return Elasticsearch(settings.elasticsearch.url)
+
+
+# Используется только синхронными вызовами ретривера (invoke)
+get_sync_elasticsearch: Final[Lazy["Elasticsearch"]] = Lazy(
+    create_sync_elasticsearch, name="sync_elasticsearch"
 )
 
-vectorstore: Final[VectorStore] = ElasticsearchStore(
-    es_url=settings.elasticsearch.url,
-    index_name="rag-index",
-    embedding=embeddings,
+
+def create_ingestion_writer() -> "IngestionWriter":
+    from .ingestion import IngestionWriter  # noqa: PLC0415
+
+    return IngestionWriter(
+        client=get_elasticsearch(),
+        embeddings=InstrumentedEmbeddings(get_embeddings(), operation="documents"),
+        index_name=INDEX_NAME,
+        batch_size=settings.embeddings.batch_size,
+        concurrency=settings.ingestion.embeddings_concurrency,
+        bulk_chunk_size=settings.ingestion.bulk_chunk_size,
+        refresh=settings.ingestion.refresh,
+        refresh_on_complete=settings.ingestion.refresh_on_complete,
+        max_retries=settings.ingestion.max_retries,
+        retry_backoff=settings.ingestion.retry_backoff,
+    )
+
+
+get_ingestion_writer: Final[Lazy["IngestionWriter"]] = Lazy(
+    create_ingestion_writer, name="ingestion_writer"
 )
 
-elasticsearch: Final[Elasticsearch] = Elasticsearch(settings.elasticsearch.url)
 
-vectorstore_retriever: Final[BaseRetriever] = vectorstore.as_retriever(search_type="similarity")
+def create_retriever() -> BaseRetriever:
+    """Создаёт гибридный ретривер, при включённом кэше - с кэшированием результатов"""
+    from .retrievers import CachedRetriever, ElasticsearchHybridRetriever  # noqa: PLC0415
+
+    k = settings.rag.k
+    if settings.reranker.enabled:
+        # Без запаса кандидатов переранжирование оставило бы все найденные документы
+        k = max(k, settings.reranker.top_n * settings.reranker.candidates_multiplier)
+    retriever = ElasticsearchHybridRetriever(
+        client=get_elasticsearch(),
+        embeddings=get_query_embeddings(),
+        index_name=INDEX_NAME,
+        sync_client=get_sync_elasticsearch,
+        k=k,
+        num_candidates=max(settings.rag.num_candidates, k),
+        vector_weight=settings.rag.vector_weight,
+        bm25_weight=settings.rag.bm25_weight,
+        fusion=settings.rag.fusion,
+    )
+    if not settings.retrieval_cache.enabled:
+        return retriever
+    return CachedRetriever(
+        retriever=retriever,
+        cache=TwoLevelCache(
+            redis=get_redis(),
+            name="retrieval",
+            ttl=settings.retrieval_cache.ttl,
+            local_max_items=settings.retrieval_cache.local_max_items,
+            local_ttl=settings.retrieval_cache.local_ttl,
+        ),
+        generation=get_index_generation(),
+    )
+
+
+get_retriever: Final[Lazy[BaseRetriever]] = Lazy(create_retriever, name="retriever")
 
-bm25_retriever: Final[BaseRetriever] = ElasticSearchBM25Retriever(
-    client=elasticsearch, index_name="rag-index",
+
+def create_single_flight[T](
+        name: str, encode: Callable[[T], str], decode: Callable[[bytes], T]
+) -> SingleFlight[T] | None:
+    """Создаёт объединитель идентичных конкурентных вызовов согласно настройкам"""
+    if not settings.coalescing.enabled:
+        return None
+    if not settings.coalescing.distributed:
+        return SingleFlight(name)
+    return DistributedSingleFlight(
+        redis=get_redis(),
+        name=name,
+        encode=encode,
+        decode=decode,
+        lock_ttl=settings.coalescing.lock_ttl,
+        wait_timeout=settings.coalescing.wait_timeout,
+        result_ttl=settings.coalescing.result_ttl,
+    )
+
+
+def create_retrieval_flight() -> SingleFlight[list[Document]] | None:
+    from .retrievers import dump_documents, load_documents  # noqa: PLC0415
+
+    return create_single_flight(
+        "retrieval",
+        encode=lambda documents: json.dumps(dump_documents(documents), ensure_ascii=False),
+        decode=lambda data: load_documents(json.loads(data)),
+    )
+
+
+get_retrieval_flight: Final[Lazy[SingleFlight[list[Document]] | None]] = Lazy(
+    create_retrieval_flight, name="retrieval_flight"
+)
+
+get_generation_flight: Final[Lazy[SingleFlight[str] | None]] = Lazy(
+    lambda: create_single_flight(
+        "generation", encode=str, decode=lambda data: data.decode("utf-8")
+    ),
+    name="generation_flight",
 )
 
-retriever: Final[BaseRetriever] = EnsembleRetriever(
-    retrievers=[vectorstore_retriever, bm25_retriever], weights=[0.6, 0.4]
+get_semantic_cache: Final[Lazy[SemanticCache]] = Lazy(
+    lambda: SemanticCache(
+        redis=get_redis(),
+        embeddings=get_query_embeddings(),
+        similarity_threshold=settings.semantic_cache.similarity_threshold,
+        ttl=settings.semantic_cache.ttl,
+        max_size=settings.semantic_cache.max_size,
+    ),
+    name="semantic_cache",
 )
 
-llm: Final[BaseChatModel] = GigaChat(
-    credentials=settings.gigachat.apikey,
-    scope=settings.gigachat.scope,
-    model=settings.gigachat.model_name,
-    profanity_check=False,
-    verify_ssl_certs=False,
-    timeout=TIMEOUT,
+get_reranker: Final[Lazy[CrossEncoderReranker | None]] = Lazy(
+    lambda: CrossEncoderReranker(
+        model_name=settings.reranker.model_name,
+        top_n=settings.reranker.top_n,
+        batch_size=settings.reranker.batch_size,
+        backend=settings.reranker.backend,
+        onnx_file_name=settings.reranker.onnx_file_name,
+        max_length=settings.reranker.max_length,
+        cache_size=settings.reranker.cache_size,
+    ) if settings.reranker.enabled else None,
+    name="reranker",
 )
 
 
-def create_index(index_name: str) -> None:
+def create_llm() -> BaseChatModel:
+    from langchain_gigachat import GigaChat  # noqa: PLC0415
+
+    return GigaChat(
+        credentials=settings.gigachat.apikey,
+        scope=settings.gigachat.scope,
+        model=settings.gigachat.model_name,
+        profanity_check=False,
+        verify_ssl_certs=False,
+        timeout=TIMEOUT,
+        callbacks=[LLMMetricsHandler()],
+    )
+
+
+get_llm: Final[Lazy[BaseChatModel]] = Lazy(create_llm, name="llm")
+
+get_conversation_summarizer: Final[Lazy[ConversationSummarizer]] = Lazy(
+    lambda: ConversationSummarizer(
+        history_store=get_history_store(),
+        summary_store=get_summary_store(),
+        llm=get_llm(),
+        keep_last_messages=settings.summarization.keep_last_messages,
+        min_messages=settings.summarization.min_messages,
+        max_words=settings.summarization.max_summary_words,
+        lock_timeout=settings.summarization.lock_timeout,
+    ),
+    name="conversation_summarizer",
+)
+
+
+async def warmup_embeddings(index_name: str) -> None:
+    """Прогревает локальную модель эмбеддингов и проверяет совместимость размерности
+    её векторов с уже проиндексированными в базе знаний.
+    """
+    embeddings = get_embeddings()
+    if not isinstance(embeddings, LocalEmbeddings):
+        return
+    dims = await embeddings.warmup()
+    mapping = await get_elasticsearch().indices.get_mapping(index=index_name)
+    vector_field = mapping[index_name]["mappings"].get("properties", {}).get("vector", {})
+    if "dims" in vector_field and vector_field["dims"] != dims:
+        raise RuntimeError(
+            f"Embeddings model {embeddings.model_name} produces {dims}-dim vectors, "
+            f"but index {index_name} contains {vector_field['dims']}-dim vectors"
+        )
+
+
+async def warmup_reranker() -> None:
+    reranker = get_reranker()
+    if reranker is not None:
+        await reranker.warmup()
+
+
+async def create_index(index_name: str) -> None:
     """Создаёт индекс, если он не был создан"""
-    if not elasticsearch.indices.exists(index=index_name):
-        elasticsearch.indices.create(index=index_name)
+    from .ingestion import INDEX_MAPPINGS  # noqa: PLC0415
+
+    client = get_elasticsearch()
+    if not await client.indices.exists(index=index_name):
+        await client.indices.create(index=index_name, mappings=INDEX_MAPPINGS)
+    elif index_name == INDEX_NAME:
+        # Маппинг существующего индекса проверяется при запуске, а не при первой индексации
+        await get_ingestion_writer().document_id_field()
+
+
+async def check_readiness(timeout: float) -> dict[str, bool]:
+    """Проверяет доступность Redis, Elasticsearch и базы данных.
+
+    :param timeout: Максимальное время каждой проверки в секундах.
+    :return Результат проверки каждой зависимости.
+    """
+    async def check(probe: Callable[[], object]) -> bool:
+        try:
+            return bool(await asyncio.wait_for(probe(), timeout))
+        except Exception:  # noqa: BLE001
+            return False
+
+    from .database.base import ping_db  # noqa: PLC0415
+
+    names = ("redis", "elasticsearch", "database")
+    results = await asyncio.gather(
+        check(lambda: get_redis().ping()),
+        check(lambda: get_elasticsearch().ping()),
+        check(ping_db),
+    )
+    return dict(zip(names, results, strict=True))
+
+
+async def close_clients() -> None:
+    """Закрывает созданные клиенты при остановке процесса"""
+    if get_task_notifier.initialized:
+        await get_task_notifier().close()
+    if get_elasticsearch.initialized:
+        await get_elasticsearch().close()
+    if get_sync_elasticsearch.initialized:
+        get_sync_elasticsearch().close()
+    if get_redis.initialized:
+        await get_redis().aclose()
@@ -0,0 +1,237 @@
+from typing import Any
+
+import asyncio
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from .background import run_in_background
+from .cache import TwoLevelCache
+from .exceptions import OverloadedError
+from .metrics import (
+    embeddings_batch_size,
+    embeddings_duration,
+    embeddings_queue_wait,
+    embeddings_texts,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEmbeddings(Embeddings):
+    """Эмбеддинги sentence-transformers модели внутри процесса приложения.
+
+    Инференс выполняется в выделенном пуле потоков, число одновременно
+    поставленных в пул запросов ограничено. Остальные ожидают освобождения места
+    не дольше queue_timeout, после чего запрос отклоняется с OverloadedError.
+    Для совместимости с уже проиндексированными векторами модель и нормализация
+    должны совпадать с используемыми в embeddings-service.
+
+    :param model_name: Название или путь до sentence-transformers модели.
+    :param normalize: Нормализовать ли векторы.
+    :param batch_size: Размер батча при инференсе.
+    :param max_workers: Количество потоков для инференса.
+    :param max_queue_size: Максимальное число запросов, поставленных в пул потоков.
+    :param queue_timeout: Максимальное время ожидания места в пуле потоков в секундах.
+    :param device: Устройство для инференса.
+    """
+
+    def __init__(
+            self,
+            model_name: str,
+            normalize: bool = False,
+            batch_size: int = 32,
+            max_workers: int = 1,
+            max_queue_size: int = 64,
+            queue_timeout: float = 5.0,
+            device: str = "cpu",
+    ) -> None:
+        self.model_name = model_name
+        self.normalize = normalize
+        self.batch_size = batch_size
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.device = device
+        self._model: Any = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="embeddings"
+        )
+        self._queue_slots = asyncio.Semaphore(max_queue_size)
+
+    def _load_model(self) -> Any:
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer  # noqa: PLC0415
+
+            self._model = SentenceTransformer(self.model_name, device=self.device)
+            logger.info("Embeddings model %s loaded on %s", self.model_name, self.device)
+        return self._model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self._load_model().encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=self.normalize,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        try:
+            await asyncio.wait_for(self._queue_slots.acquire(), self.queue_timeout)
+        except TimeoutError:
+            raise OverloadedError(
+                f"Embeddings queue is full ({self.max_queue_size} requests), "
+                f"no slot freed in {self.queue_timeout} s"
+            ) from None
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self.embed_documents, texts)
+        finally:
+            self._queue_slots.release()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    async def warmup(self) -> int:
+        """Загружает модель и прогоняет тестовый запрос.
+
+        :return Размерность векторов модели.
+        """
+        vector = await self.aembed_query("warmup")
+        return len(vector)
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """Динамический микро-батчинг запросов эмбеддингов от конкурентных корутин.
+
+    Запросы aembed_query копятся до max_batch_size штук или max_wait_ms миллисекунд,
+    после чего отправляются одним батчевым вызовом, каждый вызывающий получает свой вектор.
+    Батч считается через aembed_documents, поэтому модель должна одинаково
+    векторизовать запросы и документы.
+
+    :param embeddings: Исходная модель эмбеддингов.
+    :param max_batch_size: Максимальный размер батча.
+    :param max_wait_ms: Максимальное время ожидания наполнения батча в миллисекундах.
+    """
+
+    def __init__(
+            self, embeddings: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 5.0
+    ) -> None:
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: list[tuple[str, asyncio.Future[list[float]], float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[list[float]] = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+        return await future
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            run_in_background(self._embed_batch(batch))
+
+    async def _embed_batch(self, batch: list[tuple[str, asyncio.Future, float]]) -> None:
+        dispatched_at = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            embeddings_queue_wait.observe(dispatched_at - enqueued_at)
+        # Одинаковые тексты в батче векторизуются один раз
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        embeddings_batch_size.observe(len(texts))
+        try:
+            vectors = dict(zip(texts, await self.embeddings.aembed_documents(texts), strict=True))
+        except Exception as e:  # noqa: BLE001
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(vectors[text])
+
+
+class CachedEmbeddings(Embeddings):
+    """Кэширование эмбеддингов запросов в двухуровневом кэше (ключ - хэш точного текста).
+
+    :param embeddings: Исходная модель эмбеддингов.
+    :param cache: Двухуровневый кэш для векторов.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: TwoLevelCache) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        vector = await self.cache.get(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await self.cache.set(key, vector)
+        return vector
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Замер длительности запросов к модели эмбеддингов и количества векторизованных текстов.
+
+    :param embeddings: Исходная модель эмбеддингов.
+    :param operation: Метка операции в метриках (query - запросы пользователей,
+    documents - индексация базы знаний).
+    """
+
+    def __init__(self, embeddings: Embeddings, operation: str) -> None:
+        self.embeddings = embeddings
+        self.operation = operation
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        embeddings_texts.labels(operation=self.operation).inc(len(texts))
+        with embeddings_duration.labels(operation=self.operation).time():
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        embeddings_texts.labels(operation=self.operation).inc()
+        with embeddings_duration.labels(operation=self.operation).time():
+            return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        embeddings_texts.labels(operation=self.operation).inc(len(texts))
+        with embeddings_duration.labels(operation=self.operation).time():
+            return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        embeddings_texts.labels(operation=self.operation).inc()
+        with embeddings_duration.labels(operation=self.operation).time():
+            return await self.embeddings.aembed_query(text)
@@ -17,3 +17,18 @@ class ReadingError(AppError):
 class UpdateError(AppError):
     def __init__(self, message: str, code: str = "UPDATE_FAILED") -> None:
         super().__init__(message, code)
+
+
+class ParsingError(AppError):
+    def __init__(self, message: str, code: str = "PARSING_FAILED") -> None:
+        super().__init__(message, code)
+
+
+class IndexingError(AppError):
+    def __init__(self, message: str, code: str = "INDEXING_FAILED") -> None:
+        super().__init__(message, code)
+
+
+class OverloadedError(AppError):
+    def __init__(self, message: str, code: str = "OVERLOADED") -> None:
+        super().__init__(message, code)
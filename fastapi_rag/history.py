@@ -0,0 +1,126 @@
+import json
+import time
+from collections.abc import Sequence
+from uuid import UUID
+
+from redis.asyncio import Redis
+
+from .schemas import ConversationSummary, HistoryEntry, Role
+
+# Компактные обозначения ролей для хранения в Redis
+ROLE_CODES: dict[Role, str] = {Role.USER: "u", Role.AI: "a"}
+CODE_ROLES: dict[str, Role] = {code: role for role, code in ROLE_CODES.items()}
+# Обозначения ролей в промптах
+ROLE_LABELS: dict[Role, str] = {Role.USER: "User", Role.AI: "AI"}
+
+
+def encode_entry(entry: HistoryEntry) -> str:
+    """Кодирует сообщение истории в компактный JSON массив [роль, время, текст]"""
+    return json.dumps(
+        [ROLE_CODES[entry.role], round(entry.timestamp, 3), entry.text],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def decode_entry(data: bytes | str) -> HistoryEntry:
+    role, timestamp, text = json.loads(data)
+    return HistoryEntry(role=CODE_ROLES[role], timestamp=timestamp, text=text)
+
+
+def make_turn(query: str, response: str) -> list[HistoryEntry]:
+    """Создаёт пару сообщений (запрос пользователя, ответ агента) для записи в историю"""
+    timestamp = time.time()
+    return [
+        HistoryEntry(role=Role.USER, text=query, timestamp=timestamp),
+        HistoryEntry(role=Role.AI, text=response, timestamp=timestamp),
+    ]
+
+
+def format_entries(entries: Sequence[HistoryEntry]) -> str:
+    """Форматирует сообщения истории для промпта"""
+    return "\n".join(f"{ROLE_LABELS[entry.role]}: {entry.text}" for entry in entries)
+
+
+class ConversationHistoryStore:
+    """Ограниченное по длине хранилище истории диалогов в Redis.
+
+    История чата хранится в списке (новые сообщения в начале), запись выполняется
+    за один атомарный round trip, чтение - только нужного окна последних сообщений.
+
+    :param redis: Асинхронный клиент Redis.
+    :param ttl: Время жизни истории в секундах.
+    :param max_length: Максимальное количество хранимых сообщений на чат.
+    :param prefix: Префикс ключей Redis.
+    """
+
+    def __init__(
+            self, redis: Redis, ttl: int, max_length: int, prefix: str = "conversation_history:v2"
+    ) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.max_length = max_length
+        self.prefix = prefix
+
+    def build_key(self, chat_id: UUID) -> str:
+        return f"{self.prefix}:{chat_id}"
+
+    async def add(self, chat_id: UUID, entries: Sequence[HistoryEntry]) -> None:
+        """Добавляет сообщения в историю чата (в хронологическом порядке)"""
+        if not entries:
+            return
+        key = self.build_key(chat_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lpush(key, *(encode_entry(entry) for entry in entries))
+            pipe.ltrim(key, 0, self.max_length - 1)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def get(self, chat_id: UUID, limit: int | None = None) -> list[HistoryEntry]:
+        """Получает последние сообщения истории чата в хронологическом порядке.
+
+        :param chat_id: Идентификатор чата.
+        :param limit: Количество последних сообщений, по умолчанию max_length.
+        """
+        stop = min(limit or self.max_length, self.max_length) - 1
+        messages = await self.redis.lrange(self.build_key(chat_id), 0, stop)
+        return [decode_entry(data) for data in reversed(messages)]
+
+    async def exists(self, chat_id: UUID) -> bool:
+        """Проверяет, есть ли у чата сохранённая история"""
+        return bool(await self.redis.exists(self.build_key(chat_id)))
+
+
+class ConversationSummaryStore:
+    """Хранилище сводок диалогов в Redis.
+
+    Сводка обновляется фоновой задачей, блокировка чата не даёт двум задачам
+    одновременно сжать одни и те же сообщения.
+
+    :param redis: Асинхронный клиент Redis.
+    :param ttl: Время жизни сводки в секундах, совпадает со временем жизни истории.
+    :param prefix: Префикс ключей Redis.
+    """
+
+    def __init__(self, redis: Redis, ttl: int, prefix: str = "conversation_summary") -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def build_key(self, chat_id: UUID) -> str:
+        return f"{self.prefix}:{chat_id}"
+
+    async def get(self, chat_id: UUID) -> ConversationSummary | None:
+        data = await self.redis.get(self.build_key(chat_id))
+        return ConversationSummary.model_validate_json(data) if data is not None else None
+
+    async def set(self, chat_id: UUID, summary: ConversationSummary) -> None:
+        await self.redis.set(self.build_key(chat_id), summary.model_dump_json(), ex=self.ttl)
+
+    async def acquire(self, chat_id: UUID, timeout: int) -> bool:
+        """Захватывает блокировку обновления сводки чата на timeout секунд"""
+        key = f"{self.build_key(chat_id)}:lock"
+        return bool(await self.redis.set(key, 1, nx=True, ex=timeout))
+
+    async def release(self, chat_id: UUID) -> None:
+        await self.redis.delete(f"{self.build_key(chat_id)}:lock")
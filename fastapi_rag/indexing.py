@@ -1,69 +1,207 @@
+import asyncio
+import hashlib
+import json
 import logging
-from collections.abc import AsyncGenerator
-from contextlib import asynccontextmanager
+import multiprocessing
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+from uuid import UUID, uuid5
 
-import aiofiles.tempfile
-import pymupdf4llm
-from aiofiles.threadpool.binary import AsyncFileIO
-from docx2md import Converter, DocxFile, DocxMedia
+import aiofiles
+from fastapi import UploadFile
 from langchain_core.documents import Document
 
-from .depends import md_splitter, text_splitter, vectorstore
+from .depends import (
+    get_index_generation,
+    get_ingestion_writer,
+    get_md_splitter,
+    get_semantic_cache,
+    get_text_splitter,
+)
+from .exceptions import ParsingError
+from .parsing import limit_memory, parse_file
+from .schemas import IngestionStage
+from .settings import settings
 
 AVAILABLE_EXTENSIONS: tuple[str, ...] = ("doc", "docx", "pdf", "txt", "md")
 
+PARSED_EXTENSIONS: tuple[str, ...] = ("doc", "docx", "pdf")
+# Запас времени сверх таймаута воркера на передачу результата между процессами
+TIMEOUT_GRACE = 5
+
 logger = logging.getLogger(__name__)
 
+ProgressCallback = Callable[[IngestionStage, int], Awaitable[None]]
+
+# Пространство имён для детерминированных идентификаторов документов по имени файла
+DOCUMENT_NAMESPACE: UUID = UUID("6b0f3f5e-6a43-4c1c-9a3e-9d1f1b6f2a10")
+
+_parsing_executor: ProcessPoolExecutor | None = None
+
+
+def get_parsing_executor() -> ProcessPoolExecutor:
+    """Возвращает пул процессов для парсинга документов, создавая его при первом обращении"""
+    global _parsing_executor  # noqa: PLW0603
+    if _parsing_executor is None:
+        _parsing_executor = ProcessPoolExecutor(
+            max_workers=settings.parsing.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=limit_memory,
+            initargs=(settings.parsing.memory_limit_mb,),
+            max_tasks_per_child=settings.parsing.max_tasks_per_child,
+        )
+    return _parsing_executor
+
+
+def shutdown_parsing_executor() -> None:
+    global _parsing_executor  # noqa: PLW0603
+    if _parsing_executor is not None:
+        _parsing_executor.shutdown(wait=False, cancel_futures=True)
+        _parsing_executor = None
+
+
+async def parse_in_executor(filename: str) -> str:
+    """Выполняет парсинг файла в пуле процессов, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    timeout = settings.parsing.timeout
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(get_parsing_executor(), partial(parse_file, filename, timeout)),
+            timeout=timeout + TIMEOUT_GRACE,
+        )
+    except BrokenProcessPool as e:
+        # Процесс пула аварийно завершился (например, превышен лимит памяти)
+        shutdown_parsing_executor()
+        raise ParsingError(f"Parsing worker crashed while processing {filename}") from e
+    except TimeoutError as e:
+        raise ParsingError(f"Parsing of {filename} timed out after {timeout} s") from e
+    except MemoryError as e:
+        raise ParsingError(f"Parsing of {filename} exceeded memory limit") from e
+
+
+def get_extension(filename: str) -> str:
+    return filename.rsplit(".", maxsplit=1)[-1].lower()
+
+
+def build_document_id(filename: str) -> UUID:
+    """Идентификатор исходного документа, повторная загрузка файла с тем же именем
+    обновляет уже проиндексированный документ.
+    """
+    return uuid5(DOCUMENT_NAMESPACE, filename)
+
+
+def compute_content_hash(document: Document) -> str:
+    payload = json.dumps(
+        [document.page_content, document.metadata], ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-@asynccontextmanager
-async def open_temp_file(data: bytes, suffix: str) -> AsyncGenerator[AsyncFileIO]:
-    """Контекстный менеджер для открытия и работы с временным файлом.
 
-    :param data: Данные (поток байтов), которые нужно записать в файл.
-    :param suffix: Суффикс временного файла.
+def assign_chunk_ids(documents: list[Document], document_id: UUID) -> list[Document]:
+    """Проставляет чанкам хэш содержимого и идентификатор исходного документа.
+
+    Идентификатор чанка детерминирован (документ + хэш), дубликаты внутри документа
+    отбрасываются.
+    """
+    chunks: dict[str, Document] = {}
+    for document in documents:
+        content_hash = compute_content_hash(document)
+        document.metadata.update({"document_id": str(document_id), "content_hash": content_hash})
+        document.id = f"{document_id}:{content_hash}"
+        chunks.setdefault(document.id, document)
+    return list(chunks.values())
+
+
+async def invalidate_caches() -> None:
+    """Инвалидирует кэши, зависящие от содержимого базы знаний"""
+    await get_index_generation().bump()
+    if settings.semantic_cache.enabled:
+        await get_semantic_cache().clear()
+
+
+async def save_upload_file(file: UploadFile, path: Path) -> None:
+    """Потоково сохраняет загруженный файл на диск, не читая его целиком в память.
+
+    :param file: Загруженный файл.
+    :param path: Путь для сохранения.
     """
-    async with aiofiles.tempfile.NamedTemporaryFile(mode="wb", suffix=suffix) as file:
-        await file.write(data)
-        await file.flush()
-        yield file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    async with aiofiles.open(path, mode="wb") as output:
+        while chunk := await file.read(settings.ingestion.upload_chunk_size):
+            await output.write(chunk)
 
 
-async def process_file(file: AsyncFileIO) -> list[Document]:
-    """Обрабатывает и преобразует открытый файл в формат Markdown,
+async def process_file(path: Path) -> list[Document]:
+    """Обрабатывает и преобразует файл в формат Markdown,
     после чего выполняется разделение по h1 заголовкам.
 
-    :param file: Открытый временный файл.
+    :param path: Путь до файла.
     :return Список документов после разбиения по h1.
     """
-    filename = file.name
-    extension = str(filename).split(".")[-1]
-    '''if extension not in AVAILABLE_EXTENSIONS:
+    extension = get_extension(path.name)
+    if extension not in AVAILABLE_EXTENSIONS:
         raise ValueError(
-            f"""Unsupported file format: {extension},
-            supported extensions: {AVAILABLE_EXTENSIONS}"""
-        )'''
-    match extension:
-        case "docx" | "doc":
-            docx = DocxFile(filename)
-            media = DocxMedia(docx)
-            converter = Converter(docx.document(), media, use_md_table=True)
-            md_text = converter.convert()
-            docx.close()
-        case "pdf":
-            md_text = pymupdf4llm.to_markdown(filename)
-            import gc  # noqa: PLC0415
-            gc.collect()
-        case _:
-            md_text = await file.read()
-    logger.info("File %s successfully processed", filename)
-    return md_splitter.split_text(md_text)
-
-
-async def indexing_file(data: bytes, filename: str) -> list[Document]:
-    async with (open_temp_file(
-            data, suffix=f".{filename.rsplit(".", maxsplit=1)[-1]}") as temp_file
-    ):
-        documents = await process_file(temp_file)
-        documents = text_splitter.split_documents(documents)
-        await vectorstore.aadd_documents(documents)
-        return documents
+            f"Unsupported file format: {extension}, supported extensions: {AVAILABLE_EXTENSIONS}"
+        )
+    if extension in PARSED_EXTENSIONS:
+        md_text = await parse_in_executor(str(path))
+    else:
+        async with aiofiles.open(path, encoding="utf-8") as text_file:
+            md_text = await text_file.read()
+    logger.info("File %s successfully processed", path)
+    return get_md_splitter().split_text(md_text)
+
+
+async def indexing_file(
+        path: Path, document_id: UUID, on_progress: ProgressCallback | None = None
+) -> list[Document]:
+    """Инкрементально индексирует файл в базе знаний: парсинг, разбиение на чанки,
+    векторизация и запись только новых или изменившихся чанков, удаление устаревших.
+
+    :param path: Путь до файла.
+    :param document_id: Идентификатор исходного документа.
+    :param on_progress: Функция, вызываемая по завершении каждого этапа индексации.
+    :return Актуальные чанки документа.
+    """
+    async def report(stage: IngestionStage, chunks_count: int) -> None:
+        logger.info("File %s reached stage %s (%s chunks)", path, stage, chunks_count)
+        if on_progress is not None:
+            await on_progress(stage, chunks_count)
+
+    documents = await process_file(path)
+    await report(IngestionStage.PARSED, 0)
+    documents = assign_chunk_ids(get_text_splitter().split_documents(documents), document_id)
+    await report(IngestionStage.CHUNKED, len(documents))
+    ingestion_writer = get_ingestion_writer()
+    existing_ids = await ingestion_writer.read_chunk_ids(str(document_id))
+    new_documents = [document for document in documents if document.id not in existing_ids]
+    vectors = await ingestion_writer.embed(new_documents)
+    await report(IngestionStage.EMBEDDED, len(new_documents))
+    if new_documents:
+        await ingestion_writer.index(new_documents, vectors)
+    stale_ids = existing_ids - {document.id for document in documents}
+    if stale_ids:
+        await ingestion_writer.delete(list(stale_ids))
+    logger.info(
+        "Document %s: %s new, %s unchanged, %s stale chunks",
+        document_id, len(new_documents), len(documents) - len(new_documents), len(stale_ids),
+    )
+    if new_documents or stale_ids:
+        await invalidate_caches()
+    await report(IngestionStage.INDEXED, len(documents))
+    return documents
+
+
+async def delete_document(document_id: UUID) -> int:
+    """Удаляет документ из базы знаний.
+
+    :return Количество удалённых чанков.
+    """
+    deleted = await get_ingestion_writer().delete_document(str(document_id))
+    if deleted:
+        await invalidate_caches()
+    logger.info("Document %s deleted, %s chunks removed", document_id, deleted)
+    return deleted
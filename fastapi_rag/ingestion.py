@@ -0,0 +1,263 @@
+from typing import Any, Literal
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Iterator, Sequence
+from uuid import uuid4
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_scan, async_streaming_bulk
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from .exceptions import IndexingError
+from .metrics import elasticsearch_duration, ingestion_chunks, ingestion_duration
+
+logger = logging.getLogger(__name__)
+
+RETRY_ON_STATUS: tuple[int, ...] = (429, 502, 503, 504)
+
+# Явный маппинг вектора и служебных полей метаданных для точного поиска чанков документа,
+# размерность вектора задаётся первым проиндексированным документом
+INDEX_MAPPINGS: dict[str, Any] = {
+    "properties": {
+        "text": {"type": "text"},
+        "vector": {"type": "dense_vector", "index": True, "similarity": "cosine"},
+        "metadata": {
+            "properties": {
+                "document_id": {"type": "keyword"},
+                "content_hash": {"type": "keyword"},
+            }
+        },
+    }
+}
+
+
+class IngestionWriter:
+    """Запись чанков документов в базу знаний.
+
+    Эмбеддинги считаются батчами по batch_size с ограниченным числом одновременных
+    запросов к сервису эмбеддингов, запись в Elasticsearch выполняется через
+    async bulk helpers. Документы совместимы с форматом ElasticsearchStore.
+
+    :param client: Асинхронный клиент Elasticsearch.
+    :param embeddings: Модель эмбеддингов.
+    :param index_name: Название индекса.
+    :param batch_size: Размер батча для запроса эмбеддингов.
+    :param concurrency: Максимальное число одновременных запросов эмбеддингов.
+    :param bulk_chunk_size: Количество документов в одном bulk запросе.
+    :param refresh: Политика refresh для bulk запросов.
+    :param refresh_on_complete: Выполнять ли refresh индекса после записи всех чанков.
+    :param max_retries: Количество повторов неудавшихся батчей.
+    :param retry_backoff: Начальная задержка перед повтором в секундах.
+    """
+
+    def __init__(
+            self,
+            client: AsyncElasticsearch,
+            embeddings: Embeddings,
+            index_name: str,
+            batch_size: int = 32,
+            concurrency: int = 4,
+            bulk_chunk_size: int = 500,
+            refresh: Literal["true", "false", "wait_for"] = "false",
+            refresh_on_complete: bool = True,
+            max_retries: int = 3,
+            retry_backoff: float = 1.0,
+            text_field: str = "text",
+            vector_field: str = "vector",
+    ) -> None:
+        self.client = client
+        self.embeddings = embeddings
+        self.index_name = index_name
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.bulk_chunk_size = bulk_chunk_size
+        self.refresh = refresh
+        self.refresh_on_complete = refresh_on_complete
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.text_field = text_field
+        self.vector_field = vector_field
+        self._document_id_field: str | None = None
+
+    async def _with_retries[T](self, func: Callable[..., Awaitable[T]], *args: Any) -> T:
+        attempt = 0
+        while True:
+            try:
+                return await func(*args)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise IndexingError(
+                        f"Batch failed after {self.max_retries} retries, error: {e}"
+                    ) from e
+                delay = self.retry_backoff * 2 ** attempt
+                attempt += 1
+                logger.warning("Batch failed (%s), retrying in %.1f s", e, delay)
+                await asyncio.sleep(delay)
+
+    async def embed(self, documents: Sequence[Document]) -> list[list[float]]:
+        """Векторизует чанки батчами с ограниченной конкурентностью"""
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        texts = [document.page_content for document in documents]
+
+        async def embed_batch(batch: list[str]) -> list[list[float]]:
+            async with semaphore:
+                return await self._with_retries(self.embeddings.aembed_documents, batch)
+
+        results = await asyncio.gather(*(
+            embed_batch(texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ))
+        vectors = [vector for batch in results for vector in batch]
+        self._report("embedded", len(vectors), time.perf_counter() - start)
+        return vectors
+
+    def _build_actions(
+            self, documents: Sequence[Document], vectors: Sequence[list[float]]
+    ) -> Iterator[dict[str, Any]]:
+        for document, vector in zip(documents, vectors, strict=True):
+            yield {
+                "_op_type": "index",
+                "_index": self.index_name,
+                "_id": document.id or str(uuid4()),
+                "_source": {
+                    self.text_field: document.page_content,
+                    self.vector_field: vector,
+                    "metadata": document.metadata,
+                },
+            }
+
+    async def index(
+            self, documents: Sequence[Document], vectors: Sequence[list[float]]
+    ) -> int:
+        """Записывает чанки и их векторы в Elasticsearch через bulk API.
+
+        Документы, отклонённые с временными ошибками (429, 5xx), повторяются
+        с экспоненциальной задержкой.
+
+        :return Количество записанных документов.
+        """
+        start = time.perf_counter()
+        indexed, errors = 0, []
+        with elasticsearch_duration.labels(operation="bulk_index").time():
+            async for ok, item in async_streaming_bulk(
+                self.client,
+                self._build_actions(documents, vectors),
+                chunk_size=self.bulk_chunk_size,
+                max_retries=self.max_retries,
+                initial_backoff=self.retry_backoff,
+                retry_on_status=RETRY_ON_STATUS,
+                raise_on_error=False,
+                refresh=self.refresh,
+            ):
+                if ok:
+                    indexed += 1
+                else:
+                    errors.append(item)
+        if self.refresh_on_complete:
+            await self.refresh_index()
+        if errors:
+            raise IndexingError(f"Failed to index {len(errors)} chunks, first error: {errors[0]}")
+        self._report("indexed", indexed, time.perf_counter() - start)
+        return indexed
+
+    async def document_id_field(self) -> str:
+        """Поле для точного поиска чанков документа по его идентификатору.
+
+        В индексе, созданном до появления INDEX_MAPPINGS, metadata.document_id получил
+        динамический маппинг text, term запрос по нему не находит UUID. В таком индексе
+        используется подполе keyword, созданное динамическим маппингом.
+        """
+        if self._document_id_field is None:
+            mapping = await self.client.indices.get_mapping(index=self.index_name)
+            field = (
+                mapping[self.index_name]["mappings"]
+                .get("properties", {}).get("metadata", {})
+                .get("properties", {}).get("document_id", {})
+            )
+            if field.get("type") == "text" and "keyword" in field.get("fields", {}):
+                logger.warning(
+                    "Index %s maps metadata.document_id as text, using its keyword subfield. "
+                    "Reindex into a new index with INDEX_MAPPINGS to fix the mapping",
+                    self.index_name,
+                )
+                self._document_id_field = "metadata.document_id.keyword"
+            else:
+                self._document_id_field = "metadata.document_id"
+        return self._document_id_field
+
+    async def read_chunk_ids(self, document_id: str) -> set[str]:
+        """Получает идентификаторы всех проиндексированных чанков документа"""
+        field = await self.document_id_field()
+        with elasticsearch_duration.labels(operation="scan").time():
+            return {
+                hit["_id"]
+                async for hit in async_scan(
+                    self.client,
+                    index=self.index_name,
+                    query={"query": {"term": {field: document_id}}},
+                    source=False,
+                )
+            }
+
+    async def delete(self, ids: Sequence[str]) -> int:
+        """Удаляет чанки по их идентификаторам.
+
+        :return Количество удалённых чанков.
+        """
+        actions = (
+            {"_op_type": "delete", "_index": self.index_name, "_id": id_} for id_ in ids
+        )
+        deleted = 0
+        with elasticsearch_duration.labels(operation="bulk_delete").time():
+            async for ok, _ in async_streaming_bulk(
+                self.client,
+                actions,
+                chunk_size=self.bulk_chunk_size,
+                max_retries=self.max_retries,
+                initial_backoff=self.retry_backoff,
+                retry_on_status=RETRY_ON_STATUS,
+                ignore_status=404,
+                raise_on_error=False,
+                refresh=self.refresh,
+            ):
+                deleted += int(ok)
+        if self.refresh_on_complete:
+            await self.refresh_index()
+        return deleted
+
+    async def refresh_index(self) -> None:
+        """Делает записанные изменения видимыми для поиска"""
+        with elasticsearch_duration.labels(operation="refresh").time():
+            await self.client.indices.refresh(index=self.index_name)
+
+    async def delete_document(self, document_id: str) -> int:
+        """Удаляет все чанки документа.
+
+        :return Количество удалённых чанков.
+        """
+        field = await self.document_id_field()
+        with elasticsearch_duration.labels(operation="delete_by_query").time():
+            response = await self.client.delete_by_query(
+                index=self.index_name,
+                query={"term": {field: document_id}},
+                refresh=self.refresh_on_complete,
+            )
+        return response["deleted"]
+
+    async def write(self, documents: Sequence[Document]) -> int:
+        """Векторизует и записывает чанки в базу знаний"""
+        vectors = await self.embed(documents)
+        return await self.index(documents, vectors)
+
+    @staticmethod
+    def _report(stage: str, count: int, elapsed: float) -> None:
+        ingestion_chunks.labels(stage=stage).inc(count)
+        ingestion_duration.labels(stage=stage).observe(elapsed)
+        logger.info(
+            "Stage %s: %s chunks in %.2f s (%.1f chunks/sec)",
+            stage, count, elapsed, count / elapsed if elapsed else 0.0,
+        )
@@ -0,0 +1,183 @@
+from typing import Any
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable, Sequence
+from contextlib import suppress
+from dataclasses import dataclass
+from uuid import UUID
+
+from faststream import BaseMiddleware
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import ChatGeneration, LLMResult
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, ResponseError
+
+from .metrics import (
+    broker_handler_duration,
+    broker_queue_depth,
+    llm_duration,
+    llm_time_to_first_token,
+    llm_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LLMRun:
+    start: float
+    first_token: float | None = None
+    streamed_tokens: int = 0
+
+
+def count_tokens(response: LLMResult) -> tuple[int, int] | None:
+    """Количество токенов промпта и ответа из результата вызова LLM"""
+    for generations in response.generations:
+        for generation in generations:
+            if isinstance(generation, ChatGeneration) and generation.message.usage_metadata:
+                usage = generation.message.usage_metadata
+                return usage["input_tokens"], usage["output_tokens"]
+    usage = (response.llm_output or {}).get("token_usage")
+    if usage:
+        usage = usage if isinstance(usage, dict) else dict(usage)
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return None
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Замер длительности вызовов LLM, времени до первого токена и количества токенов.
+
+    Если модель не вернула использование токенов, количество токенов ответа
+    оценивается по числу полученных фрагментов потокового ответа.
+    """
+
+    run_inline = True  # Вызывается в цикле событий, без пула потоков
+
+    def __init__(self) -> None:
+        self._runs: dict[UUID, LLMRun] = {}
+
+    def on_chat_model_start(
+            self,
+            serialized: dict[str, Any],  # noqa: ARG002
+            messages: list,  # noqa: ARG002
+            *,
+            run_id: UUID,
+            **kwargs: Any,  # noqa: ARG002
+    ) -> None:
+        self._runs[run_id] = LLMRun(start=time.perf_counter())
+
+    def on_llm_start(
+            self,
+            serialized: dict[str, Any],  # noqa: ARG002
+            prompts: list[str],  # noqa: ARG002
+            *,
+            run_id: UUID,
+            **kwargs: Any,  # noqa: ARG002
+    ) -> None:
+        self._runs[run_id] = LLMRun(start=time.perf_counter())
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:  # noqa: ARG002
+        run = self._runs.get(run_id)
+        if run is None:
+            return
+        if run.first_token is None:
+            run.first_token = time.perf_counter()
+            llm_time_to_first_token.observe(run.first_token - run.start)
+        run.streamed_tokens += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:  # noqa: ARG002
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        llm_duration.labels(status="ok").observe(time.perf_counter() - run.start)
+        tokens = count_tokens(response)
+        if tokens is not None:
+            llm_tokens.labels(type="input").inc(tokens[0])
+            llm_tokens.labels(type="output").inc(tokens[1])
+        else:
+            llm_tokens.labels(type="output").inc(run.streamed_tokens)
+
+    def on_llm_error(
+            self, error: BaseException, *, run_id: UUID, **kwargs: Any  # noqa: ARG002
+    ) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            llm_duration.labels(status="error").observe(time.perf_counter() - run.start)
+
+
+class BrokerMetricsMiddleware(BaseMiddleware):
+    """Замер длительности обработки сообщений брокера по Redis Streams"""
+
+    async def consume_scope(  # noqa: PLR6301
+            self, call_next: Callable[[Any], Awaitable[Any]], msg: Any
+    ) -> Any:
+        stream = msg.raw_message.get("channel", "unknown")
+        start, status = time.perf_counter(), "ok"
+        try:
+            return await call_next(msg)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            broker_handler_duration.labels(stream=stream, status=status).observe(
+                time.perf_counter() - start
+            )
+
+
+class QueueDepthMonitor:
+    """Периодический опрос глубины очередей брокера: количества сообщений,
+    ещё не доставленных группе потребителей (lag), и доставленных,
+    но не подтверждённых (pending).
+
+    :param redis: Асинхронный клиент Redis.
+    :param streams: Названия Redis Streams.
+    :param group: Группа потребителей.
+    :param interval: Период опроса в секундах.
+    """
+
+    def __init__(
+            self, redis: Redis, streams: Sequence[str], group: str, interval: float = 15.0
+    ) -> None:
+        self.redis = redis
+        self.streams = streams
+        self.group = group
+        self.interval = interval
+        self._task: asyncio.Task[None] | None = None
+
+    async def sample(self) -> None:
+        for stream in self.streams:
+            try:
+                groups = await self.redis.xinfo_groups(stream)
+            except ResponseError:  # Stream ещё не создан
+                groups = []
+            info = next((
+                group for group in groups
+                if group["name"] in {self.group, self.group.encode("utf-8")}
+            ), None)
+            if info is None:
+                lag, pending = await self.redis.xlen(stream), 0
+            else:
+                lag, pending = info.get("lag") or 0, info["pending"]
+            broker_queue_depth.labels(stream=stream, state="lag").set(lag)
+            broker_queue_depth.labels(stream=stream, state="pending").set(pending)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sample()
+            except RedisError:
+                logger.warning("Failed to sample broker queue depth", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+
+from .metrics import client_init_duration, startup_duration
+
+logger = logging.getLogger(__name__)
+
+
+class Lazy[T]:
+    """Клиент, создаваемый при первом обращении, а не при импорте модуля.
+
+    Импорт модулей приложения не требует тяжёлых зависимостей и сети,
+    клиенты создаются в lifespan или при первом запросе и могут быть
+    подменены до первого обращения (например, в бенчмарках).
+
+    :param factory: Функция создания клиента.
+    :param name: Название клиента в логах и метриках.
+    """
+
+    def __init__(self, factory: Callable[[], T], name: str) -> None:
+        self.factory = factory
+        self.name = name
+        self._value: T | None = None
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> T:
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    start = time.perf_counter()
+                    self._value = self.factory()
+                    self._initialized = True
+                    elapsed = time.perf_counter() - start
+                    client_init_duration.labels(client=self.name).set(elapsed)
+                    logger.info("Client %s created in %.3f s", self.name, elapsed)
+        return self._value
+
+    @property
+    def initialized(self) -> bool:
+        return self._initialized
+
+    def override(self, value: T) -> None:
+        """Подменяет клиент, следующие обращения получат переданное значение"""
+        with self._lock:
+            self._value, self._initialized = value, True
+
+    def reset(self) -> None:
+        """Сбрасывает клиент, следующее обращение создаст его заново"""
+        with self._lock:
+            self._value, self._initialized = None, False
+
+
+class StartupReport:
+    """Замер длительности этапов запуска процесса.
+
+    :param name: Название процесса в логах.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.stages: dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, stage: str) -> Generator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = time.perf_counter() - start
+            startup_duration.labels(stage=stage).set(self.stages[stage])
+
+    def log(self) -> None:
+        total = time.perf_counter() - self._start
+        startup_duration.labels(stage="total").set(total)
+        logger.info(
+            "%s started in %.3f s (%s)",
+            self.name,
+            total,
+            ", ".join(f"{stage}: {elapsed:.3f} s" for stage, elapsed in self.stages.items()),
+        )
@@ -0,0 +1,190 @@
+from typing import Any, Final, cast
+
+import inspect
+import logging
+import time
+from collections.abc import Awaitable, Callable, Generator
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+semantic_cache_hits: Final[Counter] = Counter(
+    "rag_semantic_cache_hits_total", "Количество попаданий в семантический кэш ответов"
+)
+semantic_cache_misses: Final[Counter] = Counter(
+    "rag_semantic_cache_misses_total", "Количество промахов семантического кэша ответов"
+)
+cache_requests: Final[Counter] = Counter(
+    "rag_cache_requests_total",
+    "Обращения к кэшам эмбеддингов и результатов поиска",
+    ["cache", "result"],
+)
+coalesced_requests: Final[Counter] = Counter(
+    "rag_coalesced_requests_total",
+    "Количество запросов, дождавшихся результата уже выполняющегося идентичного вызова",
+    ["operation", "scope"],
+)
+
+node_duration: Final[Histogram] = Histogram(
+    "rag_node_duration_seconds", "Длительность выполнения вершин графа агента", ["node"]
+)
+agent_duration: Final[Histogram] = Histogram(
+    "rag_agent_duration_seconds", "Длительность выполнения графа агента до получения ответа"
+)
+
+ingestion_chunks: Final[Counter] = Counter(
+    "rag_ingestion_chunks_total", "Количество обработанных при индексации чанков", ["stage"]
+)
+ingestion_duration: Final[Histogram] = Histogram(
+    "rag_ingestion_duration_seconds", "Длительность этапов индексации документа", ["stage"]
+)
+
+reranker_duration: Final[Histogram] = Histogram(
+    "rag_reranker_duration_seconds",
+    "Длительность переранжирования документов cross-encoder моделью",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+embeddings_batch_size: Final[Histogram] = Histogram(
+    "rag_embeddings_batch_size",
+    "Размер батча запросов эмбеддингов после микро-батчинга",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+embeddings_queue_wait: Final[Histogram] = Histogram(
+    "rag_embeddings_queue_wait_seconds",
+    "Время ожидания запроса эмбеддинга в очереди микро-батчинга",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+broker_dead_letters: Final[Counter] = Counter(
+    "rag_broker_dead_letters_total",
+    "Сообщения, перенесённые в dead-letter stream после исчерпания попыток доставки",
+    ["stream"],
+)
+
+embeddings_duration: Final[Histogram] = Histogram(
+    "rag_embeddings_duration_seconds",
+    "Длительность запросов к модели эмбеддингов",
+    ["operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+embeddings_texts: Final[Counter] = Counter(
+    "rag_embeddings_texts_total", "Количество векторизованных текстов", ["operation"]
+)
+
+elasticsearch_duration: Final[Histogram] = Histogram(
+    "rag_elasticsearch_duration_seconds",
+    "Длительность запросов к Elasticsearch",
+    ["operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+llm_duration: Final[Histogram] = Histogram(
+    "rag_llm_duration_seconds",
+    "Длительность вызовов LLM",
+    ["status"],
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0),
+)
+llm_time_to_first_token: Final[Histogram] = Histogram(
+    "rag_llm_time_to_first_token_seconds",
+    "Время до первого токена потокового ответа LLM",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0),
+)
+llm_tokens: Final[Counter] = Counter(
+    "rag_llm_tokens_total", "Количество токенов промптов (input) и ответов (output) LLM", ["type"]
+)
+
+broker_handler_duration: Final[Histogram] = Histogram(
+    "rag_broker_handler_duration_seconds",
+    "Длительность обработки сообщений брокера",
+    ["stream", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+broker_queue_depth: Final[Gauge] = Gauge(
+    "rag_broker_queue_depth",
+    "Сообщения Redis Streams брокера: ещё не доставленные (lag) и не подтверждённые "
+    "(pending) группе потребителей",
+    ["stream", "state"],
+)
+
+db_query_duration: Final[Histogram] = Histogram(
+    "rag_db_query_duration_seconds",
+    "Длительность запросов к базе данных",
+    ["query"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+startup_duration: Final[Gauge] = Gauge(
+    "rag_startup_duration_seconds", "Длительность этапов запуска процесса", ["stage"]
+)
+client_init_duration: Final[Gauge] = Gauge(
+    "rag_client_init_duration_seconds", "Длительность создания клиентов", ["client"]
+)
+
+conversation_summaries: Final[Counter] = Counter(
+    "rag_conversation_summaries_total",
+    "Запуски обновления сводок диалогов (updated, skipped, locked)",
+    ["result"],
+)
+
+messages_flush_size: Final[Histogram] = Histogram(
+    "rag_messages_flush_size",
+    "Количество сообщений, сохраняемых в базу данных одной транзакцией",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
+websocket_connections: Final[Gauge] = Gauge(
+    "rag_websocket_connections", "Количество открытых websocket соединений процесса"
+)
+websocket_dropped_messages: Final[Counter] = Counter(
+    "rag_websocket_dropped_messages_total",
+    "Количество сообщений, не принятых в переполненную очередь отправки websocket",
+    ["policy"],
+)
+
+
+@contextmanager
+def observe_node(name: str) -> Generator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        node_duration.labels(node=name).observe(elapsed)
+        logger.info("Node %s took %.3f s", name, elapsed)
+
+
+def track_node[**P, R](func: Callable[P, R]) -> Callable[P, R]:
+    """Декоратор для замера длительности синхронной или асинхронной вершины графа"""
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+            with observe_node(func.__name__):
+                return await func(*args, **kwargs)
+
+        return cast("Callable[P, R]", async_wrapper)
+
+    @wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        with observe_node(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def track_query[**P, R](func: Callable[P, Awaitable[R]]) -> Callable[P, Awaitable[R]]:
+    """Декоратор для замера длительности запроса к базе данных"""
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            db_query_duration.labels(query=func.__name__).observe(time.perf_counter() - start)
+
+    return wrapper
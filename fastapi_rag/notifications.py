@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from uuid import UUID
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from .schemas import Task, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES: frozenset[TaskStatus] = frozenset({TaskStatus.DONE, TaskStatus.ERROR})
+# Максимальное время удержания long-poll запроса и SSE подписки в секундах
+MAX_WAIT_TIMEOUT = 60
+# Максимальное время websocket подписки на задачу в секундах
+SUBSCRIPTION_TIMEOUT = 600
+
+
+class TaskNotifier:
+    """Уведомления об изменении статуса асинхронных задач через Redis pub/sub.
+
+    Воркер публикует задачу вместе с ответом, последний статус кэшируется в Redis,
+    поэтому ожидающие клиенты не обращаются к базе данных. На процесс API
+    приходится одна pub/sub подписка, события раздаются локальным слушателям.
+
+    :param redis: Асинхронный клиент Redis.
+    :param ttl: Время хранения последнего статуса задачи в секундах.
+    :param prefix: Префикс ключей и каналов.
+    """
+
+    def __init__(self, redis: Redis, ttl: int, prefix: str = "task_events") -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self._listeners: defaultdict[str, set[asyncio.Queue[Task]]] = defaultdict(set)
+        self._pubsub: PubSub | None = None
+        self._listener: asyncio.Task[None] | None = None
+        self._lock = asyncio.Lock()
+
+    def _build_key(self, task_id: UUID) -> str:
+        return f"{self.prefix}:{task_id}"
+
+    async def publish(self, task: Task) -> None:
+        """Сохраняет статус задачи и оповещает подписчиков"""
+        key, payload = self._build_key(task.id), task.model_dump_json()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(f"{key}:last", payload, ex=self.ttl)
+            pipe.publish(key, payload)
+            await pipe.execute()
+
+    async def get(self, task_id: UUID) -> Task | None:
+        """Последний опубликованный статус задачи"""
+        payload = await self.redis.get(f"{self._build_key(task_id)}:last")
+        return Task.model_validate_json(payload) if payload is not None else None
+
+    async def listen(self, task_id: UUID, timeout: float) -> AsyncIterator[Task]:
+        """Отдаёт изменения статуса задачи до завершения задачи или истечения таймаута.
+
+        :param task_id: Идентификатор задачи.
+        :param timeout: Максимальное время ожидания в секундах.
+        :return Асинхронный итератор статусов задачи.
+        """
+        queue: asyncio.Queue[Task] = asyncio.Queue()
+        listeners = self._listeners[str(task_id)]
+        listeners.add(queue)
+        try:
+            await self._ensure_listening()
+            # Задача могла завершиться до подписки
+            task = await self.get(task_id)
+            deadline = time.monotonic() + timeout
+            while task is None or task.status not in TERMINAL_STATUSES:
+                if task is not None:
+                    yield task
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    task = await asyncio.wait_for(queue.get(), remaining)
+                except TimeoutError:
+                    return
+            yield task
+        finally:
+            listeners.discard(queue)
+            if not listeners:
+                self._listeners.pop(str(task_id), None)
+
+    async def wait(self, task_id: UUID, timeout: float) -> Task | None:
+        """Ожидает завершения задачи.
+
+        :return Завершённая задача или None, если за timeout секунд задача не завершилась.
+        """
+        async with aclosing(self.listen(task_id, timeout)) as updates:
+            async for task in updates:
+                if task.status in TERMINAL_STATUSES:
+                    return task
+        return None
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _ensure_listening(self) -> None:
+        async with self._lock:
+            if self._listener is not None and not self._listener.done():
+                return
+            if self._pubsub is not None:
+                await self._pubsub.aclose()
+            self._pubsub = self.redis.pubsub()
+            await self._pubsub.psubscribe(f"{self.prefix}:*")
+            self._listener = asyncio.create_task(self._dispatch(self._pubsub))
+
+    async def _dispatch(self, pubsub: PubSub) -> None:
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                task = Task.model_validate_json(message["data"])
+                for queue in self._listeners.get(str(task.id), ()):
+                    queue.put_nowait(task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Task notifications listener stopped")
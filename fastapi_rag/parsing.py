@@ -0,0 +1,53 @@
+"""Преобразование документов в Markdown.
+
+Модуль выполняется в дочерних процессах пула парсинга, поэтому
+не должен импортировать тяжёлые зависимости приложения. Библиотеки
+парсинга импортируются при первом разборе файла, а не при импорте модуля.
+"""
+
+import resource
+import signal
+from pathlib import Path
+
+BYTES_IN_MB = 1024 * 1024
+
+
+def limit_memory(memory_limit_mb: int) -> None:
+    """Инициализатор процесса пула, ограничивает доступную процессу память"""
+    if memory_limit_mb > 0:
+        limit = memory_limit_mb * BYTES_IN_MB
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _raise_timeout(signum: int, frame: object) -> None:  # noqa: ARG001
+    raise TimeoutError("File parsing timed out")
+
+
+def parse_file(path: str, timeout: int) -> str:
+    """Преобразует PDF или DOCX файл в Markdown.
+
+    :param path: Путь до файла.
+    :param timeout: Максимальное время обработки файла в секундах.
+    :return Текст документа в формате Markdown.
+    """
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.alarm(timeout)
+    try:
+        match Path(path).suffix.lstrip(".").lower():
+            case "docx" | "doc":
+                from docx2md import Converter, DocxFile, DocxMedia  # noqa: PLC0415
+
+                docx = DocxFile(path)
+                try:
+                    converter = Converter(docx.document(), DocxMedia(docx), use_md_table=True)
+                    return converter.convert()
+                finally:
+                    docx.close()
+            case "pdf":
+                import pymupdf4llm  # noqa: PLC0415
+
+                return pymupdf4llm.to_markdown(path)
+            case extension:
+                raise ValueError(f"Unsupported file format for parsing: {extension}")
+    finally:
+        signal.alarm(0)
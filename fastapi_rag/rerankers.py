@@ -0,0 +1,130 @@
+from typing import Any, Literal
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+
+from .metrics import reranker_duration
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Переранжирование документов локальной cross-encoder моделью на CPU.
+
+    Модель загружается лениво (или при прогреве), инференс выполняется батчами
+    в выделенном потоке, чтобы не блокировать event loop. Скоры пар запрос-чанк
+    кэшируются в LRU кэше.
+
+    :param model_name: Название или путь до cross-encoder модели.
+    :param top_n: Количество документов, остающихся после переранжирования.
+    :param batch_size: Размер батча при скоринге.
+    :param backend: Бэкенд инференса (torch или onnx).
+    :param onnx_file_name: Файл ONNX модели, например квантизованной int8.
+    :param max_length: Максимальная длина пары в токенах.
+    :param cache_size: Максимальное количество закэшированных скоров.
+    """
+
+    def __init__(
+            self,
+            model_name: str,
+            top_n: int = 4,
+            batch_size: int = 16,
+            backend: Literal["torch", "onnx"] = "torch",
+            onnx_file_name: str | None = None,
+            max_length: int = 512,
+            cache_size: int = 10_000,
+    ) -> None:
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.backend = backend
+        self.onnx_file_name = onnx_file_name
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self._model: Any = None
+        self._cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+
+    def _load_model(self) -> Any:
+        if self._model is None:
+            from sentence_transformers import CrossEncoder  # noqa: PLC0415
+
+            model_kwargs = {"file_name": self.onnx_file_name} if self.onnx_file_name else None
+            self._model = CrossEncoder(
+                self.model_name,
+                device="cpu",
+                backend=self.backend,
+                model_kwargs=model_kwargs,
+                max_length=self.max_length,
+            )
+            logger.info("Reranker model %s loaded (%s backend)", self.model_name, self.backend)
+        return self._model
+
+    def _predict(self, pairs: list[tuple[str, str]]) -> list[float]:
+        scores = self._load_model().predict(
+            pairs, batch_size=self.batch_size, show_progress_bar=False
+        )
+        return [float(score) for score in scores]
+
+    @staticmethod
+    def _document_key(document: Document) -> str:
+        return document.metadata.get("content_hash") or hashlib.sha256(
+            document.page_content.encode("utf-8")
+        ).hexdigest()
+
+    async def warmup(self) -> None:
+        """Загружает модель и прогоняет тестовый батч, чтобы первый запрос не был медленным"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._predict, [("warmup", "warmup")])
+
+    async def arerank(self, query: str, documents: Sequence[Document]) -> list[Document]:
+        """Переранжирует документы по релевантности запросу и оставляет top_n лучших.
+
+        Скор cross-encoder сохраняется в metadata["score"], исходный скор
+        ретривера - в metadata["retrieval_score"].
+        """
+        start = time.perf_counter()
+        keys = [(query, self._document_key(document)) for document in documents]
+        # Скоры собираются локально до ожидания модели: конкурентный вызов
+        # может вытеснить ключи из общего кэша, пока идёт инференс
+        scores: dict[tuple[str, str], float] = {}
+        missing: dict[tuple[str, str], str] = {}
+        for key, document in zip(keys, documents, strict=True):
+            if key in self._cache:
+                scores[key] = self._cache[key]
+            else:
+                missing.setdefault(key, document.page_content)
+        if missing:
+            loop = asyncio.get_running_loop()
+            predicted = await loop.run_in_executor(
+                self._executor, self._predict, [(query, text) for text in missing.values()]
+            )
+            scores.update(zip(missing, predicted, strict=True))
+        for key, score in scores.items():
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        reranked: list[Document] = []
+        for key, document in zip(keys, documents, strict=True):
+            metadata = {
+                **document.metadata,
+                "retrieval_score": document.metadata.get("score"),
+                "score": scores[key],
+            }
+            reranked.append(document.model_copy(update={"metadata": metadata}))
+        reranked.sort(key=lambda document: document.metadata["score"], reverse=True)
+        elapsed = time.perf_counter() - start
+        reranker_duration.observe(elapsed)
+        logger.info(
+            "Reranked %s documents (%s scored, %s cached) in %.3f s",
+            len(documents), len(missing), len(documents) - len(missing), elapsed,
+        )
+        return reranked[:self.top_n]
@@ -0,0 +1,198 @@
+from typing import Any, Literal
+
+import logging
+from collections.abc import Callable, Mapping
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from .cache import IndexGeneration, TwoLevelCache, build_query_key
+from .exceptions import ReadingError
+from .metrics import elasticsearch_duration
+
+logger = logging.getLogger(__name__)
+
+
+def dump_documents(documents: list[Document]) -> list[dict[str, Any]]:
+    """Сериализует документы для хранения в кэше"""
+    return [
+        {"id": document.id, "page_content": document.page_content, "metadata": document.metadata}
+        for document in documents
+    ]
+
+
+def load_documents(data: list[dict[str, Any]]) -> list[Document]:
+    return [Document(**document) for document in data]
+
+
+class ElasticsearchHybridRetriever(BaseRetriever):
+    """Гибридный (kNN + BM25) ретривер поверх Elasticsearch.
+
+    Оба поиска выполняются за один запрос к Elasticsearch:
+     - linear: kNN и BM25 поиски в одном _msearch, скоры каждого списка нормализуются
+       min-max в [0, 1] и складываются с весами vector_weight и bm25_weight
+       (скор BM25 не ограничен, поэтому без нормализации веса теряют смысл);
+     - rrf: reciprocal rank fusion на стороне Elasticsearch (веса не учитываются).
+
+    Документы совместимы с форматом ElasticsearchStore (поля text, vector, metadata),
+    итоговый скор сохраняется в metadata["score"]. Синхронный вызов (invoke)
+    выполняется через sync_client.
+    """
+
+    client: AsyncElasticsearch
+    embeddings: Embeddings
+    index_name: str
+    sync_client: Callable[[], Elasticsearch] | None = None
+    k: int = 4
+    num_candidates: int = 50
+    vector_weight: float = 0.6
+    bm25_weight: float = 0.4
+    fusion: Literal["linear", "rrf"] = "linear"
+    rank_constant: int = 60
+    text_field: str = "text"
+    vector_field: str = "vector"
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _build_knn(self, query_vector: list[float]) -> dict[str, Any]:
+        return {
+            "field": self.vector_field,
+            "query_vector": query_vector,
+            "k": self.k,
+            "num_candidates": self.num_candidates,
+        }
+
+    def _build_linear_searches(
+            self, query: str, query_vector: list[float]
+    ) -> list[dict[str, Any]]:
+        source = [self.text_field, "metadata"]
+        return [
+            {},
+            {"size": self.k, "_source": source, "knn": self._build_knn(query_vector)},
+            {},
+            {"size": self.k, "_source": source, "query": {"match": {self.text_field: query}}},
+        ]
+
+    def _build_rrf_body(self, query: str, query_vector: list[float]) -> dict[str, Any]:
+        return {
+            "retriever": {
+                "rrf": {
+                    "retrievers": [
+                        {"knn": self._build_knn(query_vector)},
+                        {"standard": {"query": {"match": {self.text_field: query}}}},
+                    ],
+                    "rank_constant": self.rank_constant,
+                    "rank_window_size": max(self.k, self.num_candidates),
+                }
+            }
+        }
+
+    def _fuse_linear(self, response: Mapping[str, Any]) -> list[dict[str, Any]]:
+        """Взвешенная сумма min-max нормализованных скоров kNN и BM25 поисков"""
+        scores: dict[str, float] = {}
+        hits: dict[str, dict[str, Any]] = {}
+        weights = (self.vector_weight, self.bm25_weight)
+        for weight, result in zip(weights, response["responses"], strict=True):
+            if "error" in result:
+                raise ReadingError(f"Hybrid search failed: {result['error']}")
+            batch = result["hits"]["hits"]
+            if not batch:
+                continue
+            low = min(hit["_score"] for hit in batch)
+            high = max(hit["_score"] for hit in batch)
+            for hit in batch:
+                normalized = (hit["_score"] - low) / (high - low) if high > low else 1.0
+                scores[hit["_id"]] = scores.get(hit["_id"], 0.0) + weight * normalized
+                hits.setdefault(hit["_id"], hit)
+        ranked = sorted(scores, key=scores.__getitem__, reverse=True)[:self.k]
+        return [{**hits[id_], "_score": scores[id_]} for id_ in ranked]
+
+    def _to_documents(self, hits: list[dict[str, Any]]) -> list[Document]:
+        return [
+            Document(
+                id=hit["_id"],
+                page_content=hit["_source"].get(self.text_field, ""),
+                metadata={**hit["_source"].get("metadata", {}), "score": hit["_score"]},
+            )
+            for hit in hits
+        ]
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun  # noqa: ARG002
+    ) -> list[Document]:
+        if self.sync_client is None:
+            raise ValueError("Synchronous retrieval requires sync_client")
+        client = self.sync_client()
+        query_vector = self.embeddings.embed_query(query)
+        with elasticsearch_duration.labels(operation="search").time():
+            if self.fusion == "rrf":
+                response = client.search(
+                    index=self.index_name,
+                    size=self.k,
+                    source=[self.text_field, "metadata"],
+                    **self._build_rrf_body(query, query_vector),
+                )
+                return self._to_documents(response["hits"]["hits"])
+            response = client.msearch(
+                index=self.index_name, searches=self._build_linear_searches(query, query_vector)
+            )
+        return self._to_documents(self._fuse_linear(response))
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun  # noqa: ARG002
+    ) -> list[Document]:
+        query_vector = await self.embeddings.aembed_query(query)
+        with elasticsearch_duration.labels(operation="search").time():
+            if self.fusion == "rrf":
+                response = await self.client.search(
+                    index=self.index_name,
+                    size=self.k,
+                    source=[self.text_field, "metadata"],
+                    **self._build_rrf_body(query, query_vector),
+                )
+                return self._to_documents(response["hits"]["hits"])
+            response = await self.client.msearch(
+                index=self.index_name, searches=self._build_linear_searches(query, query_vector)
+            )
+        return self._to_documents(self._fuse_linear(response))
+
+
+class CachedRetriever(BaseRetriever):
+    """Кэширование результатов поиска в двухуровневом кэше.
+
+    Ключ включает поколение базы знаний, поэтому индексация документов
+    инвалидирует результаты без сканирования ключей. Синхронный вызов (invoke)
+    делегируется обёрнутому ретриверу без кэширования.
+    """
+
+    retriever: BaseRetriever
+    cache: TwoLevelCache
+    generation: IndexGeneration
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        # Кэш использует асинхронный клиент Redis, синхронный вызов выполняется без него
+        return self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        key = f"{await self.generation.get()}:{build_query_key(query)}"
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return load_documents(cached)
+        documents = await self.retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        await self.cache.set(key, dump_documents(documents))
+        return documents
@@ -4,6 +4,7 @@ from fastapi import APIRouter
 
 from .chat import router as chat_router
 from .documents import router as documents_router
+from .health import router as health_router
 from .ws import router as ws_router
 
 router = APIRouter()
@@ -14,3 +15,4 @@ api_router.include_router(documents_router)
 
 router.include_router(api_router)
 router.include_router(ws_router)
+router.include_router(health_router)
@@ -1,12 +1,21 @@
 from uuid import UUID
 
-from fastapi import APIRouter, BackgroundTasks, Query, status
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from pydantic import PositiveInt
 
 from ..agent import execute_agent
 from ..broker import broker
-from ..database.queries import persist_task, read_chat_history, read_task
-from ..schemas import ChatHistory, Message, Role, Task, TaskProcess, TaskStatus
+from ..database.queries import (
+    persist_task,
+    read_chat_history,
+    read_chat_history_page,
+    read_task,
+)
+from ..depends import get_task_notifier
+from ..notifications import MAX_WAIT_TIMEOUT, TERMINAL_STATUSES
+from ..schemas import ChatHistory, ChatHistoryPage, Message, Role, Task, TaskProcess, TaskStatus
+from ..streaming import stream_sse, stream_task_events
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -23,11 +32,25 @@ async def create_chat_completion(
     response = await execute_agent(user_message.chat_id, user_message.text)
     ai_message = Message(chat_id=user_message.chat_id, role=Role.AI, text=response)
     background_tasks.add_task(
-        broker.publish, [user_message, ai_message], queue="messages_persisting"
+        broker.publish, [user_message, ai_message], stream="messages_persisting"
     )
     return ai_message
 
 
+@router.post(
+    path="/completions/stream",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    summary="Потоковый чат с RAG агентом (Server-Sent Events)",
+)
+async def create_chat_completion_stream(user_message: Message) -> StreamingResponse:
+    return StreamingResponse(
+        stream_sse(user_message),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post(
     path="/completions/async",
     status_code=status.HTTP_201_CREATED,
@@ -41,7 +64,7 @@ async def create_chat_completion_async(
     background_tasks.add_task(
         broker.publish,
         TaskProcess(id=task.id, user_message=user_message),
-        queue="pending_tasks"
+        stream="pending_tasks"
     )
     await persist_task(task)
     return task
@@ -54,7 +77,47 @@ async def create_chat_completion_async(
     summary=""
 )
 async def get_chat_task(task_id: UUID) -> Task:
-    return await read_task(task_id)
+    return await get_task_notifier().get(task_id) or await read_task(task_id)
+
+
+async def get_task_or_404(task_id: UUID) -> Task:
+    task = await get_task_notifier().get(task_id) or await read_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Task not found")
+    return task
+
+
+@router.get(
+    path="/tasks/{task_id}/wait",
+    status_code=status.HTTP_200_OK,
+    response_model=Task,
+    summary="Ожидание завершения задачи (long-poll)"
+)
+async def wait_chat_task(
+        task_id: UUID, timeout: float = Query(30.0, gt=0, le=MAX_WAIT_TIMEOUT)
+) -> Task:
+    task = await get_task_or_404(task_id)
+    if task.status in TERMINAL_STATUSES:
+        return task
+    # По истечении таймаута возвращается текущий статус, клиент повторяет запрос
+    return await get_task_notifier().wait(task_id, timeout) or task
+
+
+@router.get(
+    path="/tasks/{task_id}/events",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    summary="Подписка на статус задачи (Server-Sent Events)"
+)
+async def subscribe_chat_task(
+        task_id: UUID, timeout: float = Query(MAX_WAIT_TIMEOUT, gt=0, le=MAX_WAIT_TIMEOUT)
+) -> StreamingResponse:
+    task = await get_task_or_404(task_id)
+    return StreamingResponse(
+        stream_task_events(task, timeout),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get(
@@ -67,3 +130,18 @@ async def get_chat_history(
         chat_id: UUID, page: PositiveInt = Query(...), limit: PositiveInt = Query(...)
 ) -> ChatHistory:
     return await read_chat_history(chat_id, page, limit)
+
+
+@router.get(
+    path="/chat/history/{chat_id}/cursor",
+    status_code=status.HTTP_200_OK,
+    response_model=ChatHistoryPage,
+    summary="Получение истории сообщений чата с пагинацией по курсору"
+)
+async def get_chat_history_page(
+        chat_id: UUID,
+        limit: PositiveInt = Query(...),
+        cursor: str | None = Query(None),
+        with_total: bool = Query(False),
+) -> ChatHistoryPage:
+    return await read_chat_history_page(chat_id, limit, cursor, with_total)
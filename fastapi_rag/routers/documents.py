@@ -1,17 +1,71 @@
-from fastapi import APIRouter, File, UploadFile, status
-from langchain_core.documents import Document
+from uuid import UUID
 
-from ..indexing import indexing_file
+from fastapi import APIRouter, BackgroundTasks, File, HTTPException, UploadFile, status
+
+from ..broker import broker
+from ..database.queries import persist_ingestion_job, read_ingestion_job
+from ..indexing import (
+    AVAILABLE_EXTENSIONS,
+    build_document_id,
+    delete_document,
+    get_extension,
+    save_upload_file,
+)
+from ..schemas import DeletedDocument, IngestionJob, IngestionTask
+from ..settings import settings
 
 router = APIRouter(prefix="/documents", tags=["Documents"])
 
 
 @router.post(
     path="/upload",
-    status_code=status.HTTP_201_CREATED,
-    response_model=list[Document],
-    summary="Загружает документы в базу знаний"
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=IngestionJob,
+    summary="Загружает документ и ставит его в очередь на индексацию в базу знаний"
+)
+async def upload_documents(
+        background_tasks: BackgroundTasks, file: UploadFile = File(...)
+) -> IngestionJob:
+    extension = get_extension(file.filename)
+    if extension not in AVAILABLE_EXTENSIONS:
+        raise ValueError(
+            f"Unsupported file format: {extension}, supported extensions: {AVAILABLE_EXTENSIONS}"
+        )
+    job = IngestionJob(document_id=build_document_id(file.filename), filename=file.filename)
+    path = settings.ingestion.upload_dir / f"{job.id}.{extension}"
+    await save_upload_file(file, path)
+    await persist_ingestion_job(job)
+    background_tasks.add_task(
+        broker.publish,
+        IngestionTask(
+            job_id=job.id, document_id=job.document_id, path=str(path), filename=file.filename
+        ),
+        stream="pending_ingestions",
+    )
+    return job
+
+
+@router.get(
+    path="/jobs/{job_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=IngestionJob,
+    summary="Получение статуса и прогресса индексации документа"
+)
+async def get_ingestion_job(job_id: UUID) -> IngestionJob:
+    job = await read_ingestion_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+@router.delete(
+    path="/{document_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=DeletedDocument,
+    summary="Удаляет документ и все его чанки из базы знаний"
 )
-async def upload_documents(file: UploadFile = File(...)) -> list[Document]:
-    filedata = await file.read()
-    return await indexing_file(filedata, file.filename)
+async def delete_documents(document_id: UUID) -> DeletedDocument:
+    chunks_count = await delete_document(document_id)
+    if chunks_count == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+    return DeletedDocument(document_id=document_id, chunks_count=chunks_count)
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Response, status
+
+from ..depends import check_readiness
+from ..settings import settings
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+
+@router.get(path="/live", summary="Проверка, что процесс API запущен")
+async def live() -> dict[str, str]:
+    return {"status": "ok"}
+
+
+@router.get(
+    path="/ready",
+    responses={status.HTTP_503_SERVICE_UNAVAILABLE: {"description": "Зависимость недоступна"}},
+    summary="Проверка доступности Redis, Elasticsearch и базы данных",
+)
+async def ready(response: Response) -> dict[str, bool]:
+    checks = await check_readiness(settings.observability.readiness_timeout)
+    if not all(checks.values()):
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return checks
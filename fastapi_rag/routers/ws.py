@@ -1,28 +1,82 @@
+import logging
 from uuid import UUID
 
-from fastapi import APIRouter, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
 
 from ..agent import execute_agent
 from ..broker import broker
+from ..database.queries import read_task
+from ..depends import get_task_notifier
+from ..notifications import SUBSCRIPTION_TIMEOUT, TERMINAL_STATUSES
 from ..schemas import Message, Role
-from ..websockets import connection_manager
+from ..sessions import ChatSession, MessageHandler
+from ..settings import settings
+from ..streaming import stream_completion
+from ..websockets import Connection, get_connection_manager
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/ws", tags=["Websockets"])
 
 
-@router.websocket("/chat/{chat_id}")
-async def chat(
-        chat_id: UUID, websocket: WebSocket, background_tasks: BackgroundTasks
-) -> None:
-    await connection_manager.connect(websocket, chat_id)
+async def run_chat_session(chat_id: UUID, websocket: WebSocket, handler: MessageHandler) -> None:
+    """Выполняет сессию чата. Ответы сессии отправляются только в её соединение,
+    рассылка менеджером по chat_id остаётся для сообщений из других процессов.
+    """
+    connection = await get_connection_manager().connect(websocket, chat_id)
+    session = ChatSession(
+        chat_id=chat_id,
+        websocket=websocket,
+        connection=connection,
+        handler=handler,
+        queue_size=settings.websocket.session_queue_size,
+        ping_interval=settings.websocket.ping_interval,
+        ping_timeout=settings.websocket.ping_timeout,
+        idle_timeout=settings.websocket.idle_timeout,
+    )
     try:
-        payload = await websocket.receive_json()
-        user_message = Message.model_validate(payload)
+        await session.run()
+    finally:
+        await get_connection_manager().disconnect(chat_id, connection)
+
+
+@router.websocket("/chat/{chat_id}")
+async def chat(chat_id: UUID, websocket: WebSocket) -> None:
+    """Сессия чата: на каждое сообщение пользователя приходит полный ответ"""
+    async def reply(user_message: Message, connection: Connection) -> None:
         response = await execute_agent(user_message.chat_id, user_message.text)
         ai_message = Message(chat_id=chat_id, role=Role.AI, text=response)
-        await connection_manager.send(chat_id, ai_message)
-        background_tasks.add_task(
-            broker.publish, [user_message, ai_message], queue="messages_persisting"
-        )
+        connection.send(ai_message.model_dump(mode="json"))
+        await broker.publish([user_message, ai_message], stream="messages_persisting")
+
+    await run_chat_session(chat_id, websocket, reply)
+
+
+@router.websocket("/chat/{chat_id}/stream")
+async def chat_stream(chat_id: UUID, websocket: WebSocket) -> None:
+    """Сессия чата с потоковой генерацией ответов"""
+    async def reply(user_message: Message, connection: Connection) -> None:
+        async for event in stream_completion(user_message):
+            connection.send(event.model_dump(mode="json"))
+
+    await run_chat_session(chat_id, websocket, reply)
+
+
+@router.websocket("/tasks/{task_id}")
+async def task_events(task_id: UUID, websocket: WebSocket) -> None:
+    """Присылает статусы асинхронной задачи до её завершения.
+    На одну задачу может быть подписано несколько клиентов.
+    """
+    await websocket.accept()
+    task = await get_task_notifier().get(task_id) or await read_task(task_id)
+    if task is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Task not found")
+        return
+    try:
+        await websocket.send_json(task.model_dump(mode="json"))
+        if task.status not in TERMINAL_STATUSES:
+            async for update in get_task_notifier().listen(task_id, SUBSCRIPTION_TIMEOUT):
+                await websocket.send_json(update.model_dump(mode="json"))
+        await websocket.close()
     except WebSocketDisconnect:
-        await connection_manager.disconnect(chat_id)
+        logger.info("Task %s subscriber disconnected", task_id)
@@ -18,6 +18,24 @@ class Message(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class HistoryEntry(BaseModel):
+    """Сообщение истории диалога, используемой в промпте агента"""
+    role: Role
+    text: str
+    timestamp: float
+
+
+class ConversationSummary(BaseModel):
+    """Сводка старых сообщений диалога
+
+    Attributes:
+        text: Краткое содержание диалога.
+        until: Время последнего сообщения, вошедшего в сводку.
+    """
+    text: str
+    until: float
+
+
 class ChatHistory(BaseModel):
     total_count: int
     page: PositiveInt
@@ -26,8 +44,18 @@ class ChatHistory(BaseModel):
     messages: list[Message]
 
 
+class ChatHistoryPage(BaseModel):
+    """Страница истории чата при пагинации по курсору"""
+    chat_id: UUID
+    limit: PositiveInt
+    messages: list[Message]
+    next_cursor: str | None = None
+    total_count: int | None = None
+
+
 class TaskStatus(StrEnum):
     PENDING = "pending"
+    RUNNING = "running"
     DONE = "done"
     ERROR = "error"
 
@@ -41,3 +69,74 @@ class Task(BaseModel):
     id: UUID = Field(default_factory=uuid4)
     status: TaskStatus
     message: Message | None = None
+
+
+class StreamEvent(StrEnum):
+    CHUNK = "chunk"
+    DONE = "done"
+
+
+class MessageChunk(BaseModel):
+    """Фрагмент ответа агента при потоковой генерации"""
+    event: StreamEvent = StreamEvent.CHUNK
+    message_id: UUID
+    chat_id: UUID
+    text: str
+
+
+class StreamEnd(BaseModel):
+    """Финальный фрейм потока с полным сообщением агента"""
+    event: StreamEvent = StreamEvent.DONE
+    message: Message
+
+
+class SessionEvent(StrEnum):
+    PING = "ping"
+    PONG = "pong"
+    ERROR = "error"
+
+
+class Heartbeat(BaseModel):
+    """Служебный фрейм проверки соединения websocket сессии"""
+    event: SessionEvent = SessionEvent.PING
+
+
+class SessionError(BaseModel):
+    """Ошибка обработки сообщения websocket сессии, сессия при этом продолжается"""
+    event: SessionEvent = SessionEvent.ERROR
+    code: str
+    message: str
+
+
+class IngestionStage(StrEnum):
+    UPLOADED = "uploaded"
+    PARSED = "parsed"
+    CHUNKED = "chunked"
+    EMBEDDED = "embedded"
+    INDEXED = "indexed"
+
+
+class IngestionJob(BaseModel):
+    """Фоновая задача индексации документа"""
+    id: UUID = Field(default_factory=uuid4)
+    document_id: UUID
+    filename: str
+    status: TaskStatus = TaskStatus.PENDING
+    stage: IngestionStage = IngestionStage.UPLOADED
+    chunks_count: int = 0
+    error: str | None = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class IngestionTask(BaseModel):
+    """Сообщение брокера для запуска индексации загруженного файла"""
+    job_id: UUID
+    document_id: UUID
+    path: str
+    filename: str
+
+
+class DeletedDocument(BaseModel):
+    document_id: UUID
+    chunks_count: int
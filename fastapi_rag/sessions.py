@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from uuid import UUID
+
+from fastapi import WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+
+from .exceptions import AppError
+from .schemas import Heartbeat, Message, SessionError, SessionEvent
+from .websockets import Connection
+
+logger = logging.getLogger(__name__)
+
+# Обработчик отвечает через соединение своей сессии, а не рассылкой по chat_id
+MessageHandler = Callable[[Message, Connection], Awaitable[None]]
+
+
+class ChatSession:
+    """Долгоживущая websocket сессия чата.
+
+    Принимает любое количество сообщений за одно соединение и обрабатывает их
+    по очереди, входящая очередь ограничена. Сервер периодически присылает
+    {"event": "ping"}, клиент отвечает {"event": "pong"} (на ping клиента сервер
+    отвечает pong). Сессия закрывается, если от клиента нет фреймов дольше
+    ping_timeout или сообщений дольше idle_timeout. При отключении клиента
+    обработка текущего сообщения (генерация ответа) отменяется.
+
+    :param chat_id: Идентификатор чата.
+    :param websocket: Принятое websocket соединение.
+    :param connection: Соединение с очередью отправки.
+    :param handler: Обработчик сообщения пользователя, получает соединение сессии.
+    :param queue_size: Максимальное количество сообщений, ожидающих обработки.
+    :param ping_interval: Период отправки ping в секундах.
+    :param ping_timeout: Максимальное время без фреймов от клиента в секундах.
+    :param idle_timeout: Максимальное время без сообщений пользователя в секундах.
+    """
+
+    def __init__(
+            self,
+            chat_id: UUID,
+            websocket: WebSocket,
+            connection: Connection,
+            handler: MessageHandler,
+            queue_size: int = 8,
+            ping_interval: float = 20.0,
+            ping_timeout: float = 60.0,
+            idle_timeout: float = 600.0,
+    ) -> None:
+        self.chat_id = chat_id
+        self.websocket = websocket
+        self.connection = connection
+        self.handler = handler
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.idle_timeout = idle_timeout
+        self._inbox: asyncio.Queue[Message] = asyncio.Queue(maxsize=queue_size)
+        self._busy = False
+        self._last_activity = time.monotonic()
+
+    async def run(self) -> None:
+        """Выполняет сессию до отключения клиента или истечения таймаутов"""
+        tasks = {
+            asyncio.create_task(self._receive()),
+            asyncio.create_task(self._process()),
+            asyncio.create_task(self._ping()),
+        }
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    logger.error("Chat %s session failed", self.chat_id, exc_info=task.exception())
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _send_error(self, code: str, message: str) -> None:
+        self.connection.send(SessionError(code=code, message=message).model_dump(mode="json"))
+
+    async def _receive(self) -> None:
+        while True:
+            try:
+                payload = await asyncio.wait_for(self.websocket.receive_json(), self.ping_timeout)
+            except TimeoutError:
+                logger.info("Chat %s session timed out waiting for pong", self.chat_id)
+                await self.connection.close(status.WS_1001_GOING_AWAY)
+                return
+            except WebSocketDisconnect:
+                logger.info("Chat %s websocket disconnected", self.chat_id)
+                return
+            event = payload.get("event") if isinstance(payload, dict) else None
+            if event == SessionEvent.PING:
+                self.connection.send(Heartbeat(event=SessionEvent.PONG).model_dump(mode="json"))
+                continue
+            if event == SessionEvent.PONG:
+                continue
+            try:
+                user_message = Message.model_validate(payload)
+            except ValidationError as e:
+                self._send_error("VALIDATION_FAILED", str(e))
+                continue
+            try:
+                self._inbox.put_nowait(user_message)
+            except asyncio.QueueFull:
+                self._send_error("QUEUE_FULL", "Too many messages are waiting for a response")
+                continue
+            self._last_activity = time.monotonic()
+
+    async def _process(self) -> None:
+        while True:
+            user_message = await self._inbox.get()
+            self._busy = True
+            try:
+                await self.handler(user_message, self.connection)
+            except AppError as e:
+                logger.exception("Chat %s message processing failed", self.chat_id)
+                self._send_error(e.code, str(e))
+            except Exception as e:
+                logger.exception("Chat %s message processing failed", self.chat_id)
+                self._send_error("INTERNAL_ERROR", str(e))
+            finally:
+                self._busy = False
+                self._last_activity = time.monotonic()
+
+    async def _ping(self) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            idle = time.monotonic() - self._last_activity
+            if not self._busy and self._inbox.empty() and idle > self.idle_timeout:
+                logger.info(
+                    "Chat %s session closed after %.0f s of inactivity", self.chat_id, idle
+                )
+                await self.connection.close()
+                return
+            self.connection.send(Heartbeat().model_dump(mode="json"))
@@ -1,8 +1,11 @@
-from typing import Final
+from typing import Final, Literal
 
+import os
+import socket
 from pathlib import Path
 
 from dotenv import load_dotenv
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -10,6 +13,7 @@ ENV_PATH = BASE_DIR / ".env"
 DB_PATH = BASE_DIR / "db.sqlite3"
 DB_DRIVER = "aiosqlite"
 SQLALCHEMY_URL = f"sqlite+{DB_DRIVER}:///{DB_PATH}"
+UPLOAD_DIR = BASE_DIR / "uploads"
 
 load_dotenv(ENV_PATH)
 
@@ -35,9 +39,20 @@ class RedisSettings(BaseSettings):
 
 
 class EmbeddingsSettings(BaseSettings):
+    backend: Literal["remote", "local"] = "remote"
     normalize: bool = False
     batch_size: int = 32
     base_url: str = "http://127.0.0.1:8000"
+    # Для local бэкенда модель должна совпадать с моделью embeddings-service
+    model_name: str = "deepvk/USER-bge-m3"
+    device: str = "cpu"
+    max_workers: int = 1
+    max_queue_size: int = 64
+    # Сколько секунд запрос ждёт места в очереди local бэкенда, прежде чем получить 503
+    queue_timeout: float = 5.0
+    micro_batching: bool = False
+    micro_batch_size: int = 32
+    micro_batch_wait_ms: float = 5.0
 
     model_config = SettingsConfigDict(env_prefix="EMBEDDINGS_")
 
@@ -64,16 +79,179 @@ class RAGSettings(BaseSettings):
     chunk_overlap: int = 20
     system_prompt: str = ""
     max_conversation_history_length: int = 10
+    k: int = 4
+    num_candidates: int = 50
+    vector_weight: float = 0.6
+    bm25_weight: float = 0.4
+    fusion: Literal["linear", "rrf"] = "linear"
+    max_prompt_tokens: int = 4000
+    max_history_tokens: int = 1000
+    chars_per_token: float = 3.0
+    dedup_threshold: float = 0.8
 
     model_config = SettingsConfigDict(env_prefix="RAG_")
 
 
+class RetrievalCacheSettings(BaseSettings):
+    enabled: bool = True
+    ttl: int = 3600  # По умолчанию 1 час
+    embeddings_ttl: int = 86400  # По умолчанию 1 сутки
+    local_max_items: int = 1024
+    local_ttl: float = 60.0
+    generation_refresh_interval: float = 1.0
+
+    model_config = SettingsConfigDict(env_prefix="RETRIEVAL_CACHE_")
+
+
+class CoalescingSettings(BaseSettings):
+    enabled: bool = True
+    distributed: bool = False  # Объединение вызовов между воркерами через Redis
+    lock_ttl: float = 120.0
+    wait_timeout: float = 120.0
+    result_ttl: int = 10
+
+    model_config = SettingsConfigDict(env_prefix="COALESCING_")
+
+
+class ParsingSettings(BaseSettings):
+    max_workers: int | None = None  # По умолчанию по количеству ядер
+    timeout: int = 300
+    memory_limit_mb: int = 2048
+    max_tasks_per_child: int = 10
+
+    model_config = SettingsConfigDict(env_prefix="PARSING_")
+
+
+class IngestionSettings(BaseSettings):
+    upload_dir: Path = UPLOAD_DIR
+    upload_chunk_size: int = 1024 * 1024  # 1 МБ
+    embeddings_concurrency: int = 4
+    bulk_chunk_size: int = 500
+    refresh: Literal["true", "false", "wait_for"] = "false"
+    refresh_on_complete: bool = True
+    max_retries: int = 3
+    retry_backoff: float = 1.0
+
+    model_config = SettingsConfigDict(env_prefix="INGESTION_")
+
+
+class SemanticCacheSettings(BaseSettings):
+    enabled: bool = False
+    similarity_threshold: float = 0.95
+    ttl: int = 86400  # По умолчанию 1 сутки
+    max_size: int = 1000
+
+    model_config = SettingsConfigDict(env_prefix="SEMANTIC_CACHE_")
+
+
+class SummarizationSettings(BaseSettings):
+    # Сводка старых сообщений диалога вместо их полного текста в промпте
+    enabled: bool = False
+    # Количество последних сообщений, всегда передаваемых в промпт без сжатия
+    keep_last_messages: int = 4
+    # Минимальное количество новых сообщений для обновления сводки
+    min_messages: int = 4
+    max_summary_words: int = 150
+    lock_timeout: int = 120
+
+    model_config = SettingsConfigDict(env_prefix="SUMMARIZATION_")
+
+
+class RerankerSettings(BaseSettings):
+    enabled: bool = False
+    model_name: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+    top_n: int = 4
+    # Ретривер возвращает top_n * candidates_multiplier кандидатов для переранжирования
+    candidates_multiplier: int = 5
+    batch_size: int = 16
+    backend: Literal["torch", "onnx"] = "torch"  # onnx требует sentence-transformers[onnx]
+    onnx_file_name: str | None = None  # Например onnx/model_qint8_avx512.onnx
+    max_length: int = 512
+    cache_size: int = 10_000
+
+    model_config = SettingsConfigDict(env_prefix="RERANKER_")
+
+
+class BrokerSettings(BaseSettings):
+    consumers_enabled: bool = True  # False - API процесс только публикует задачи
+    max_workers: int = 4  # Количество одновременно обрабатываемых сообщений на подписчика
+    group: str = "rag-workers"
+    # Имя потребителя в группе должно быть уникальным для каждого процесса
+    consumer: str = Field(default_factory=lambda: f"{socket.gethostname()}-{os.getpid()}")
+    # Через сколько мс неподтверждённое сообщение забирается другим потребителем
+    min_idle_time: int = 600_000
+    # Сообщение, доставленное больше max_deliveries раз, переносится в dead-letter stream
+    max_deliveries: int = 5
+    polling_interval: int = 1000
+    graceful_timeout: float = 30.0
+
+    model_config = SettingsConfigDict(env_prefix="BROKER_")
+
+
+class PersistenceSettings(BaseSettings):
+    batch_size: int = 100
+    flush_interval_ms: float = 50.0
+    max_retries: int = 3
+    retry_backoff: float = 0.5
+
+    model_config = SettingsConfigDict(env_prefix="PERSISTENCE_")
+
+
+class WebsocketSettings(BaseSettings):
+    backend: Literal["memory", "redis"] = "redis"
+    send_queue_size: int = 256
+    slow_consumer_policy: Literal["drop_oldest", "disconnect"] = "disconnect"
+    send_timeout: float = 5.0
+    presence_ttl: int = 30
+    heartbeat_interval: float = 10.0
+    # Сессии чата: очередь входящих сообщений, ping/pong и отключение неактивных клиентов
+    session_queue_size: int = 8
+    ping_interval: float = 20.0
+    ping_timeout: float = 60.0
+    idle_timeout: float = 600.0
+
+    model_config = SettingsConfigDict(env_prefix="WEBSOCKET_")
+
+
+class DatabaseSettings(BaseSettings):
+    # Логирование SQL запросов SQLAlchemy (только для отладки)
+    echo: bool = False
+
+    model_config = SettingsConfigDict(env_prefix="DATABASE_")
+
+
+class ObservabilitySettings(BaseSettings):
+    # Передача идентификатора трассировки из HTTP запроса в сообщения брокера и логи
+    trace_propagation: bool = True
+    trace_header: str = "X-Trace-Id"
+    # Порт /metrics отдельного процесса воркера (0 - не запускать)
+    worker_metrics_port: int = 9100
+    # Период опроса глубины очередей брокера в секундах
+    queue_depth_interval: float = 15.0
+    # Максимальное время проверки каждой зависимости в /health/ready в секундах
+    readiness_timeout: float = 2.0
+
+    model_config = SettingsConfigDict(env_prefix="OBSERVABILITY_")
+
+
 class Settings(BaseSettings):
     gigachat: GigaChatSettings = GigaChatSettings()
     embeddings: EmbeddingsSettings = EmbeddingsSettings()
     redis: RedisSettings = RedisSettings()
+    broker: BrokerSettings = BrokerSettings()
+    persistence: PersistenceSettings = PersistenceSettings()
+    database: DatabaseSettings = DatabaseSettings()
+    websocket: WebsocketSettings = WebsocketSettings()
+    observability: ObservabilitySettings = ObservabilitySettings()
     elasticsearch: ElasticsearchSettings = ElasticsearchSettings()
     rag: RAGSettings = RAGSettings()
+    semantic_cache: SemanticCacheSettings = SemanticCacheSettings()
+    summarization: SummarizationSettings = SummarizationSettings()
+    retrieval_cache: RetrievalCacheSettings = RetrievalCacheSettings()
+    coalescing: CoalescingSettings = CoalescingSettings()
+    parsing: ParsingSettings = ParsingSettings()
+    ingestion: IngestionSettings = IngestionSettings()
+    reranker: RerankerSettings = RerankerSettings()
 
 
 settings: Final[Settings] = Settings()
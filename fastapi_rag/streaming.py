@@ -0,0 +1,55 @@
+from collections.abc import AsyncIterator
+
+from .agent import stream_agent
+from .broker import broker
+from .depends import get_task_notifier
+from .notifications import TERMINAL_STATUSES
+from .schemas import Message, MessageChunk, Role, StreamEnd, Task
+
+
+def format_sse(event: MessageChunk | StreamEnd) -> str:
+    """Форматирует событие потока в Server-Sent Events фрейм"""
+    return f"event: {event.event}\ndata: {event.model_dump_json()}\n\n"
+
+
+async def stream_completion(user_message: Message) -> AsyncIterator[MessageChunk | StreamEnd]:
+    """Потоковая генерация ответа на сообщение пользователя.
+
+    Отдаёт фрагменты ответа по мере генерации, после завершения потока
+    публикует сообщения для сохранения и отдаёт финальный фрейм с полным ответом.
+
+    :param user_message: Сообщение пользователя.
+    :return Асинхронный итератор фрагментов ответа и финального фрейма.
+    """
+    ai_message = Message(chat_id=user_message.chat_id, role=Role.AI, text="")
+    tokens: list[str] = []
+    async for token in stream_agent(user_message.chat_id, user_message.text):
+        tokens.append(token)
+        yield MessageChunk(message_id=ai_message.id, chat_id=ai_message.chat_id, text=token)
+    ai_message.text = "".join(tokens)
+    await broker.publish([user_message, ai_message], stream="messages_persisting")
+    yield StreamEnd(message=ai_message)
+
+
+async def stream_sse(user_message: Message) -> AsyncIterator[str]:
+    """Потоковая генерация ответа в формате Server-Sent Events"""
+    async for event in stream_completion(user_message):
+        yield format_sse(event)
+
+
+def format_task_event(task: Task) -> str:
+    return f"event: {task.status}\ndata: {task.model_dump_json()}\n\n"
+
+
+async def stream_task_events(task: Task, timeout: float) -> AsyncIterator[str]:
+    """Статусы асинхронной задачи в формате Server-Sent Events.
+
+    :param task: Текущее состояние задачи.
+    :param timeout: Максимальное время подписки в секундах.
+    :return Асинхронный итератор событий до завершения задачи.
+    """
+    yield format_task_event(task)
+    if task.status in TERMINAL_STATUSES:
+        return
+    async for update in get_task_notifier().listen(task.id, timeout):
+        yield format_task_event(update)
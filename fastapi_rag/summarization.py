@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from uuid import UUID
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from .history import ConversationHistoryStore, ConversationSummaryStore, format_entries
+from .metrics import conversation_summaries
+from .schemas import ConversationSummary
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Обнови краткое содержание диалога пользователя с AI ассистентом.
+
+Текущее краткое содержание:
+{summary}
+
+Новые сообщения диалога:
+{messages}
+
+Сохрани факты, названия, числа, договорённости и открытые вопросы, которые понадобятся
+для продолжения диалога. Ответь только обновлённым кратким содержанием,
+не длиннее {max_words} слов.
+"""
+
+
+class ConversationSummarizer:
+    """Инкрементальное сжатие старых сообщений диалога в сводку.
+
+    В сводку добавляются только сообщения, которые в неё ещё не вошли, кроме
+    keep_last_messages последних - они передаются в промпт как есть. Сообщения
+    одного хода (запрос и ответ) всегда попадают в сводку вместе.
+
+    :param history_store: Хранилище истории диалогов.
+    :param summary_store: Хранилище сводок.
+    :param llm: Модель для сжатия сообщений.
+    :param keep_last_messages: Количество последних сообщений, не попадающих в сводку.
+    :param min_messages: Минимальное количество сообщений для обновления сводки.
+    :param max_words: Ограничение длины сводки в словах.
+    :param lock_timeout: Время блокировки обновления сводки чата в секундах.
+    """
+
+    def __init__(
+            self,
+            history_store: ConversationHistoryStore,
+            summary_store: ConversationSummaryStore,
+            llm: BaseChatModel,
+            keep_last_messages: int = 4,
+            min_messages: int = 4,
+            max_words: int = 150,
+            lock_timeout: int = 120,
+    ) -> None:
+        self.history_store = history_store
+        self.summary_store = summary_store
+        self.keep_last_messages = keep_last_messages
+        self.min_messages = min_messages
+        self.max_words = max_words
+        self.lock_timeout = lock_timeout
+        self.chain = ChatPromptTemplate.from_template(SUMMARY_PROMPT) | llm | StrOutputParser()
+
+    async def summarize(self, chat_id: UUID) -> ConversationSummary | None:
+        """Добавляет накопившиеся старые сообщения чата в его сводку.
+
+        :return Обновлённая сводка или None, если обновлять её ещё рано
+        (или сводку уже обновляет другая задача).
+        """
+        if not await self.summary_store.acquire(chat_id, self.lock_timeout):
+            conversation_summaries.labels(result="locked").inc()
+            return None
+        try:
+            entries, summary = await asyncio.gather(
+                self.history_store.get(chat_id), self.summary_store.get(chat_id)
+            )
+            until = summary.until if summary is not None else 0.0
+            pending = [entry for entry in entries if entry.timestamp > until]
+            boundary = len(pending) - self.keep_last_messages
+            if boundary < self.min_messages:
+                conversation_summaries.labels(result="skipped").inc()
+                return None
+            until = pending[boundary - 1].timestamp
+            stale = [entry for entry in pending if entry.timestamp <= until]
+            text = await self.chain.ainvoke({
+                "summary": summary.text if summary is not None else "-",
+                "messages": format_entries(stale),
+                "max_words": self.max_words,
+            })
+            summary = ConversationSummary(text=text.strip(), until=until)
+            await self.summary_store.set(chat_id, summary)
+            conversation_summaries.labels(result="updated").inc()
+            logger.info("Summarized %s messages of chat %s", len(stale), chat_id)
+            return summary
+        finally:
+            await self.summary_store.release(chat_id)
@@ -0,0 +1,86 @@
+from typing import Any
+
+import logging
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from uuid import uuid4
+
+from faststream import BaseMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+TRACE_ID_HEADER = "trace_id"  # Заголовок сообщений брокера
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"
+
+trace_id_var: ContextVar[str | None] = ContextVar("trace_id", default=None)
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет идентификатор трассировки текущего запроса в записи логов"""
+
+    def filter(self, record: logging.LogRecord) -> bool:  # noqa: PLR6301
+        record.trace_id = trace_id_var.get() or "-"
+        return True
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """Настраивает логирование процесса с идентификатором трассировки в каждой записи"""
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.basicConfig(level=level, handlers=[handler])
+
+
+class TraceIdMiddleware:
+    """ASGI middleware, принимающий идентификатор трассировки из заголовка запроса
+    (или создающий новый) и возвращающий его в заголовке ответа.
+
+    :param app: ASGI приложение.
+    :param header: Название HTTP заголовка.
+    """
+
+    def __init__(self, app: ASGIApp, header: str = "X-Trace-Id") -> None:
+        self.app = app
+        self.header = header.lower().encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in {"http", "websocket"}:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        trace_id = headers[self.header].decode("latin-1") if self.header in headers else None
+        trace_id = trace_id or uuid4().hex
+        token = trace_id_var.set(trace_id)
+
+        async def send_with_trace_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"].append((self.header, trace_id.encode("latin-1")))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            trace_id_var.reset(token)
+
+
+class TraceMiddleware(BaseMiddleware):
+    """Передаёт идентификатор трассировки через заголовки сообщений брокера:
+    при публикации берёт его из контекста, при обработке восстанавливает в контексте.
+    """
+
+    async def publish_scope(  # noqa: PLR6301
+            self, call_next: Callable[[Any], Awaitable[Any]], cmd: Any
+    ) -> Any:
+        trace_id = trace_id_var.get()
+        if trace_id is not None:
+            cmd.add_headers({TRACE_ID_HEADER: trace_id}, override=False)
+        return await call_next(cmd)
+
+    async def consume_scope(  # noqa: PLR6301
+            self, call_next: Callable[[Any], Awaitable[Any]], msg: Any
+    ) -> Any:
+        token = trace_id_var.set(msg.headers.get(TRACE_ID_HEADER) or uuid4().hex)
+        try:
+            return await call_next(msg)
+        finally:
+            trace_id_var.reset(token)
@@ -1,29 +1,142 @@
-from typing import Final, TypeVar
+from typing import Any, Final, Literal, TypeVar
 
+import asyncio
+import json
 import logging
+import time
+import uuid
 from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import suppress
 from uuid import UUID
 
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect, status
 from pydantic import BaseModel
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from .background import run_in_background
+from .depends import get_redis
+from .lifecycle import Lazy
+from .metrics import websocket_connections, websocket_dropped_messages
+from .settings import settings
 
 logger = logging.getLogger(__name__)
 
 ConnectionId = str | UUID
 PayloadType = TypeVar("PayloadType", bound=BaseModel)
+SlowConsumerPolicy = Literal["drop_oldest", "disconnect"]
+
+
+class Connection:
+    """Websocket соединение с ограниченной очередью отправки.
+
+    Сообщения отправляются отдельной задачей, поэтому медленный клиент не блокирует
+    отправителя. При переполнении очереди самое старое сообщение отбрасывается
+    (drop_oldest) или соединение закрывается (disconnect), так же соединение
+    закрывается, если клиент не принимает сообщение дольше send_timeout секунд.
+
+    :param websocket: Принятое websocket соединение.
+    :param max_queue_size: Максимальное количество неотправленных сообщений.
+    :param policy: Политика для медленного клиента.
+    :param send_timeout: Максимальное время отправки одного сообщения в секундах.
+    """
+
+    def __init__(
+            self,
+            websocket: WebSocket,
+            max_queue_size: int = 256,
+            policy: SlowConsumerPolicy = "disconnect",
+            send_timeout: float = 5.0,
+    ) -> None:
+        self.websocket = websocket
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.closed = False
+        self._queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=max_queue_size)
+        self._sender: asyncio.Task[None] = asyncio.create_task(self._send_loop())
+
+    def send(self, data: dict[str, Any]) -> bool:
+        """Ставит сообщение в очередь отправки, не дожидаясь клиента.
+
+        :return Было ли сообщение принято в очередь.
+        """
+        if self.closed:
+            return False
+        if self._queue.full():
+            websocket_dropped_messages.labels(policy=self.policy).inc()
+            if self.policy == "disconnect":
+                logger.warning("Send queue overflow, closing slow websocket connection")
+                self.closed = True
+                self._sender.cancel()
+                run_in_background(self._close_websocket(status.WS_1013_TRY_AGAIN_LATER))
+                return False
+            self._queue.get_nowait()
+            self._queue.task_done()
+        self._queue.put_nowait(data)
+        return True
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        """Дожидается отправки сообщений из очереди и закрывает соединение"""
+        if not self.closed:
+            with suppress(TimeoutError):
+                await asyncio.wait_for(self._queue.join(), self.send_timeout)
+        self._sender.cancel()
+        await self._close(code)
+
+    async def _close(self, code: int) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        await self._close_websocket(code)
+
+    async def _close_websocket(self, code: int) -> None:
+        # Клиент мог уже разорвать соединение
+        with suppress(RuntimeError, WebSocketDisconnect):
+            await self.websocket.close(code=code)
+
+    async def _send_loop(self) -> None:
+        while True:
+            data = await self._queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_json(data), self.send_timeout)
+            except TimeoutError:
+                logger.warning(
+                    "Websocket client did not receive message in %s s", self.send_timeout
+                )
+                await self._close(status.WS_1013_TRY_AGAIN_LATER)
+                return
+            except (RuntimeError, WebSocketDisconnect):
+                self.closed = True
+                return
+            finally:
+                self._queue.task_done()
+
+
+def create_connection(websocket: WebSocket) -> Connection:
+    return Connection(
+        websocket,
+        max_queue_size=settings.websocket.send_queue_size,
+        policy=settings.websocket.slow_consumer_policy,
+        send_timeout=settings.websocket.send_timeout,
+    )
 
 
 class ConnectionManager(ABC):
     @abstractmethod
-    async def connect(self, websocket: WebSocket, connection_id: ConnectionId) -> None:
+    async def connect(self, websocket: WebSocket, connection_id: ConnectionId) -> Connection:
         """Создаёт websocket соединение"""
 
     @abstractmethod
-    async def disconnect(self, connection_id: ConnectionId) -> None:
-        """Разрывает websocket соединение"""
+    async def disconnect(
+            self, connection_id: ConnectionId, connection: Connection | None = None
+    ) -> None:
+        """Разрывает websocket соединение (все соединения идентификатора,
+        если конкретное соединение не указано)
+        """
 
     @abstractmethod
-    async def get_connection(self, connection_id: ConnectionId) -> WebSocket | None:
+    async def get_connection(self, connection_id: ConnectionId) -> Connection | None:
         """Получает websocket соединение по его идентификатору"""
 
     async def send(self, connection_id: ConnectionId, payload: PayloadType) -> None:
@@ -35,25 +148,201 @@ class ConnectionManager(ABC):
         connection = await self.get_connection(connection_id)
         if connection is None:
             return
-        await connection.send_json(payload)
+        connection.send(payload.model_dump(mode="json"))
+
+    async def close(self) -> None:  # noqa: B027
+        """Освобождает ресурсы менеджера при остановке приложения"""
 
 
 class InMemoryConnectionManager(ConnectionManager):
     def __init__(self) -> None:
-        self.active_connections: dict[str, WebSocket] = {}
+        self.active_connections: dict[str, Connection] = {}
+        websocket_connections.set_function(lambda: len(self.active_connections))
 
-    async def connect(self, websocket: WebSocket, connection_id: ConnectionId) -> None:
+    async def connect(self, websocket: WebSocket, connection_id: ConnectionId) -> Connection:
         await websocket.accept()
-        self.active_connections[connection_id] = websocket
+        connection = create_connection(websocket)
+        self.active_connections[str(connection_id)] = connection
         logger.info("Created new connection with id %s", connection_id)
+        return connection
+
+    async def disconnect(
+            self, connection_id: ConnectionId, connection: Connection | None = None
+    ) -> None:
+        active_connection = self.active_connections.get(str(connection_id))
+        connection = connection or active_connection
+        if connection is None:
+            return
+        # Соединение могло быть заменено новым с тем же идентификатором
+        if connection is active_connection:
+            del self.active_connections[str(connection_id)]
+        await connection.close()
+        logger.info("Deleted connection by id %s", connection_id)
+
+    async def get_connection(self, connection_id: ConnectionId) -> Connection | None:
+        return self.active_connections.get(str(connection_id))
 
-    async def disconnect(self, connection_id: ConnectionId) -> None:
-        if connection_id in self.active_connections:
-            del self.active_connections[connection_id]
+
+class RedisConnectionManager(ConnectionManager):
+    """Распределённый менеджер websocket соединений.
+
+    Каждый процесс хранит только свои соединения и подписан на Redis каналы
+    их идентификаторов. Отправка публикуется в канал идентификатора и доходит
+    до соединений в любом процессе (воркере uvicorn или поде), своим соединениям
+    процесс доставляет сообщение сразу. Присутствие клиента отслеживается
+    sorted set ключом, который процесс периодически продлевает.
+
+    :param redis: Асинхронный клиент Redis.
+    :param presence_ttl: Время жизни отметки присутствия в секундах.
+    :param heartbeat_interval: Период продления присутствия в секундах.
+    :param prefix: Префикс каналов и ключей.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            presence_ttl: int = 30,
+            heartbeat_interval: float = 10.0,
+            prefix: str = "ws",
+    ) -> None:
+        self.redis = redis
+        self.presence_ttl = presence_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.prefix = prefix
+        self.instance_id = uuid.uuid4().hex
+        self.local_connections: defaultdict[str, set[Connection]] = defaultdict(set)
+        self._pubsub: PubSub | None = None
+        self._listener: asyncio.Task[None] | None = None
+        self._heartbeat: asyncio.Task[None] | None = None
+        self._lock = asyncio.Lock()
+        websocket_connections.set_function(
+            lambda: sum(len(connections) for connections in self.local_connections.values())
+        )
+
+    def _build_channel(self, connection_id: str) -> str:
+        return f"{self.prefix}:{connection_id}"
+
+    def _build_presence_key(self, connection_id: str) -> str:
+        return f"{self.prefix}:presence:{connection_id}"
+
+    async def connect(self, websocket: WebSocket, connection_id: ConnectionId) -> Connection:
+        await websocket.accept()
+        connection = create_connection(websocket)
+        connection_id = str(connection_id)
+        async with self._lock:
+            if not self.local_connections[connection_id]:
+                await self._subscribe(connection_id)
+            self.local_connections[connection_id].add(connection)
+        await self._touch([connection_id])
+        logger.info("Created new connection with id %s", connection_id)
+        return connection
+
+    async def disconnect(
+            self, connection_id: ConnectionId, connection: Connection | None = None
+    ) -> None:
+        connection_id = str(connection_id)
+        async with self._lock:
+            connections = self.local_connections.get(connection_id, set())
+            closing = set(connections) if connection is None else connections & {connection}
+            connections -= closing
+            if not connections:
+                self.local_connections.pop(connection_id, None)
+                if self._pubsub is not None:
+                    await self._pubsub.unsubscribe(self._build_channel(connection_id))
+                await self.redis.zrem(self._build_presence_key(connection_id), self.instance_id)
+        for closed_connection in closing:
+            await closed_connection.close()
+        if closing:
             logger.info("Deleted connection by id %s", connection_id)
 
-    async def get_connection(self, connection_id: ConnectionId) -> WebSocket:
-        return self.active_connections.get(connection_id)
+    async def get_connection(self, connection_id: ConnectionId) -> Connection | None:
+        return next(iter(self.local_connections.get(str(connection_id), ())), None)
+
+    async def send(self, connection_id: ConnectionId, payload: PayloadType) -> None:
+        connection_id = str(connection_id)
+        data = payload.model_dump(mode="json")
+        self._deliver(connection_id, data)
+        message = json.dumps({"origin": self.instance_id, "data": data}, ensure_ascii=False)
+        await self.redis.publish(self._build_channel(connection_id), message)
+
+    async def is_online(self, connection_id: ConnectionId) -> bool:
+        """Есть ли у идентификатора активное соединение в каком-либо процессе"""
+        count = await self.redis.zcount(
+            self._build_presence_key(str(connection_id)), time.time(), "+inf"
+        )
+        return count > 0
+
+    async def close(self) -> None:
+        for task in (self._listener, self._heartbeat):
+            if task is not None:
+                task.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    def _deliver(self, connection_id: str, data: dict[str, Any]) -> None:
+        for connection in list(self.local_connections.get(connection_id, ())):
+            connection.send(data)
+
+    async def _subscribe(self, connection_id: str) -> None:
+        if self._pubsub is None:
+            self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(self._build_channel(connection_id))
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen(self._pubsub))
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._send_heartbeats())
+
+    async def _listen(self, pubsub: PubSub) -> None:
+        prefix_length = len(self.prefix) + 1
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Websocket pub/sub listener failed, retrying")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            envelope = json.loads(message["data"])
+            # Своим соединениям сообщение уже доставлено при отправке
+            if envelope["origin"] == self.instance_id:
+                continue
+            self._deliver(message["channel"].decode("utf-8")[prefix_length:], envelope["data"])
+
+    async def _touch(self, connection_ids: list[str]) -> None:
+        expires_at = time.time() + self.presence_ttl
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for connection_id in connection_ids:
+                key = self._build_presence_key(connection_id)
+                pipe.zadd(key, {self.instance_id: expires_at})
+                pipe.zremrangebyscore(key, "-inf", time.time())
+                pipe.expire(key, self.presence_ttl)
+            await pipe.execute()
+
+    async def _send_heartbeats(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self.local_connections:
+                continue
+            try:
+                await self._touch(list(self.local_connections))
+            except Exception:
+                logger.exception("Failed to refresh websocket presence")
+
+
+def create_connection_manager() -> ConnectionManager:
+    if settings.websocket.backend == "memory":
+        return InMemoryConnectionManager()
+    return RedisConnectionManager(
+        redis=get_redis(),
+        presence_ttl=settings.websocket.presence_ttl,
+        heartbeat_interval=settings.websocket.heartbeat_interval,
+    )
 
 
-connection_manager: Final[ConnectionManager] = InMemoryConnectionManager()
+get_connection_manager: Final[Lazy[ConnectionManager]] = Lazy(
+    create_connection_manager, name="connection_manager"
+)
@@ -3,7 +3,8 @@ import logging
 import uvicorn
 
 from fastapi_rag.app import app
+from fastapi_rag.tracing import configure_logging
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
+    configure_logging(logging.INFO)
     uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")  # noqa: S104
@@ -0,0 +1,28 @@
+from collections.abc import AsyncIterator
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from fastapi_rag.database import queries
+from fastapi_rag.database.base import Base
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def database(monkeypatch: pytest.MonkeyPatch) -> AsyncIterator[None]:
+    """Подменяет базу данных запросов на in-memory SQLite с созданными таблицами"""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(
+        queries,
+        "sessionmaker",
+        async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False),
+    )
+    yield
+    await engine.dispose()
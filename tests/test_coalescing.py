@@ -0,0 +1,130 @@
+from typing import Any
+
+import asyncio
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from redis.asyncio.client import PubSub
+
+from fastapi_rag.coalescing import DistributedSingleFlight, SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class SlowCall:
+    """Функция с подсчётом вызовов, завершающаяся по событию release.
+
+    :param result: Результат вызова.
+    :param cancel_delay: Время завершения после отмены в секундах (например, закрытие соединения).
+    """
+
+    def __init__(self, result: str = "result", cancel_delay: float = 0.0) -> None:
+        self.result = result
+        self.cancel_delay = cancel_delay
+        self.calls = 0
+        self.cancelled = False
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        self.started.set()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            await asyncio.sleep(self.cancel_delay)
+            raise
+        return self.result
+
+
+async def test_concurrent_callers_share_one_call() -> None:
+    flight = SingleFlight[str]("test")
+    func = SlowCall()
+
+    callers = [asyncio.create_task(flight.do("key", func)) for _ in range(10)]
+    await func.started.wait()
+    func.release.set()
+
+    assert await asyncio.gather(*callers) == ["result"] * 10
+    assert func.calls == 1
+
+
+async def test_cancelled_waiter_does_not_cancel_shared_call() -> None:
+    flight = SingleFlight[str]("test")
+    func = SlowCall()
+
+    first = asyncio.create_task(flight.do("key", func))
+    second = asyncio.create_task(flight.do("key", func))
+    await func.started.wait()
+    first.cancel()
+    await asyncio.sleep(0)
+    func.release.set()
+
+    assert await second == "result"
+    assert first.cancelled()
+    assert not func.cancelled
+    assert func.calls == 1
+
+
+async def test_cancelling_last_waiter_cancels_shared_call() -> None:
+    flight = SingleFlight[str]("test")
+    func = SlowCall()
+
+    caller = asyncio.create_task(flight.do("key", func))
+    await func.started.wait()
+    caller.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    await asyncio.sleep(0)
+    assert func.cancelled
+
+
+async def test_caller_after_cancel_starts_new_call() -> None:
+    flight = SingleFlight[str]("test")
+    cancelled_func, func = SlowCall("cancelled", cancel_delay=0.1), SlowCall()
+
+    caller = asyncio.create_task(flight.do("key", cancelled_func))
+    await cancelled_func.started.wait()
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    func.release.set()
+
+    # Отменённый вызов ещё завершается, новый вызов не должен к нему присоединиться
+    assert await flight.do("key", func) == "result"
+    assert cancelled_func.calls == func.calls == 1
+
+
+async def test_distributed_follower_receives_leader_result(
+        monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    server = FakeServer()
+    leader_redis, follower_redis = FakeRedis(server=server), FakeRedis(server=server)
+    leader = DistributedSingleFlight[str](leader_redis, "test", encode=str, decode=bytes.decode)
+    follower = DistributedSingleFlight[str](
+        follower_redis, "test", encode=str, decode=bytes.decode
+    )
+    leader_func, follower_func = SlowCall("leader"), SlowCall("follower")
+    # Ведомый подписывается на результат только после неудачного захвата блокировки
+    following_leader = asyncio.Event()
+    pubsub = follower_redis.pubsub
+
+    def spy_pubsub(**kwargs: Any) -> PubSub:
+        following_leader.set()
+        return pubsub(**kwargs)
+
+    monkeypatch.setattr(follower_redis, "pubsub", spy_pubsub)
+
+    leading = asyncio.create_task(leader.do("key", leader_func))
+    await leader_func.started.wait()
+    following = asyncio.create_task(follower.do("key", follower_func))
+    await following_leader.wait()
+    leader_func.release.set()
+
+    assert await asyncio.gather(leading, following) == ["leader", "leader"]
+    assert follower_func.calls == 0
+    await leader_redis.aclose()
+    await follower_redis.aclose()
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from fastapi_rag.embeddings import LocalEmbeddings, MicroBatchingEmbeddings
+from fastapi_rag.exceptions import OverloadedError
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingEmbeddings(Embeddings):
+    """Эмбеддинги, записывающие батчи вызовов aembed_documents.
+
+    :param error: Ошибка, которой завершается каждый вызов.
+    """
+
+    def __init__(self, error: Exception | None = None) -> None:
+        self.error = error
+        self.batches: list[list[str]] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:  # noqa: PLR6301
+        return [float(len(text)), float(sum(map(ord, text)))]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.batches.append(texts)
+        if self.error is not None:
+            raise self.error
+        return self.embed_documents(texts)
+
+
+async def test_concurrent_queries_are_embedded_in_one_batch() -> None:
+    embeddings = RecordingEmbeddings()
+    batching = MicroBatchingEmbeddings(embeddings, max_batch_size=32, max_wait_ms=10)
+    queries = ["доставка", "оплата", "возврат", "доставка"]
+
+    vectors = await asyncio.gather(*(batching.aembed_query(query) for query in queries))
+
+    assert vectors == [embeddings.embed_query(query) for query in queries]
+    assert embeddings.batches == [["доставка", "оплата", "возврат"]]
+
+
+async def test_full_batch_is_dispatched_without_waiting() -> None:
+    embeddings = RecordingEmbeddings()
+    batching = MicroBatchingEmbeddings(embeddings, max_batch_size=2, max_wait_ms=60_000)
+
+    async with asyncio.timeout(1):
+        await asyncio.gather(batching.aembed_query("первый"), batching.aembed_query("второй"))
+
+    assert embeddings.batches == [["первый", "второй"]]
+
+
+async def test_error_reaches_every_waiter() -> None:
+    error = RuntimeError("Embeddings service is unavailable")
+    batching = MicroBatchingEmbeddings(RecordingEmbeddings(error), max_wait_ms=10)
+
+    results = await asyncio.gather(
+        *(batching.aembed_query(query) for query in ("доставка", "оплата")),
+        return_exceptions=True,
+    )
+
+    assert results == [error, error]
+
+
+async def test_local_embeddings_reject_requests_when_queue_is_full(
+        monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    embeddings = LocalEmbeddings("model", max_queue_size=1, queue_timeout=0.05)
+    release = threading.Event()
+
+    def embed_documents(texts: list[str]) -> list[list[float]]:
+        release.wait()
+        return [[1.0] for _ in texts]
+
+    monkeypatch.setattr(embeddings, "embed_documents", embed_documents)
+    running = asyncio.create_task(embeddings.aembed_query("первый"))
+    await asyncio.sleep(0)
+
+    try:
+        with pytest.raises(OverloadedError):
+            await embeddings.aembed_query("второй")
+    finally:
+        release.set()
+    assert await running == [1.0]
+    assert await embeddings.aembed_query("третий") == [1.0]
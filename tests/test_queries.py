@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+
+from fastapi_rag.database import queries
+from fastapi_rag.database.models import MessageModel
+from fastapi_rag.database.queries import (
+    persist_messages,
+    persist_task,
+    read_chat_history_page,
+    read_task,
+)
+from fastapi_rag.schemas import Message, Role, Task, TaskStatus
+
+pytestmark = [pytest.mark.anyio, pytest.mark.usefixtures("database")]
+
+
+async def test_persist_task_stores_message_id() -> None:
+    message = Message(chat_id=uuid4(), role=Role.AI, text="На работе")
+    await persist_messages([message])
+    task = Task(status=TaskStatus.DONE, message=message)
+
+    await persist_task(task)
+
+    assert await read_task(task.id) == task
+
+
+async def test_persist_task_without_message() -> None:
+    task = Task(status=TaskStatus.PENDING)
+
+    await persist_task(task)
+
+    assert await read_task(task.id) == task
+
+
+async def test_cursor_pages_messages_with_equal_created_at() -> None:
+    chat_id = uuid4()
+    created_at = datetime(2026, 1, 1, 12, 0, 0)  # noqa: DTZ001
+    # Семь сообщений с одинаковым временем создания и два более поздних
+    models = [
+        MessageModel(
+            id=uuid4(),
+            chat_id=chat_id,
+            role=Role.USER,
+            text=f"Сообщение {i}",
+            created_at=created_at + timedelta(seconds=i // 7),
+        )
+        for i in range(9)
+    ]
+    async with queries.sessionmaker() as session:
+        session.add_all(models)
+        await session.commit()
+    expected = [model.id for model in sorted(models, key=lambda m: (m.created_at, m.id))]
+
+    ids, cursor = [], None
+    while True:
+        page = await read_chat_history_page(chat_id, limit=3, cursor=cursor)
+        ids.extend(message.id for message in page.messages)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+
+    assert ids == expected
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "WyIyMDI2LTAxLTAxIl0="])
+async def test_malformed_cursor_is_rejected(cursor: str) -> None:
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        await read_chat_history_page(uuid4(), limit=3, cursor=cursor)
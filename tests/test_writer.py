@@ -0,0 +1,127 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from fastapi_rag.database import writer
+from fastapi_rag.database.queries import persist_messages, read_message
+from fastapi_rag.database.writer import MessageWriter
+from fastapi_rag.exceptions import PersistingError
+from fastapi_rag.schemas import Message, Role
+
+pytestmark = [pytest.mark.anyio, pytest.mark.usefixtures("database")]
+
+
+class RecordingPersist:
+    """Обёртка над persist_messages, записывающая сохраняемые пакеты.
+
+    :param failures: Количество первых вызовов, завершающихся ошибкой.
+    """
+
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.batches: list[list[Message]] = []
+        self.called = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, messages: list[Message]) -> None:
+        self.batches.append(messages)
+        self.called.set()
+        await self.release.wait()
+        if len(self.batches) <= self.failures:
+            raise PersistingError("Database is unavailable")
+        await persist_messages(messages)
+
+
+@pytest.fixture
+def persist(monkeypatch: pytest.MonkeyPatch) -> RecordingPersist:
+    persist = RecordingPersist()
+    monkeypatch.setattr(writer, "persist_messages", persist)
+    return persist
+
+
+def make_messages(count: int) -> list[Message]:
+    chat_id = uuid4()
+    return [Message(chat_id=chat_id, role=Role.USER, text=f"Сообщение {i}") for i in range(count)]
+
+
+async def assert_persisted(messages: list[Message]) -> None:
+    for message in messages:
+        assert await read_message(message.id) == message
+
+
+async def test_flushes_when_batch_is_full(persist: RecordingPersist) -> None:
+    message_writer = MessageWriter(max_batch_size=3, max_wait_ms=60_000)
+    messages = make_messages(3)
+
+    async with asyncio.timeout(1):
+        await asyncio.gather(*(message_writer.write([message]) for message in messages))
+
+    assert persist.batches == [messages]
+    await assert_persisted(messages)
+
+
+async def test_flushes_after_max_wait(persist: RecordingPersist) -> None:
+    message_writer = MessageWriter(max_batch_size=100, max_wait_ms=20)
+    messages = make_messages(2)
+
+    async with asyncio.timeout(1):
+        await message_writer.write(messages)
+
+    assert persist.batches == [messages]
+    await assert_persisted(messages)
+
+
+async def test_retries_failed_flush_with_backoff(persist: RecordingPersist) -> None:
+    persist.failures = 2
+    message_writer = MessageWriter(max_batch_size=1, max_retries=3, retry_backoff=0.05)
+    messages = make_messages(1)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    await message_writer.write(messages)
+
+    backoff = sum(message_writer.retry_backoff * 2 ** i for i in range(persist.failures))
+    assert loop.time() - start >= backoff
+    assert len(persist.batches) == persist.failures + 1
+    await assert_persisted(messages)
+
+
+async def test_raises_after_retries_are_exhausted(persist: RecordingPersist) -> None:
+    persist.failures = 3
+    message_writer = MessageWriter(max_batch_size=1, max_retries=2, retry_backoff=0.01)
+
+    with pytest.raises(PersistingError):
+        await message_writer.write(make_messages(1))
+
+    assert len(persist.batches) == message_writer.max_retries + 1
+
+
+async def test_close_flushes_pending_messages(persist: RecordingPersist) -> None:
+    message_writer = MessageWriter(max_batch_size=100, max_wait_ms=60_000)
+    messages = make_messages(2)
+    writing = asyncio.create_task(message_writer.write(messages))
+    await asyncio.sleep(0)
+
+    async with asyncio.timeout(1):
+        await message_writer.close()
+        await writing
+
+    assert persist.batches == [messages]
+    await assert_persisted(messages)
+
+
+async def test_write_returns_after_batch_is_committed(persist: RecordingPersist) -> None:
+    persist.release.clear()
+    message_writer = MessageWriter(max_batch_size=1)
+    messages = make_messages(1)
+
+    writing = asyncio.create_task(message_writer.write(messages))
+    await persist.called.wait()
+    assert not writing.done()
+    assert await read_message(messages[0].id) is None
+
+    persist.release.set()
+    await writing
+    await assert_persisted(messages)
@@ -0,0 +1,9 @@
+import asyncio
+import logging
+
+from fastapi_rag.broker import app
+from fastapi_rag.tracing import configure_logging
+
+if __name__ == "__main__":
+    configure_logging(logging.INFO)
+    asyncio.run(app.run())